@@ -0,0 +1,212 @@
+import mmap
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from bit_timing import AUTO_BAUD_RECORDS, BIT_DURATION, SAMPLE_OFFSET, estimate_timing
+from capture import CaptureFile
+from decoder import CANDecoder, RECORD_DTYPE, RECORD_SIZE, TIMESTAMP_LIMIT, record_starts
+from timeline import TickCounter
+
+FILE_CHUNK = 1 << 16
+MIN_SHARD_RECORDS = 1 << 16
+SHARDS_PER_JOB = 4
+SEARCH_RECORDS = 1 << 14  # how far past the even split a shard boundary is looked for
+BASE_RECORDS = 1 << 20  # records read at a time to find the tick base of every shard
+IDLE_SPLIT_BITS = 11  # recessive bits before a frame start a continuous capture is split at
+
+
+def split_points(states, timestamps):
+    # records the decoder is certain to start a new capture at: the level changes, the
+    # tick counter goes back from the last kept record and nothing in between ran past the
+    # capture window. everything before such a record is dropped by the decoder, so the
+    # records from there on decode the same on their own
+    states = states.astype(np.int64)
+    timestamps = timestamps.astype(np.int64)
+    n = len(states)
+    if n < 3:
+        return np.empty(0, dtype=np.intp)
+
+    kept = np.zeros(n, dtype=bool)
+    kept[1:] = states[1:] != states[:-1]
+    in_window = timestamps <= TIMESTAMP_LIMIT
+
+    # last kept record before each one and the records past the window up to it
+    last_kept = np.maximum.accumulate(np.where(kept & in_window, np.arange(n), -1))
+    prev = np.empty(n, dtype=np.int64)
+    prev[0] = -1
+    prev[1:] = last_kept[:-1]
+    overflow = np.concatenate(([0], np.cumsum(~in_window)))
+
+    has_prev = prev >= 1
+    safe_prev = np.where(has_prev, prev, 1)
+    clean = overflow[:n] == overflow[safe_prev - 1]
+    rollback = timestamps < timestamps[safe_prev]
+    return np.flatnonzero(kept & has_prev & clean & rollback)
+
+
+def idle_points(states, timestamps, bit_duration=BIT_DURATION):
+    # records of a continuous capture that start a frame after the bus was recessive for
+    # IDLE_SPLIT_BITS or more. the frame before is over, EOF and intermission included, and
+    # stuffing starts over, so the records from the frame start on decode the same on their
+    # own. a gap with an analyzer reset in it is never split at
+    states = states.astype(np.int64)
+    n = len(states)
+    if n < 3:
+        return np.empty(0, dtype=np.intp)
+
+    ticks, resets = TickCounter().extend(timestamps)
+    edge = np.flatnonzero(states[1:] != states[:-1]) + 1
+    rise, fall = edge[:-1], edge[1:]
+    reset_count = np.zeros(n + 1, dtype=np.int64)
+    reset_count[resets + 1] = 1
+    reset_count = np.cumsum(reset_count)
+
+    idle = (states[rise] == 1) & (ticks[fall] - ticks[rise] >= IDLE_SPLIT_BITS * bit_duration) & \
+        (reset_count[fall + 1] == reset_count[rise + 1])
+    return fall[idle]
+
+
+class ShardedCapture:
+    # a capture file mapped read only, records can be picked out by index without loading
+    # the whole file. raw analyzer dumps are scanned for their records once
+    def __init__(self, path):
+        self.path = path
+        if path.endswith('.cancap'):
+            self._capture = CaptureFile(path)
+            self._starts = None
+            self.count = len(self._capture)
+        else:
+            self._capture = None
+            self._file = open(path, 'rb')
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(path) else b''
+            self._buf = np.frombuffer(self._mm, dtype=np.uint8)
+            self._starts = record_starts(self._buf)
+            self.count = len(self._starts)
+
+    def records(self, start, stop):
+        if self._capture is not None:
+            return self._capture.records[start:stop]
+        starts = self._starts[start:stop]
+        return self._buf[starts[:, None] + np.arange(RECORD_SIZE)].view(RECORD_DTYPE).reshape(-1)
+
+    def byte_offset(self, record):
+        if self._capture is not None:
+            return self._capture.header_size + record * RECORD_SIZE
+        if record >= self.count:
+            return len(self._buf)
+        return int(self._starts[record])
+
+    def shard_bounds(self, shards, continuous=False, bit_duration=BIT_DURATION):
+        # record index of every shard start plus the end, each start is a split point: a
+        # window start, or a frame start after a long idle level in a continuous capture
+        bounds = [0]
+        for i in range(1, shards):
+            target = max(self.count * i // shards, bounds[-1] + 1)
+            records = self.records(target - 1, min(target + SEARCH_RECORDS, self.count))
+            if continuous:
+                points = idle_points(records['state'], records['timestamp'], bit_duration)
+            else:
+                points = split_points(records['state'], records['timestamp'])
+            if len(points):
+                bounds.append(target - 1 + int(points[0]))
+        bounds.append(self.count)
+        return bounds
+
+    def tick_bases(self, bounds, continuous=False):
+        # (tick base, last raw tick) before every record in bounds, so shards are stamped
+        # on the same timeline a single decoder puts the frames on
+        bases = []
+        base, last = 0, None
+        counter = TickCounter()
+        pos = 0
+        for bound in bounds:
+            while pos < bound:
+                stop = min(pos + BASE_RECORDS, bound)
+                ticks = self.records(pos, stop)['timestamp'].astype(np.int64)
+                if continuous:
+                    counter.extend(ticks)
+                    base, last = counter.base, counter.last
+                else:
+                    prev = np.empty_like(ticks)
+                    prev[0] = ticks[0] if last is None else last
+                    prev[1:] = ticks[:-1]
+                    base += int(prev[ticks < prev].sum())
+                    last = int(ticks[-1])
+                pos = stop
+            bases.append((base, last))
+        return bases
+
+    def close(self):
+        if self._capture is not None:
+            self._capture.close()
+            return
+        self._buf = None
+        self._starts = None
+        if isinstance(self._mm, mmap.mmap):
+            self._mm.close()
+        self._file.close()
+
+
+def estimate_file_timing(path):
+    # (bit_duration, offset) estimated from the first records of a file, or None
+    capture = ShardedCapture(path)
+    try:
+        records = capture.records(0, min(AUTO_BAUD_RECORDS, capture.count))
+        return estimate_timing(records['state'], records['timestamp'])
+    finally:
+        capture.close()
+
+
+def decode_shard(path, start, stop, bit_duration=BIT_DURATION, offset=SAMPLE_OFFSET, first=(0, 0, None),
+                 continuous=False, until=None):
+    # frames of bytes [start, stop) of a file, runs in a pool process. first is the record
+    # index, tick base and last tick the shard starts at. frames from record until on are
+    # left to the next shard, the records up to it only end the levels before it
+    decoder = CANDecoder(bit_duration, offset, continuous=continuous)
+    decoder.start_at(*first)
+    frames = []
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        for pos in range(start, stop, FILE_CHUNK):
+            frames.extend(decoder.feed(mm[pos:min(pos + FILE_CHUNK, stop)]))
+    frames.extend(decoder.flush())
+    if until is not None:
+        frames = [frame for frame in frames if frame.record is None or frame.record < until]
+    return frames
+
+
+def decode_file(path, jobs=None, bit_duration=BIT_DURATION, offset=SAMPLE_OFFSET, continuous=False):
+    # yields the frames of a capture shard by shard in capture order, the shards are decoded
+    # in parallel. the frames are the ones a single decoder fed the whole file returns
+    jobs = jobs or os.cpu_count() or 1
+    capture = ShardedCapture(path)
+    try:
+        shards = max(1, min(jobs * SHARDS_PER_JOB, capture.count // MIN_SHARD_RECORDS))
+        bounds = capture.shard_bounds(shards, continuous, bit_duration)
+        bases = capture.tick_bases(bounds[:-1], continuous)
+        ranges = []
+        for a, b, base in zip(bounds[:-1], bounds[1:], bases):
+            if a >= b:
+                continue
+            # a continuous shard also gets the frame start after it, which ends its idle level
+            # the way it ends in a single decoder
+            until = b if continuous and b < capture.count else None
+            stop = capture.byte_offset(b + 1 if until is not None else b)
+            ranges.append((capture.byte_offset(a), stop, (a,) + base, until))
+    finally:
+        capture.close()
+
+    if len(ranges) <= 1 or jobs == 1:
+        for start, stop, first, until in ranges:
+            yield decode_shard(path, start, stop, bit_duration, offset, first, continuous, until)
+        return
+
+    executor = ProcessPoolExecutor(jobs)
+    try:
+        futures = [executor.submit(decode_shard, path, start, stop, bit_duration, offset, first, continuous, until)
+                   for start, stop, first, until in ranges]
+        for future in futures:
+            yield future.result()
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
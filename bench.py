@@ -0,0 +1,287 @@
+import argparse
+import json
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from decoder import CANDecoder, RecordStream, find_records
+from traffic import TrafficGenerator, frame_bits
+from trigger import HeaderScan, TriggerEngine, parse_condition
+
+CHUNK = 1 << 16
+DRAW_WINDOWS = 300  # draw_frame is timed on the first windows only
+THRESHOLDS = 'bench_thresholds.json'
+TRIGGERS = ('id=0x7fc/0x7fc', 'error')  # conditions a few of the generated frames match
+
+# measured values are checked against the threshold file with these margins on --update
+MIN_MARGIN = 0.5
+MAX_MARGIN = 1.5
+
+
+class Checked:
+    # checkbox that is always on, all labels are drawn
+    def get(self):
+        return True
+
+
+class BenchApp:
+    def __init__(self):
+        for name in ('bit_chkbox', 'hex_chkbox', 'hili_chkbox', 'text_chkbox', 'frametype_chkbox'):
+            setattr(self, name, Checked())
+
+    def enable_all_checkboxes(self):
+        pass
+
+
+class Workload:
+    # one generated capture and the input every stage starts from
+    def __init__(self, frames, bus_load, seed):
+        generator = TrafficGenerator(bus_load, seed)
+        self.frames = generator.frames(frames)
+        self.data = generator.stream(self.frames)
+        self.windows = generator.windows
+
+        self.wire_bits = []
+        self.unstuffed_bits = []
+        for can_id, extended, rtr, dlc, data in self.frames:
+            self.wire_bits += frame_bits(can_id, data, extended, rtr, dlc)
+            self.unstuffed_bits += frame_bits(can_id, data, extended, rtr, dlc, stuffed=False)
+
+        # every level as a (start, end) pair on one timeline
+        records, _ = find_records(self.data)
+        ticks = records['timestamp'].astype(np.int64)
+        window_start = np.concatenate(([0], np.flatnonzero(ticks[1:] < ticks[:-1]) + 1))
+        base = np.zeros(len(ticks), dtype=np.int64)
+        base[window_start[1:]] = ticks[window_start[1:] - 1]
+        edges = ticks + np.cumsum(base)
+        self.timestamp_data = np.repeat(edges, 2)[1:-1].tolist()
+
+        # analyzer bytes of every window, for redrawing one window at a time
+        bounds = (window_start * records.itemsize).tolist() + [len(self.data)]
+        self.window_data = [self.data[a:b] for a, b in zip(bounds[:-1], bounds[1:])]
+        self._draw_input = None
+
+    def draw_input(self):
+        # a plotter on an offscreen figure and the decoder state of the first windows, every
+        # redraw starts from one of them
+        if self._draw_input is None:
+            import matplotlib
+            matplotlib.use('Agg')
+            from matplotlib.backends.backend_agg import FigureCanvasAgg
+            from matplotlib.figure import Figure
+            from plotter import Plotter
+
+            plotter = Plotter(BenchApp())
+            figure = Figure(figsize=(16, 5))
+            FigureCanvasAgg(figure)
+            plotter.ax = figure.add_subplot()
+
+            states = []
+            for data in self.window_data[:DRAW_WINDOWS]:
+                plotter.decoder.reset_data()
+                plotter.decoder.feed(data)
+                plotter.decoder.flush()
+                states.append(plotter.decoder.snapshot())
+            self._draw_input = plotter, states
+        return self._draw_input
+
+
+def stage_find_records(work):
+    for pos in range(0, len(work.data), CHUNK):
+        find_records(work.data[pos:pos + CHUNK])
+
+
+def stage_decode_8byte_data(work):
+    decoder = CANDecoder()
+    for pos in range(0, len(work.data), CHUNK):
+        decoder.decode_8byte_data(work.data[pos:pos + CHUNK])
+
+
+def stage_remove_stuff_bits(work):
+    CANDecoder().remove_stuff_bits(work.wire_bits)
+
+
+def stage_decode_frame_type(work):
+    frames = CANDecoder().decode_frame_type(work.unstuffed_bits)
+    assert len(frames) == len(work.frames)
+
+
+def stage_retrive_bit_timestamp(work):
+    CANDecoder().retrive_bit_timestamp(work.timestamp_data)
+
+
+def stage_feed(work):
+    decoder = CANDecoder()
+    frames = []
+    for pos in range(0, len(work.data), CHUNK):
+        frames += decoder.feed(work.data[pos:pos + CHUNK])
+    frames += decoder.flush()
+    assert len(frames) == len(work.frames)
+
+
+def stage_trigger_scan(work):
+    scan = HeaderScan(CANDecoder().bit_duration, CANDecoder().offset)
+    stream = RecordStream()
+    conditions = [parse_condition(text) for text in TRIGGERS]
+    seen = 0
+    for pos in range(0, len(work.data), CHUNK):
+        records = stream.feed(work.data[pos:pos + CHUNK])
+        scan.scan(records, seen, conditions)
+        seen += len(records)
+
+
+def stage_trigger_feed(work):
+    # the whole capture through the trigger engine, only the windows around triggers are decoded
+    engine = TriggerEngine([parse_condition(text) for text in TRIGGERS], CANDecoder())
+    for pos in range(0, len(work.data), CHUNK):
+        engine.feed(work.data[pos:pos + CHUNK])
+    engine.flush()
+
+
+def stage_draw_frame(work):
+    plotter, states = work.draw_input()
+    for state in states:
+        plotter.decoder.load_snapshot(state)
+        plotter.draw_frame()
+
+
+# name: (function, bytes of input, frames of input)
+STAGES = {
+    'find_records': (stage_find_records, lambda w: len(w.data), lambda w: len(w.frames)),
+    'decode_8byte_data': (stage_decode_8byte_data, lambda w: len(w.data), lambda w: len(w.frames)),
+    'remove_stuff_bits': (stage_remove_stuff_bits, None, lambda w: len(w.frames)),
+    'decode_frame_type': (stage_decode_frame_type, None, lambda w: len(w.frames)),
+    'retrive_bit_timestamp': (stage_retrive_bit_timestamp, None, lambda w: len(w.frames)),
+    'feed': (stage_feed, lambda w: len(w.data), lambda w: len(w.frames)),
+    'trigger_scan': (stage_trigger_scan, lambda w: len(w.data), lambda w: len(w.frames)),
+    'trigger_feed': (stage_trigger_feed, lambda w: len(w.data), lambda w: len(w.frames)),
+    'draw_frame': (stage_draw_frame, lambda w: sum(len(d) for d in w.window_data[:DRAW_WINDOWS]),
+                   lambda w: sum(len(state['frames']) for state in w.draw_input()[1])),
+}
+
+
+def measure(work, name, repeat):
+    function, size, count = STAGES[name]
+
+    # the first run fills caches and builds lazy input, it isn't timed
+    function(work)
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(work)
+        best = min(best, time.perf_counter() - start)
+
+    # one more run for the memory it allocates at its peak
+    tracemalloc.start()
+    function(work)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = {'seconds': best, 'frames_s': count(work) / best, 'peak_kib': peak / 1024}
+    if size is not None:
+        result['mb_s'] = size(work) / best / 1e6
+    return result
+
+
+def check(results, thresholds):
+    # stages that got slower or use more memory than the threshold file allows
+    failures = []
+    for name, limits in thresholds.get('stages', {}).items():
+        result = results.get(name)
+        if result is None:
+            continue
+        for key, limit in limits.items():
+            kind, metric = key.split('_', 1)
+            value = result.get(metric)
+            if value is None:
+                continue
+            if (kind == 'min' and value < limit) or (kind == 'max' and value > limit):
+                failures.append(f"{name}: {metric} {value:.1f}, {kind} {limit:.1f}")
+    return failures
+
+
+def thresholds_from(results, args):
+    stages = {}
+    for name, result in results.items():
+        limits = {'min_frames_s': round(result['frames_s'] * MIN_MARGIN, 1),
+                  'max_peak_kib': round(result['peak_kib'] * MAX_MARGIN, 1)}
+        if 'mb_s' in result:
+            limits['min_mb_s'] = round(result['mb_s'] * MIN_MARGIN, 3)
+        stages[name] = limits
+    return {'frames': args.frames, 'load': args.load, 'seed': args.seed, 'stages': stages}
+
+
+def report(results):
+    lines = [f"{'stage':<24}{'frames/s':>12}{'MB/s':>10}{'peak KiB':>12}{'seconds':>10}"]
+    for name, result in results.items():
+        mb_s = f"{result['mb_s']:.2f}" if 'mb_s' in result else '-'
+        lines.append(f"{name:<24}{result['frames_s']:>12.0f}{mb_s:>10}{result['peak_kib']:>12.0f}"
+                     f"{result['seconds']:>10.3f}")
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Throughput and memory of every decoding stage")
+    parser.add_argument('stages', nargs='*', help=f"stages to run, all if omitted: {', '.join(STAGES)}")
+    parser.add_argument('--frames', type=int, help="frames to generate, from the threshold file if omitted")
+    parser.add_argument('--load', type=float, help="bus load of the generated traffic")
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--repeat', type=int, default=3, help="best of this many runs")
+    parser.add_argument('--thresholds', default=THRESHOLDS)
+    parser.add_argument('--update', action='store_true', help="write the thresholds from this run")
+    parser.add_argument('--output', help="also write the report to this file")
+    parser.add_argument('--history', help="append the results as a JSON line to this file")
+    args = parser.parse_args(argv)
+
+    try:
+        with open(args.thresholds) as f:
+            thresholds = json.load(f)
+    except FileNotFoundError:
+        thresholds = {}
+
+    # the workload the thresholds were taken with, unless asked otherwise
+    args.frames = args.frames or thresholds.get('frames', 10000)
+    args.load = args.load or thresholds.get('load', 0.5)
+    args.seed = args.seed if args.seed is not None else thresholds.get('seed', 0)
+
+    for name in args.stages:
+        if name not in STAGES:
+            parser.error(f"unknown stage {name}")
+
+    work = Workload(args.frames, args.load, args.seed)
+    results = {name: measure(work, name, args.repeat) for name in args.stages or STAGES}
+
+    text = (f"{args.frames} frames, {work.windows} windows, {len(work.data)} bytes, "
+            f"bus load {args.load}\n{report(results)}")
+    print(text)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    if args.history:
+        with open(args.history, 'a') as f:
+            f.write(json.dumps({'time': time.time(), 'frames': args.frames, 'load': args.load,
+                                'seed': args.seed, 'results': results}) + '\n')
+
+    if args.update:
+        if args.stages:
+            parser.error("--update needs every stage")
+        with open(args.thresholds, 'w') as f:
+            json.dump(thresholds_from(results, args), f, indent=2)
+            f.write('\n')
+        print(f"Thresholds written to {args.thresholds}")
+        return 0
+
+    if (args.frames, args.load, args.seed) != (thresholds.get('frames'), thresholds.get('load'), thresholds.get('seed')):
+        print("Not checked, the thresholds were taken with another workload")
+        return 0
+
+    failures = check(results, thresholds)
+    for failure in failures:
+        print(f"REGRESSION {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
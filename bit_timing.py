@@ -0,0 +1,69 @@
+import numpy as np
+
+TICK_RATE = 10_000_000  # analyzer ticks per second, 0.1 us/tick
+BIT_RATE = 500_000
+BIT_DURATION = 20  # ticks per bit at BIT_RATE
+SAMPLE_OFFSET = 8  # ticks a level has to run into a bit period for that bit to count
+
+# classic CAN rates and the usual CAN FD data phase rates
+BIT_RATES = (10_000, 20_000, 50_000, 83_333, 100_000, 125_000, 250_000, 500_000, 800_000, 1_000_000,
+             2_000_000, 4_000_000, 5_000_000, 8_000_000)
+
+AUTO_BAUD_RECORDS = 4096  # records the bit time is estimated from
+MIN_INTERVALS = 32
+MAX_RUN_BITS = 11  # longer levels are idle, they don't refine the estimate
+SNAP_TOLERANCE = 0.02  # an estimate this close to a listed rate is taken as that rate
+JITTER_PERCENTILE = 99
+
+
+def ticks(value):
+    # whole tick counts stay ints so the default timing decodes exactly as before
+    value = float(value)
+    return int(value) if value.is_integer() else value
+
+
+def timing_for(bit_rate, sample_point=SAMPLE_OFFSET / BIT_DURATION, tick_rate=TICK_RATE):
+    # (bit_duration, offset) in ticks for a bit rate
+    bit_duration = tick_rate / bit_rate
+    return ticks(bit_duration), ticks(round(sample_point * bit_duration, 1))
+
+
+def describe(bit_duration, offset, tick_rate=TICK_RATE):
+    return f"{tick_rate / bit_duration:.0f} bit/s, {bit_duration:g} ticks per bit, sample point {offset / bit_duration:.0%}"
+
+
+def estimate_timing(states, timestamps, tick_rate=TICK_RATE):
+    # (bit_duration, offset) from the edge to edge intervals of some records, None if
+    # there are too few edges. every interval is a whole number of bits, the most common
+    # one is a single bit and all short intervals together refine it
+    states = np.asarray(states, dtype=np.int64)
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    if len(states) < 2:
+        return None
+
+    edges = timestamps[np.concatenate(([0], np.flatnonzero(np.diff(states)) + 1))]
+    intervals = np.diff(edges)
+    longest = MAX_RUN_BITS * tick_rate // min(BIT_RATES)
+    intervals = intervals[(intervals > 0) & (intervals <= longest)]
+    if len(intervals) < MIN_INTERVALS:
+        return None
+
+    # levels of one bit are the most common, their mean is a first estimate
+    peak = max(int(np.argmax(np.bincount(intervals))), 1)
+    bit_duration = intervals[(intervals >= peak / 2) & (intervals <= peak * 3 / 2)].mean()
+
+    bits = np.round(intervals / bit_duration)
+    used = (bits >= 1) & (bits <= MAX_RUN_BITS)
+    bit_duration = intervals[used].sum() / bits[used].sum()
+
+    bit_rate = tick_rate / bit_duration
+    nearest = min(BIT_RATES, key=lambda rate: abs(rate - bit_rate))
+    if abs(nearest - bit_rate) <= SNAP_TOLERANCE * nearest:
+        bit_duration = tick_rate / nearest
+
+    # the sample offset has to clear the jitter on both sides of a bit boundary, the
+    # default sample point is kept where it does
+    jitter = np.percentile(np.abs(intervals[used] - bits[used] * bit_duration), JITTER_PERCENTILE)
+    offset = SAMPLE_OFFSET / BIT_DURATION * bit_duration
+    offset = min(max(offset, jitter), max(bit_duration - jitter, bit_duration / 2))
+    return ticks(round(bit_duration, 3)), ticks(round(offset, 1))
@@ -0,0 +1,208 @@
+from functools import lru_cache
+
+import numpy as np
+
+from perf import timed
+
+# header layouts (name, length) from SOF up to the DLC
+STANDARD_HEADER = (('SOF', 1), ('ID', 11), ('RTR', 1), ('IDE', 1), ('r0', 1))
+EXTENDED_HEADER = (('SOF', 1), ('BASE ID', 11), ('SRR', 1), ('IDE', 1), ('EXT ID', 18),
+                   ('RTR', 1), ('r0', 1), ('r1', 1))
+TRAILER = (('CRC', 15), ('CD', 1), ('ACK', 1), ('AD', 1), ('EOF', 7), ('IFS', 3))
+
+CRC15_POLY = 0x4599
+
+IDE_OFFSET = 13
+STANDARD_RTR_OFFSET = 12
+EXTENDED_RTR_OFFSET = 32
+
+
+@lru_cache(maxsize=None)
+def frame_layout(extended, rtr, dlc):
+    # (name, offset, length) of every field, shared by all frames of the same shape
+    parts = list(EXTENDED_HEADER if extended else STANDARD_HEADER)
+    parts.append(('DLC', 4))
+    if not rtr:
+        parts.extend((f'Data{i}', 8) for i in range(min(dlc, 8)))
+    parts.extend(TRAILER)
+
+    fields = []
+    offset = 0
+    for name, length in parts:
+        fields.append((name, offset, length))
+        offset += length
+    return tuple(fields)
+
+
+def _crc15_table():
+    table = []
+    for byte in range(256):
+        crc = byte << 7
+        for _ in range(8):
+            crc = (crc << 1) ^ CRC15_POLY if crc & 0x4000 else crc << 1
+        table.append(crc & 0x7FFF)
+    return tuple(table)
+
+
+CRC15_TABLE = _crc15_table()
+
+
+def crc15(bits):
+    # CAN CRC-15 over a bit sequence, a byte at a time. the register starts at zero, so
+    # leading zero bits that fill up the first byte leave it unchanged
+    pad = -len(bits) % 8
+    packed = np.packbits(np.concatenate((np.zeros(pad, dtype=np.uint8), np.asarray(bits, dtype=np.uint8))))
+
+    crc = 0
+    for byte in packed.tolist():
+        crc = ((crc << 8) ^ CRC15_TABLE[((crc >> 7) ^ byte) & 0xFF]) & 0x7FFF
+    return crc
+
+
+def bits_to_int(bits, start, length):
+    value = 0
+    for bit in bits[start:start + length]:
+        value = (value << 1) | bit
+    return value
+
+
+class CANFrame:
+    __slots__ = ('can_id', 'extended', 'rtr', 'dlc', 'data', 'crc',
+                 'start_bit', 'fields', 'start_time', 'end_time',
+                 'crc_ok', 'stuff_error', 'form_error', 'ack_error', 'record')
+
+    def __init__(self, can_id, extended, rtr, dlc, data, crc, start_bit, fields,
+                 start_time=0.0, end_time=0.0, crc_ok=True, stuff_error=False,
+                 form_error=False, ack_error=False, record=None):
+        self.can_id = can_id
+        self.extended = extended
+        self.rtr = rtr
+        self.dlc = dlc
+        self.data = data
+        self.crc = crc
+        self.start_bit = start_bit
+        self.fields = fields
+        self.start_time = start_time
+        self.end_time = end_time
+        self.crc_ok = crc_ok
+        self.stuff_error = stuff_error
+        self.form_error = form_error
+        self.ack_error = ack_error
+        self.record = record  # raw record of the first edge, to decode the frame again
+
+    @property
+    def errors(self):
+        errors = []
+        if not self.crc_ok:
+            errors.append('CRC')
+        if self.stuff_error:
+            errors.append('stuff')
+        if self.form_error:
+            errors.append('form')
+        if self.ack_error:
+            errors.append('ACK')
+        return errors
+
+    @property
+    def error(self):
+        return not self.crc_ok or self.stuff_error or self.form_error or self.ack_error
+
+    @property
+    def frame_type(self):
+        return 'Extended' if self.extended else 'Standard'
+
+    @property
+    def frame_subtype(self):
+        return 'Remote' if self.rtr else 'Data'
+
+    @property
+    def bit_length(self):
+        name, offset, length = self.fields[-1]
+        return offset + length
+
+    @property
+    def end_bit(self):
+        return self.start_bit + self.bit_length
+
+    def field_span(self, name):
+        # absolute (start, end) of a field in the destuffed bitstream
+        for part, offset, length in self.fields:
+            if part == name:
+                return self.start_bit + offset, self.start_bit + offset + length
+        raise KeyError(name)
+
+    def field_value(self, name):
+        if name == 'ID':
+            return self.can_id
+        if name == 'BASE ID':
+            return self.can_id >> 18
+        if name == 'EXT ID':
+            return self.can_id & 0x3FFFF
+        if name == 'DLC':
+            return self.dlc
+        if name == 'CRC':
+            return self.crc
+        if name.startswith('Data'):
+            return self.data[int(name[4:])]
+        raise KeyError(name)
+
+    def to_dict(self):
+        return {'start_time': self.start_time,
+                'end_time': self.end_time,
+                'id': self.can_id,
+                'extended': self.extended,
+                'rtr': self.rtr,
+                'dlc': self.dlc,
+                'data': self.data.hex(),
+                'crc': self.crc,
+                'crc_ok': self.crc_ok,
+                'errors': self.errors}
+
+    def __repr__(self):
+        errors = f", errors={'/'.join(self.errors)}" if self.error else ""
+        return (f"CANFrame(id=0x{self.can_id:X}, {self.frame_type} {self.frame_subtype}, "
+                f"dlc={self.dlc}, data={self.data.hex()}, crc=0x{self.crc:04X}{errors})")
+
+
+@timed('parse_frame')
+def parse_frame(bits, idx):
+    # decode one frame starting at the SOF at idx, raises IndexError until every bit
+    # up to the end of IFS is available
+    if idx + IDE_OFFSET >= len(bits):
+        raise IndexError("frame incomplete")
+
+    extended = bits[idx + IDE_OFFSET] == 1
+    dlc_offset = 35 if extended else 15
+    if idx + dlc_offset + 4 > len(bits):
+        raise IndexError("frame incomplete")
+
+    rtr = bits[idx + (EXTENDED_RTR_OFFSET if extended else STANDARD_RTR_OFFSET)] == 1
+    dlc = bits_to_int(bits, idx + dlc_offset, 4)
+    fields = frame_layout(extended, rtr, dlc)
+
+    name, offset, length = fields[-1]
+    if idx + offset + length > len(bits):
+        raise IndexError("frame incomplete")
+
+    if extended:
+        can_id = (bits_to_int(bits, idx + 1, 11) << 18) | bits_to_int(bits, idx + 14, 18)
+    else:
+        can_id = bits_to_int(bits, idx + 1, 11)
+
+    data_start = idx + dlc_offset + 4
+    n_data = 0 if rtr else min(dlc, 8)
+    data = bytes(bits_to_int(bits, data_start + 8 * i, 8) for i in range(n_data))
+    crc_offset = fields[-len(TRAILER)][1]
+    crc = bits_to_int(bits, idx + crc_offset, 15)
+    crc_ok = crc15(bits[idx:idx + crc_offset]) == crc
+
+    # CRC delimiter, ACK delimiter and EOF are fixed recessive, the ACK slot is driven
+    # dominant by every receiver that got the frame
+    cd, ack, ad = bits[idx + crc_offset + 15:idx + crc_offset + 18]
+    eof = bits[idx + crc_offset + 18:idx + crc_offset + 25]
+    form_error = cd != 1 or ad != 1 or 0 in eof
+    ack_error = ack != 0
+
+    frame = CANFrame(can_id, extended, rtr, dlc, data, crc, idx, fields,
+                     crc_ok=crc_ok, form_error=form_error, ack_error=ack_error)
+    return frame, idx + offset + length
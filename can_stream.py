@@ -0,0 +1,77 @@
+import asyncio
+from collections import deque
+
+from decoder import CANDecoder
+from serial_reader import SerialReader
+
+POLL_INTERVAL = 0.005  # used where the event loop can't watch the port's file descriptor
+
+
+class CANStream:
+    # async iterator of decoded frames. the port is only read while the consumer waits for
+    # the next frame, so a slow consumer leaves the data in the OS buffer and the reader's
+    # ring buffer instead of piling up decoded frames
+    def __init__(self, port, baudrate=1152000, decoder=None, **reader_args):
+        self.reader = SerialReader(port, baudrate, timeout=0, threaded=False, **reader_args)
+        self.decoder = decoder or CANDecoder()
+        self._frames = deque()
+        self._closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self._frames:
+            if self._closed:
+                raise StopAsyncIteration
+
+            await self._wait_readable()
+            if self._closed:
+                break
+
+            self.reader.poll()
+            data = self.reader.read_data()
+            if data:
+                self._frames.extend(self.decoder.feed(data))
+
+        if not self._frames:
+            self._frames.extend(self.decoder.flush())
+            if not self._frames:
+                raise StopAsyncIteration
+
+        return self._frames.popleft()
+
+    async def _wait_readable(self):
+        loop = asyncio.get_running_loop()
+        readable = loop.create_future()
+
+        def on_readable():
+            if not readable.done():
+                readable.set_result(None)
+
+        try:
+            loop.add_reader(self.reader.fileno(), on_readable)
+        except (NotImplementedError, AttributeError, ValueError):
+            await asyncio.sleep(POLL_INTERVAL)
+            return
+
+        try:
+            await readable
+        finally:
+            loop.remove_reader(self.reader.fileno())
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self.reader.disconnect()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def open_can_stream(port, baudrate=1152000, **kwargs):
+    # async for frame in open_can_stream(port, baudrate): ...
+    return CANStream(port, baudrate, **kwargs)
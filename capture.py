@@ -0,0 +1,203 @@
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+
+import numpy as np
+
+from bit_timing import BIT_DURATION, SAMPLE_OFFSET, TICK_RATE, ticks
+from decoder import RECORD_DTYPE, RECORD_SIZE, RecordStream
+
+# file: 64 byte header followed by the raw 8 byte analyzer records
+MAGIC = b'CANCAP01'
+VERSION = 2
+HEADER = struct.Struct('<8sHHIddQ')
+HEADER_V1 = struct.Struct('<8sHHIHHQ')  # timing in whole ticks
+HEADER_SIZE = 64
+
+# sidecar <file>.idx: one entry per written chunk, split where the tick counter goes back
+INDEX_MAGIC = b'CANIDX01'
+INDEX_HEADER = struct.Struct('<8sQ')
+INDEX_DTYPE = np.dtype([('record', '<u8'),      # first record of the entry
+                        ('count', '<u4'),       # records in the entry
+                        ('tick_base', '<i8'),   # added to the raw timestamps of the entry
+                        ('first_tick', '<i8'),  # tick_base + first raw timestamp
+                        ('host_time', '<f8')])  # arrival time of the chunk, seconds
+
+
+def index_path(path):
+    return path + '.idx'
+
+
+class CaptureWriter:
+    # writes on its own thread so saving never blocks the caller
+    def __init__(self, path, bit_duration=BIT_DURATION, offset=SAMPLE_OFFSET, tick_rate=TICK_RATE):
+        self.path = path
+        self.bit_duration = bit_duration
+        self.offset = offset
+        self.tick_rate = tick_rate
+
+        self.record_count = 0
+        self._index = []
+        self._records = RecordStream()
+        self._last_raw = None
+        self._tick_base = 0
+
+        self._file = open(path, 'wb')
+        self._file.write(self._header())
+        self._queue = queue.Queue()
+        self._thr = threading.Thread(target=self._loop, daemon=True)
+        self._thr.start()
+
+    def _header(self):
+        # the timing is kept in fractional ticks, 83.333 kbit/s is 120.0005 ticks per bit
+        header = HEADER.pack(MAGIC, VERSION, HEADER_SIZE, self.tick_rate, self.bit_duration, self.offset,
+                             self.record_count)
+        return header.ljust(HEADER_SIZE, b'\x00')
+
+    def write(self, chunk, host_time=None):
+        self._queue.put((time.time() if host_time is None else host_time, bytes(chunk)))
+
+    def close(self, wait=True):
+        self._queue.put(None)
+        if wait:
+            self._thr.join()
+
+    def _loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            try:
+                self._write_chunk(*item)
+            except Exception as e:
+                print(f"[CaptureWriter] write error: {e}")
+        self._finish()
+
+    def _write_chunk(self, host_time, chunk):
+        records = self._records.feed(chunk)
+        if not len(records):
+            return
+
+        self._file.write(memoryview(records).cast('B'))
+
+        # a timestamp going back starts a new entry that continues after the last tick
+        ticks = records['timestamp'].astype(np.int64)
+        starts = np.concatenate(([0], np.flatnonzero(ticks[1:] < ticks[:-1]) + 1))
+        rolls_back = self._last_raw is not None and ticks[0] < self._last_raw
+
+        for i, (a, b) in enumerate(zip(starts.tolist(), np.append(starts[1:], len(ticks)).tolist())):
+            if i > 0 or rolls_back:
+                self._tick_base += self._last_raw
+            self._index.append((self.record_count + a, b - a, self._tick_base,
+                                self._tick_base + int(ticks[a]), host_time))
+            self._last_raw = int(ticks[b - 1])
+
+        self.record_count += len(records)
+
+    def _finish(self):
+        self._file.seek(0)
+        self._file.write(self._header())
+        self._file.close()
+
+        index = np.array(self._index, dtype=INDEX_DTYPE)
+        with open(index_path(self.path), 'wb') as f:
+            f.write(INDEX_HEADER.pack(INDEX_MAGIC, len(index)))
+            f.write(index.tobytes())
+
+
+class CaptureFile:
+    # memory-mapped capture, records are read in place and never loaded as a whole
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version = struct.unpack_from('<8sH', self._mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a capture file")
+        if version > VERSION:
+            raise ValueError(f"{path} is capture version {version}, this reads up to {VERSION}")
+
+        header = HEADER if version >= 2 else HEADER_V1
+        _, _, header_size, self.tick_rate, bit_duration, offset, count = header.unpack_from(self._mm, 0)
+        self.bit_duration, self.offset = ticks(bit_duration), ticks(offset)
+
+        # a writer that never finished leaves the count at 0
+        if count == 0:
+            count = (len(self._mm) - header_size) // RECORD_SIZE
+        self.header_size = header_size
+        self.records = np.frombuffer(self._mm, dtype=RECORD_DTYPE, count=count, offset=header_size)
+        self.index = self._load_index(index_path(path))
+
+    def _load_index(self, path):
+        if not os.path.exists(path):
+            # no sidecar, one entry per run of non-decreasing timestamps
+            return self._build_index()
+
+        with open(path, 'rb') as f:
+            magic, count = INDEX_HEADER.unpack(f.read(INDEX_HEADER.size))
+            if magic != INDEX_MAGIC:
+                raise ValueError(f"{path} is not a capture index")
+            return np.fromfile(f, dtype=INDEX_DTYPE, count=count)
+
+    def _build_index(self):
+        ticks = self.records['timestamp'].astype(np.int64)
+        if not len(ticks):
+            return np.zeros(0, dtype=INDEX_DTYPE)
+
+        starts = np.concatenate(([0], np.flatnonzero(ticks[1:] < ticks[:-1]) + 1))
+        ends = np.append(starts[1:], len(ticks))
+        index = np.zeros(len(starts), dtype=INDEX_DTYPE)
+        index['record'] = starts
+        index['count'] = ends - starts
+        index['tick_base'] = np.concatenate(([0], np.cumsum(ticks[ends - 1])[:-1]))
+        index['first_tick'] = index['tick_base'] + ticks[starts]
+        return index
+
+    def __len__(self):
+        return len(self.records)
+
+    def close(self):
+        self.records = None
+        try:
+            self._mm.close()
+        except BufferError:
+            # views handed out by raw_bytes() are still alive, the map goes with them
+            pass
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def raw_bytes(self, start=0, stop=None):
+        # analyzer bytes of records [start, stop), a view into the file
+        stop = len(self.records) if stop is None else stop
+        return memoryview(self._mm)[self.header_size + start * RECORD_SIZE:self.header_size + stop * RECORD_SIZE]
+
+    def ticks(self, entry):
+        # monotonic ticks of one index entry
+        entry = self.index[entry]
+        record, count = int(entry['record']), int(entry['count'])
+        return int(entry['tick_base']) + self.records['timestamp'][record:record + count].astype(np.int64)
+
+    def seek(self, tick):
+        # first record at or after tick, O(log n)
+        entry = int(np.searchsorted(self.index['first_tick'], tick, side='right')) - 1
+        if entry < 0:
+            return 0
+
+        record, count = int(self.index['record'][entry]), int(self.index['count'][entry])
+        raw = self.records['timestamp'][record:record + count]
+        return record + int(np.searchsorted(raw, tick - int(self.index['tick_base'][entry])))
+
+    def chunks(self):
+        # (arrival time, raw bytes) in the order the chunks were captured
+        for entry in self.index:
+            record, count = int(entry['record']), int(entry['count'])
+            yield float(entry['host_time']), self.raw_bytes(record, record + count)
@@ -0,0 +1,250 @@
+import argparse
+import contextlib
+import csv
+import itertools
+import json
+import sys
+import time
+
+from bit_timing import BIT_DURATION, SAMPLE_OFFSET, TICK_RATE, describe, timing_for
+from decoder import CANDecoder
+from perf import instruments
+from trigger import POST_TICKS, PRE_TICKS, TriggerEngine, parse_condition
+
+FILE_CHUNK = 1 << 16
+INDEX_BATCH = 4096
+WAIT_TIMEOUT = 0.1
+
+CSV_FIELDS = ['start_time', 'end_time', 'id', 'extended', 'rtr', 'dlc', 'data', 'crc', 'crc_ok', 'errors']
+
+
+def parse_id(text):
+    return int(text, 0)
+
+
+def file_chunks(path):
+    if path.endswith('.cancap'):
+        from capture import CaptureFile
+
+        with CaptureFile(path) as capture:
+            for host_time, chunk in capture.chunks():
+                yield chunk
+        return
+
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(FILE_CHUNK)
+            if not chunk:
+                return
+            yield chunk
+
+
+def serial_chunks(port, baudrate, deadline, idle=False):
+    # with idle, an empty chunk after every wait that timed out, for idle triggers to fire on
+    from serial_reader import SerialReader
+
+    reader = SerialReader(port, baudrate)
+    try:
+        while deadline is None or time.monotonic() < deadline:
+            if reader.wait(WAIT_TIMEOUT):
+                instruments.gauge('backlog', reader.backlog)
+                instruments.gauge('dropped', reader.overrun_bytes)
+                yield reader.read_data()
+            elif reader.error is not None:
+                reader.read_data()  # raises the read error
+            elif idle:
+                yield b''
+    finally:
+        reader.disconnect()
+
+
+class FrameWriter:
+    def __init__(self, out, fmt):
+        self.out = out
+        self.fmt = fmt
+        self._csv = None
+        if fmt == 'csv':
+            self._csv = csv.DictWriter(out, fieldnames=CSV_FIELDS)
+            self._csv.writeheader()
+
+    def write(self, frame):
+        row = frame.to_dict()
+        if self._csv is not None:
+            row['id'] = f"0x{row['id']:X}"
+            row['errors'] = '|'.join(row['errors'])
+            self._csv.writerow(row)
+        else:
+            self.out.write(json.dumps(row) + '\n')
+
+
+def write_frames(batches, writer, ids=None, count=None, error=False):
+    written = 0
+    for frames in batches:
+        instruments.tick()
+        for frame in frames:
+            if ids and frame.can_id not in ids:
+                continue
+            if error and not (frame.errors if error is True else error in frame.errors):
+                continue
+            writer.write(frame)
+            written += 1
+            if count is not None and written >= count:
+                return written
+    return written
+
+
+def decoded_batches(chunks, decoder, deadline=None):
+    for chunk in chunks:
+        yield decoder.feed(chunk)
+        if deadline is not None and time.monotonic() >= deadline:
+            break
+    yield decoder.flush()
+
+
+def indexed_batches(batches, index):
+    for frames in batches:
+        index.add(frames)
+        yield frames
+
+
+def index_batches(index, ids=None, error=False, t0=None, t1=None):
+    # the frames of a saved index that match, only their rows are read
+    if ids:
+        positions = sorted(itertools.chain.from_iterable(index.between(t0, t1, can_id, error) for can_id in ids))
+    else:
+        positions = index.between(t0, t1, None, error)
+    for i in range(0, len(positions), INDEX_BATCH):
+        yield [index.frame(pos) for pos in positions[i:i + INDEX_BATCH]]
+
+
+def file_timing(path):
+    # the timing a capture was saved with, the default one for raw analyzer bytes
+    if path.endswith('.cancap'):
+        from capture import CaptureFile
+
+        with CaptureFile(path) as capture:
+            return capture.bit_duration, capture.offset
+    return BIT_DURATION, SAMPLE_OFFSET
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Decode CAN frames from the logic analyzer without the GUI")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--port', help="serial port of the analyzer")
+    source.add_argument('--file', help="saved .cancap capture or a file with raw analyzer bytes")
+    source.add_argument('--from-index', metavar='PATH', help="frame index saved with --index, nothing is decoded")
+    parser.add_argument('--baudrate', type=int, default=1152000)
+    parser.add_argument('--format', choices=('ndjson', 'csv'), default='ndjson')
+    parser.add_argument('--output', help="output file, stdout if omitted")
+    parser.add_argument('--duration', type=float, help="stop after this many seconds")
+    parser.add_argument('--count', type=int, help="stop after this many frames")
+    parser.add_argument('--continuous', action='store_true',
+                        help="one capture on a 64 bit timeline instead of the analyzer's capture windows")
+    parser.add_argument('--bit-rate', type=int, help="CAN bit rate, 500000 or the one a capture was saved with if omitted")
+    parser.add_argument('--sample-point', type=float, default=SAMPLE_OFFSET / BIT_DURATION,
+                        help="share of a bit a level has to last into it to count, with --bit-rate")
+    parser.add_argument('--auto-baud', action='store_true', help="estimate the bit rate from the first records")
+    parser.add_argument('--jobs', type=int,
+                        help="decode a --file with this many processes, 0 for one per core")
+    parser.add_argument('--perf', metavar='PATH', help="write stage timings and rates as JSON to this file")
+    parser.add_argument('--profile', type=float, metavar='SECONDS', help="cProfile the first seconds")
+    parser.add_argument('--profile-out', default='can_cli.prof')
+    parser.add_argument('--id', dest='ids', type=parse_id, action='append',
+                        help="only output this CAN ID (0x650 or 1616), can be repeated")
+    parser.add_argument('--errors', nargs='?', const='any', choices=('any', 'CRC', 'stuff', 'form', 'ACK'),
+                        help="only output frames with errors, or with this kind of error")
+    parser.add_argument('--since', type=float, metavar='SECONDS', help="only frames from this capture time on, with --from-index")
+    parser.add_argument('--until', type=float, metavar='SECONDS', help="only frames before this capture time, with --from-index")
+    parser.add_argument('--index', metavar='PATH', help="save an index of the decoded frames to this .npz file")
+    parser.add_argument('--trigger', type=parse_condition, action='append', metavar='COND',
+                        help="only decode around frames or events matching id=0x650[/MASK][,data=01??ff], "
+                             "error or idle=SECONDS, can be repeated")
+    parser.add_argument('--pre', type=float, default=PRE_TICKS / TICK_RATE,
+                        help="seconds decoded before a trigger")
+    parser.add_argument('--post', type=float, default=POST_TICKS / TICK_RATE,
+                        help="seconds decoded after a trigger")
+    args = parser.parse_args(argv)
+    if args.trigger and (args.jobs is not None or args.auto_baud or args.from_index):
+        parser.error("--trigger can't be used with --jobs, --auto-baud or --from-index")
+    if (args.since is not None or args.until is not None) and not args.from_index:
+        parser.error("--since and --until need --from-index")
+    error = True if args.errors == 'any' else args.errors or False
+    if args.duration is not None and (args.jobs is not None or args.from_index):
+        parser.error("--duration can't be used with --jobs or --from-index")
+
+    instruments.enable(bool(args.perf))
+    if args.profile:
+        instruments.start_profile(args.profile, args.profile_out)
+
+    if args.bit_rate:
+        bit_duration, offset = timing_for(args.bit_rate, args.sample_point)
+    elif args.file:
+        bit_duration, offset = file_timing(args.file)
+    else:
+        bit_duration, offset = BIT_DURATION, SAMPLE_OFFSET
+
+    deadline = time.monotonic() + args.duration if args.duration is not None else None
+    chunks = None
+    index = None
+    decoder = CANDecoder(bit_duration, offset, continuous=args.continuous, auto_baud=args.auto_baud)
+    engine = None
+    if args.trigger:
+        # the engine is fed in place of the decoder and hands it only the records around triggers
+        engine = TriggerEngine(args.trigger, decoder, round(args.pre * TICK_RATE), round(args.post * TICK_RATE),
+                               live=bool(args.port))
+    if args.from_index:
+        from frame_index import FrameIndex
+
+        t0 = args.since * TICK_RATE if args.since is not None else None
+        t1 = args.until * TICK_RATE if args.until is not None else None
+        batches = index_batches(FrameIndex.load(args.from_index), args.ids, error, t0, t1)
+    elif args.port:
+        chunks = serial_chunks(args.port, args.baudrate, deadline, engine is not None)
+        batches = decoded_batches(chunks, engine or decoder, deadline)
+    elif args.jobs is not None:
+        # shards of the file are decoded in parallel, frames still come out in capture order. a
+        # continuous capture is split where the bus was idle
+        from batch_decode import decode_file, estimate_file_timing
+
+        if args.auto_baud:
+            decoder.bit_duration, decoder.offset = estimate_file_timing(args.file) or (bit_duration, offset)
+        batches = decode_file(args.file, args.jobs or None, decoder.bit_duration, decoder.offset, args.continuous)
+    else:
+        chunks = file_chunks(args.file)
+        batches = decoded_batches(chunks, engine or decoder, deadline)
+
+    if args.index and not args.from_index:
+        from frame_index import FrameIndex
+
+        index = FrameIndex()
+        batches = indexed_batches(batches, index)
+
+    out = open(args.output, 'w', newline='') if args.output else sys.stdout
+
+    # status messages from the reader go to stderr, stdout carries only frames
+    with contextlib.redirect_stdout(sys.stderr):
+        try:
+            writer = FrameWriter(out, args.format)
+            write_frames(batches, writer, set(args.ids or ()), args.count, error)
+        except (KeyboardInterrupt, BrokenPipeError):
+            pass
+        finally:
+            batches.close()
+            if chunks is not None:
+                chunks.close()
+            instruments.stop_profile()
+            if index is not None:
+                index.save(args.index)
+                print(f"Indexed {len(index)} frames to {args.index}")
+            if engine is not None:
+                print(f"{len(engine.events)} triggers, {engine.windows} windows decoded")
+            if args.auto_baud:
+                print(f"Bit timing: {describe(decoder.bit_duration, decoder.offset)}")
+            if args.perf:
+                instruments.dump(args.perf)
+            if args.output:
+                out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+import multiprocessing as mp
+import pickle
+import time
+
+from bit_timing import BIT_DURATION, SAMPLE_OFFSET
+from capture import CaptureWriter
+from decoder import CANDecoder
+from frame_index import FrameIndex, MAX_FRAMES, decode_frame_at
+from perf import instruments
+from rolling import RollingCapture
+from serial_reader import SerialReader, SerialReaderError
+from shm_ring import SnapshotRing
+from trigger import POST_TICKS, PRE_TICKS, TriggerEngine
+
+PUBLISH_INTERVAL = 0.02  # newest decoder state at most every 20 ms
+WAIT_TIMEOUT = 0.05
+QUERY_TIMEOUT = 2.0
+QUERIES = ('between', 'next', 'previous', 'time', 'ids', 'errors')  # FrameIndex methods the GUI may call
+
+
+def run_worker(port, baudrate, ring_name, commands, bit_duration, offset, max_frames, log_options, perf=False,
+               continuous=False, auto_baud=False, trigger=None, pre=PRE_TICKS, post=POST_TICKS):
+    # worker process: owns the serial port, the decoder and the raw log
+    instruments.enable(perf)
+    ring = SnapshotRing(ring_name)
+    decoder = CANDecoder(bit_duration, offset, max_frames, continuous, auto_baud=auto_baud)
+    # with trigger conditions only the records around a trigger reach the decoder
+    engine = TriggerEngine(trigger, decoder, pre, post, live=True) if trigger else None
+    feed = (engine or decoder).feed
+    raw_log = RollingCapture(bit_duration=bit_duration, offset=offset, **log_options)
+    index = FrameIndex(MAX_FRAMES)
+    reader = None
+    published = 0.0
+    changed = False
+
+    def publish(error=None):
+        state = decoder.snapshot()
+        state['raw_records'] = len(raw_log)
+        state['error'] = error
+        if engine is not None:
+            state['triggers'] = len(engine.events)
+            state['trigger'] = engine.events[-1][:2] + (str(engine.events[-1][2]),) if engine.events else None
+        if instruments.enabled:
+            if reader is not None:
+                instruments.gauge('backlog', reader.backlog)
+                instruments.gauge('dropped', reader.overrun_bytes)
+                instruments.gauge('latency_ms', reader.last_latency * 1e3)
+            state['perf'] = instruments.snapshot()
+        try:
+            ring.write(pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL))
+        except ValueError as e:
+            print(f"[DecodeWorker] {e}")
+
+    def show(pos):
+        # the frame at an index position and a decoder snapshot of it from the raw log
+        frame = index.frame(pos)
+        records = raw_log.records
+        if frame.record is None or frame.record < records.dropped:
+            return None
+        drawn = decode_frame_at(records.view(), frame.record - records.dropped, decoder.bit_duration,
+                                decoder.offset, continuous, records.dropped)
+        return frame, drawn.snapshot()
+
+    try:
+        reader = SerialReader(port, baudrate)
+    except Exception as e:
+        publish(f"cannot open {port}: {e}")
+
+    while True:
+        # commands from the GUI, blocking once the port is closed
+        while reader is None or commands.poll():
+            command, *args = commands.recv()
+            if command == 'save':
+                writer = CaptureWriter(args[0], decoder.bit_duration, decoder.offset)
+                for host_time, raw in raw_log.chunks():
+                    writer.write(raw, host_time)
+                writer.close()
+            elif command == 'query':
+                seq, method, query_args = args
+                try:
+                    commands.send((seq, getattr(index, method)(*query_args) if method in QUERIES else None))
+                except (IndexError, KeyError) as e:
+                    print(f"[DecodeWorker] bad query {method}: {e}")
+                    commands.send((seq, None))
+            elif command == 'show':
+                seq, pos = args
+                try:
+                    commands.send((seq, show(pos)))
+                except IndexError:
+                    commands.send((seq, None))
+            elif command == 'stop' and reader is not None:
+                reader.disconnect()
+                reader = None
+                publish()
+            elif command == 'quit':
+                if reader is not None:
+                    reader.disconnect()
+                raw_log.close()
+                ring.close()
+                return
+
+        if reader.wait(WAIT_TIMEOUT):
+            try:
+                data = reader.read_data()
+            except SerialReaderError as e:
+                reader.disconnect()
+                reader = None
+                publish(str(e))
+                continue
+
+            raw_log.append(data, time.time())
+            try:
+                index.add(feed(data))
+            except Exception as e:
+                print(f"[DecodeWorker] decode error: {e}")
+                decoder.reset_data()
+            changed = True
+        elif reader.error is not None:
+            error = str(reader.error)
+            reader.disconnect()
+            reader = None
+            publish(error)
+            continue
+        elif engine is not None:
+            # nothing came in, an idle trigger can still be due on the host clock
+            fired = len(engine.events)
+            index.add(engine.poll())
+            changed = changed or len(engine.events) > fired
+
+        now = time.monotonic()
+        if changed and now - published >= PUBLISH_INTERVAL:
+            publish()
+            published = now
+            changed = False
+
+
+class DecodeWorker:
+    # serial port and decoder in their own process, so decoding neither waits for the
+    # GUI nor holds it up. the GUI reads the newest decoder state with latest(), states
+    # published in between are skipped. stopping closes the port but keeps the process
+    # and its raw log until close(), so a stopped session can still be saved
+    def __init__(self, port, baudrate=1152000, bit_duration=BIT_DURATION, offset=SAMPLE_OFFSET, max_frames=None,
+                 perf=False, continuous=False, auto_baud=False, trigger=None, pre=PRE_TICKS, post=POST_TICKS,
+                 **log_options):
+        self.port = port
+        self.ring = SnapshotRing()
+        self.seq = 0
+        self.skipped = 0
+        self.raw_records = 0
+        self.error = None
+        self.perf = None  # the worker's instruments when they are enabled
+        self.triggers = 0
+        self.trigger = None  # (tick, record, condition) of the last trigger
+        self._asked = 0  # sequence number of the last command that expects a reply
+        self._stop = mp.Event()
+
+        self._commands, worker_end = mp.Pipe()
+        self._process = mp.Process(target=run_worker, daemon=True,
+                                   args=(port, baudrate, self.ring.name, worker_end, bit_duration, offset, max_frames,
+                                         log_options, perf, continuous, auto_baud, trigger, pre, post))
+        self._process.start()
+
+    def latest(self):
+        # newest decoder state not seen yet, or None
+        seq, payload = self.ring.read_latest(self.seq)
+        if payload is None:
+            if not self._process.is_alive():
+                self._stop.set()
+            return None
+
+        self.skipped += seq - self.seq - 1
+        self.seq = seq
+        state = pickle.loads(payload)
+        self.raw_records = state['raw_records']
+        self.perf = state.get('perf')
+        self.triggers = state.get('triggers', 0)
+        self.trigger = state.get('trigger')
+        if state['error']:
+            self.error = state['error']
+            self._stop.set()
+            raise SerialReaderError(f"serial read failed: {state['error']}")
+        return state
+
+    def save_raw(self, path):
+        self._commands.send(('save', path))
+
+    def _ask(self, command, *args):
+        # a command the worker replies to, None if it doesn't in time. replies carry the
+        # command's sequence number, late ones to commands given up on are dropped
+        if not self._process.is_alive():
+            return None
+        self._asked += 1
+        self._commands.send((command, self._asked) + args)
+        deadline = time.monotonic() + QUERY_TIMEOUT
+        while self._commands.poll(max(deadline - time.monotonic(), 0)):
+            seq, reply = self._commands.recv()
+            if seq == self._asked:
+                return reply
+        print(f"[DecodeWorker] no reply to {command}")
+        return None
+
+    def query(self, method, *args):
+        # a FrameIndex query answered from the worker's index
+        return self._ask('query', method, args)
+
+    def show(self, pos):
+        # (frame, decoder snapshot) to draw the frame at an index position
+        return self._ask('show', pos)
+
+    def disconnect(self):
+        if not self._stop.is_set() and self._process.is_alive():
+            self._commands.send(('stop',))
+        self._stop.set()
+
+    def close(self):
+        self._stop.set()
+        if self._process.is_alive():
+            self._commands.send(('quit',))
+            self._process.join(timeout=2)
+            if self._process.is_alive():
+                self._process.terminate()
+        self.ring.close()
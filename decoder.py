@@ -1,248 +1,716 @@
-import struct
+import bisect
+
 import numpy as np
 
+from bit_timing import AUTO_BAUD_RECORDS, BIT_DURATION, SAMPLE_OFFSET, estimate_timing
+from can_frame import parse_frame
+from perf import instruments, timed
+from timeline import ArrayBuffer, Timeline, TickCounter
+
+RECORD_SIZE = 8
+RECORD_DTYPE = np.dtype([('sync', 'u1'),
+                         ('state', 'u1'),
+                         ('marker', 'u1'),
+                         ('pad', 'u1'),
+                         ('timestamp', '<u4')])
+TIMESTAMP_LIMIT = 3150
+MAX_FRAME_BITS = 1 + 34 + 4 + 64 + 28
+KEEP_BITS = 4096  # bits a continuous capture keeps for drawing, older ones are only on the timeline
+MAX_LEVEL_BITS = 64  # longer levels of a continuous capture, like minutes of idle, count as this many bits
+SLICE_RECORDS = 1 << 13  # records of a continuous capture decoded before the bits kept are trimmed
+
+
+def record_starts(buf):
+    # byte offsets of the records in buf, records look like 11 <state> 01 <pad> <timestamp:u4>
+    n = len(buf) - RECORD_SIZE + 1
+    if n <= 0:
+        return np.empty(0, dtype=np.intp)
+
+    is_header = (buf[:n] == 0x11) & (buf[1:n + 1] <= 1) & (buf[2:n + 2] == 0x01)
+    starts = np.flatnonzero(is_header)
+
+    # a header found inside a record that was already taken is not a record
+    if len(starts) > 1 and np.any(np.diff(starts) < RECORD_SIZE):
+        taken = []
+        next_free = 0
+        for start in starts.tolist():
+            if start >= next_free:
+                taken.append(start)
+                next_free = start + RECORD_SIZE
+        starts = np.array(taken, dtype=np.intp)
+    return starts
+
+
+def find_records(raw_data):
+    # anything that isn't a record is skipped. returns the records and the offset just
+    # past the last one
+    buf = np.frombuffer(raw_data, dtype=np.uint8)
+    starts = record_starts(buf)
+    if not len(starts):
+        return np.empty(0, dtype=RECORD_DTYPE), 0
+
+    end = int(starts[-1]) + RECORD_SIZE
+
+    # aligned stream, view the records in place
+    if np.all(np.diff(starts) == RECORD_SIZE):
+        return np.frombuffer(raw_data, dtype=RECORD_DTYPE, count=len(starts), offset=int(starts[0])), end
+
+    return buf[starts[:, None] + np.arange(RECORD_SIZE)].view(RECORD_DTYPE).reshape(-1), end
+
+
+class RecordStream:
+    # splits analyzer bytes into records, a record cut by a read is kept for the next feed.
+    # the records may be a view of data, use them before data is reused
+    def __init__(self):
+        self._pending = b''
+
+    def feed(self, data):
+        if self._pending:
+            data = self._pending + data
+        records, end = find_records(data)
+        self._pending = bytes(data[max(end, len(data) - RECORD_SIZE + 1):])
+        return records
+
+
+@timed('remove_stuff_bits')
+def destuff_bits(bits, last_bit=None, run_len=0, resets=None):
+    # a bit that changes level right after a run of exactly five equal bits is a stuff bit.
+    # last_bit/run_len carry the run that ended the previous call, returns the destuffed
+    # bits, the stuff bit positions and the state for the next call. at the positions in
+    # resets a new capture starts, with no run before it
+    bits = np.asarray(bits, dtype=np.uint8)
+    if not len(bits):
+        return bits, np.empty(0, dtype=np.intp), last_bit, run_len
+
+    # a run starts at every level change and at every reset
+    change = np.empty(len(bits), dtype=bool)
+    change[0] = last_bit is None or bits[0] != last_bit
+    np.not_equal(bits[1:], bits[:-1], out=change[1:])
+    if resets is not None and len(resets):
+        change[resets] = True
+    starts = np.flatnonzero(change)
+
+    # the carried run sits just before position 0
+    prev_run = np.diff(starts, prepend=-run_len)
+    if resets is not None and len(resets):
+        prev_run[np.searchsorted(starts, resets)] = 0
+    stuff_pos = starts[prev_run == 5]
+
+    if len(starts):
+        run_len = len(bits) - int(starts[-1])
+    else:
+        run_len += len(bits)
+
+    return np.delete(bits, stuff_pos), stuff_pos, int(bits[-1]), run_len
+
+
+def has_stuff_error(bits):
+    # six equal bits in a row can't happen between SOF and the end of CRC
+    wire = bytes(np.asarray(bits, dtype=np.uint8))
+    return bytes(6) in wire or b'\x01' * 6 in wire
+
+
 class CANDecoder:
-    def __init__(self, bit_duration=20, offset=8):
-        self.bit_data = []
-        self.timestamp_data = []
-        self.state_data = []
+    def __init__(self, bit_duration=BIT_DURATION, offset=SAMPLE_OFFSET, max_frames=None, continuous=False,
+                 max_edges=None, auto_baud=False):
+        # bits, plot steps and step times are preallocated arrays, bit_data, state_data and
+        # timestamp_data are views of them
+        self._bits = ArrayBuffer(np.uint8, 4 * KEEP_BITS)
+        self._states = ArrayBuffer(np.uint8, 4 * KEEP_BITS)
+        self._times = ArrayBuffer(np.int64, 4 * KEEP_BITS)
         self.retrived_frame = []
         self.unstuff_bits = []
         self.stuff_bits_position = []
+        self.frames = []
 
         self.bit_duration = bit_duration
         self.offset = offset
+        self.max_frames = max_frames
         self.last_time = 0
 
+        # a continuous capture runs on the 64 bit tick timeline and drops the oldest bits
+        # as it goes, the lists then start at these global bit indexes and tick
+        self.continuous = continuous
+        self.max_edges = max_edges
+        self.keep_bits = KEEP_BITS
+        self.ticks = TickCounter()
+        self.timeline = Timeline(max_edges=max_edges) if continuous else None
+        self.bit_base = 0
+        self.unstuff_base = 0
+        self.time_base = 0
+        self._stuff_dropped = 0
+
+        # with auto_baud the first records are held back until the bit time is known
+        self._timing_records = [] if auto_baud else None
+
+        # frames are stamped with the record of their first edge, and window captures with
+        # the capture timeline the capture index uses, every window after the last tick of
+        # the one before
+        self.records_decoded = 0
+        self.window_base = 0
+        self._tick_base = 0
+        self._last_raw = None
+
+        # streaming state carried between feeds
+        self._records = RecordStream()
+        self._destuff_pos = 0
+        self._last_bit = None
+        self._run_len = 0
+        self._frame_start = 0
+        self._new_frames = []
+        self._stuff_shift = []
+        self._edge_bit = [0]
+        self._edge_time = [0]
+        self._edge_record = [-1]
+
+    @property
+    def bit_data(self):
+        return self._bits.view()
+
+    @property
+    def state_data(self):
+        return self._states.view()
+
+    @property
+    def timestamp_data(self):
+        return self._times.view()
+
     def decode_and_parse_data(self, data):
-        self.decode_8byte_data(data)
-        self.unstuff_bits, self.stuff_bits_position = self.remove_stuff_bits(self.bit_data)
-        self.retrived_frame = self.decode_frame_type(self.unstuff_bits)
+        self.feed(data)
         return self.bit_data
 
+    @timed('feed')
+    def feed(self, data):
+        # decode a new chunk and return the frames completed by it
+        self.decode_8byte_data(data)
+        self._advance()
+        open_frames = self.decode_frame_type(self.unstuff_bits, self._frame_start)
+        for frame in open_frames:
+            frame.start_bit += self.unstuff_base
+            self._stamp_frame(frame)
+        self.retrived_frame = self.frames + open_frames
+
+        new_frames, self._new_frames = self._new_frames, []
+        if instruments.enabled:
+            instruments.count('bytes', len(data))
+            instruments.count('frames', len(new_frames))
+        return new_frames
+
+    def flush(self):
+        # end of input, the bus is recessive after the last edge
+        if self._timing_records is not None:
+            self._decode_records(self._detect_timing(np.empty(0, dtype=RECORD_DTYPE), final=True))
+        self._close_window()
+        new_frames, self._new_frames = self._new_frames, []
+        if instruments.enabled:
+            instruments.count('frames', len(new_frames))
+        return new_frames
+
     def get_plot_data(self):
         return self.state_data, self.timestamp_data
 
+    def snapshot(self):
+        # what the plot is drawn from, as arrays so it pickles quickly for another process
+        return {'state_data': np.array(self.state_data, dtype=np.uint8),
+                'timestamp_data': np.array(self.timestamp_data, dtype=np.int64),
+                'bit_data': np.array(self.bit_data, dtype=np.uint8),
+                'unstuff_bits': np.array(self.unstuff_bits, dtype=np.uint8),
+                'stuff_bits_position': np.array(self.stuff_bits_position, dtype=np.int64),
+                'stuff_shift': np.array(self._stuff_shift, dtype=np.int64),
+                'edge_bit': np.array(self._edge_bit, dtype=np.int64),
+                'edge_time': np.array(self._edge_time, dtype=np.int64),
+                'edge_record': np.array(self._edge_record, dtype=np.int64),
+                'bases': (self.bit_base, self.unstuff_base, self.time_base, self._stuff_dropped),
+                'timing': (self.bit_duration, self.offset),
+                'frames': self.retrived_frame}
+
+    @timed('load_snapshot')
+    def load_snapshot(self, state):
+        # show a snapshot taken by a decoder elsewhere, feeding more data after this
+        # continues from a reset stream
+        self.reset_data()
+        self._states.extend(state['state_data'])
+        self._times.extend(state['timestamp_data'])
+        self._bits.extend(state['bit_data'])
+        self.unstuff_bits = state['unstuff_bits'].tolist()
+        self.stuff_bits_position = state['stuff_bits_position'].tolist()
+        self._stuff_shift = state['stuff_shift'].tolist()
+        self._edge_bit = state['edge_bit'].tolist()
+        self._edge_time = state['edge_time'].tolist()
+        self._edge_record = state['edge_record'].tolist()
+        self.bit_base, self.unstuff_base, self.time_base, self._stuff_dropped = state['bases']
+        self.bit_duration, self.offset = state['timing']
+        self.retrived_frame = list(state['frames'])
+
     def reset_data(self):
-        self.state_data.clear()
-        self.timestamp_data.clear()
-        self.bit_data.clear()
+        self._states.clear()
+        self._times.clear()
+        self._bits.clear()
+        self.unstuff_bits.clear()
+        self.stuff_bits_position.clear()
+        self.frames.clear()
+        self.retrived_frame = []
         self.total_time = 0
         self.last_time = 0
 
+        self._destuff_pos = 0
+        self._last_bit = None
+        self._run_len = 0
+        self._frame_start = 0
+        self._stuff_shift = []
+        self._edge_bit = [0]
+        self._edge_time = [0]
+        self._edge_record = [-1]
+
+        self.bit_base = 0
+        self.unstuff_base = 0
+        self.time_base = 0
+        self._stuff_dropped = 0
+
+    def restart(self):
+        # a new capture: the tick timeline and the record count start over too
+        self.reset_data()
+        self._records = RecordStream()
+        self._new_frames = []
+        self.ticks = TickCounter()
+        if self.continuous:
+            self.timeline = Timeline(max_edges=self.max_edges)
+        self.records_decoded = 0
+        self.window_base = 0
+        self._tick_base = 0
+        self._last_raw = None
+
+    def start_at(self, record, tick_base=0, last_tick=None):
+        # go on as if the records before `record` had been decoded, for a part of a file
+        self.records_decoded = record
+        self._tick_base = tick_base
+        self._last_raw = last_tick
+        self.ticks.base = tick_base
+        self.ticks.last = last_tick
+
+    @timed('decode_8byte_data')
     def decode_8byte_data(self, raw_data):
-        i = 0
-
-        while i < len(raw_data):
-
-            if raw_data[i:i+3] == b'\x11\x00\x01' or raw_data[i:i+3] == b'\x11\x01\x01':
-                record = raw_data[i:i+8]
-                if len(record) < 8:
-                    continue
-
-                state = record[1]
-                if len(self.state_data) > 1 and state == self.state_data[-1]:
-                    i += 8
-                    continue
-
-                timestamp = struct.unpack("<I", record[4:8])[0]
-            
-                # Debugging output
-                # print(f"Rec: {record[0:4]}          {record[4:8]}           Lev: {state}    Dur: {timestamp}")
-                
-                if len(self.timestamp_data) > 0 and timestamp < self.timestamp_data[-1]:
-                    self.reset_data()
-
-                if timestamp > 3150:
-                    break
-
-                if len(self.state_data) >= 1:
-                    self.state_data.append(self.state_data[-1])
-                    self.timestamp_data.append(timestamp)
-                    
-                self.state_data.append(state)
-                self.timestamp_data.append(timestamp)
-
-                duration = timestamp - self.last_time
-
-                while duration > self.offset:
-                    self.bit_data.append(1 - state)
-                    duration -= self.bit_duration
-                    pass
-
-                self.last_time = timestamp
-                
-                i += 8
-            else:
-                i += 1
-
-    def decode_frame_type(self, bits):
+        records = self._records.feed(raw_data)
+        if self._timing_records is not None:
+            records = self._detect_timing(records)
+        self._decode_records(records)
+
+    def detect_timing(self):
+        # estimate the bit time again from the next records
+        self._timing_records = []
+
+    def _detect_timing(self, records, final=False):
+        # hold records back until there are enough to estimate the bit time from, then
+        # return all of them. the configured timing stays if no estimate can be made
+        self._timing_records.append(records.copy())
+        held = sum(len(r) for r in self._timing_records)
+        if held < AUTO_BAUD_RECORDS and not final:
+            return records[:0]
+
+        records = np.concatenate(self._timing_records)
+        self._timing_records = None
+        timing = estimate_timing(records['state'], records['timestamp'])
+        if timing is not None:
+            self.bit_duration, self.offset = timing
+        return records
+
+    def _decode_records(self, records):
+        states = records['state'].astype(np.int64)
+        timestamps = records['timestamp'].astype(np.int64)
+        index = self.records_decoded + np.arange(len(states))
+        self.records_decoded += len(states)
+        if self.continuous:
+            # a slice at a time, so a big chunk doesn't grow the bits kept past the next trim
+            for i in range(0, len(states), SLICE_RECORDS):
+                self._append_continuous(states[i:i + SLICE_RECORDS], timestamps[i:i + SLICE_RECORDS],
+                                        index[i:i + SLICE_RECORDS])
+                self._advance()
+            return
+        if not len(states):
+            return
+
+        prev = np.empty_like(timestamps)
+        prev[0] = timestamps[0] if self._last_raw is None else self._last_raw
+        prev[1:] = timestamps[:-1]
+        bases = self._tick_base + np.cumsum(np.where(timestamps < prev, prev, 0))
+        self._tick_base = int(bases[-1])
+        self._last_raw = int(timestamps[-1])
+
+        # records past the end of a capture window carry no level, a timestamp going
+        # backwards starts the next window
+        valid = np.flatnonzero(timestamps <= TIMESTAMP_LIMIT)
+        if not len(self._states):
+            self.window_base = int(bases[valid[0] if len(valid) else 0])
+        if not len(valid):
+            return
+        kept, new_window = self._window_levels(states[valid], timestamps[valid])
+        kept = valid[kept]
+        self._append_windows(states[kept], timestamps[kept], index[kept], bases[kept], new_window)
+
+    def _kept_levels(self, states, first_kept=2):
+        # drop repeated levels, the first levels of a capture are always kept
+        if not len(states):
+            return np.empty(0, dtype=np.intp)
+        prev_states = np.empty_like(states)
+        prev_states[1:] = states[:-1]
+        prev_states[0] = self.state_data[-1] if len(self._states) else -1
+        keep = states != prev_states
+        keep[:max(0, first_kept - len(self._states))] = True
+        return np.flatnonzero(keep)
+
+    def _append_continuous(self, states, timestamps, index):
+        # the whole input is one capture. a reset analyzer ends the frame on the bus and the
+        # bits start over at its first edge, decoding goes on after it
+        ticks, resets = self.ticks.extend(timestamps)
+        pos = 0
+        for reset in resets.tolist() + [len(states)]:
+            kept_idx = pos + self._kept_levels(states[pos:reset], first_kept=0)
+            self._commit_records(states[kept_idx], ticks[kept_idx], index[kept_idx])
+            self.timeline.append(states[kept_idx], ticks[kept_idx])
+            if reset == len(states):
+                break
+
+            self._close_window()
+            self._last_bit = None
+            self._run_len = 0
+            self.timeline.resets.append(int(ticks[reset]))
+            pos = reset
+
+    def _window_levels(self, states, timestamps):
+        # indexes of the records kept and which of them start a new window. a record is kept
+        # when its level changes and so are the first two of a window, a kept record older
+        # than the one kept before it starts a window. the second record of a window depends
+        # on where the window starts, so this is repeated until no window start moves
+        prev_states = np.empty_like(states)
+        prev_states[1:] = states[:-1]
+        prev_states[0] = self.state_data[-1] if len(self._states) else -1
+        changed = states != prev_states
+        first = np.zeros(len(states), dtype=bool)
+        first[:max(0, 2 - len(self._states))] = True
+
+        forced = first
+        while True:
+            kept = np.flatnonzero(changed | forced)
+            kept_times = timestamps[kept]
+            prev_times = np.empty_like(kept_times)
+            prev_times[1:] = kept_times[:-1]
+            if len(prev_times):
+                prev_times[0] = self.timestamp_data[-1] if len(self._times) else -1
+            new_window = kept_times < prev_times
+
+            second = kept[new_window] + 1
+            again = first.copy()
+            again[second[second < len(states)]] = True
+            if np.array_equal(again, forced):
+                return kept, new_window
+            forced = again
+
+    def _append_windows(self, states, timestamps, records, bases, new_window):
+        # levels of all windows of a chunk are worked out at once, only closing a window
+        # and starting the next one goes window by window
+        n = len(states)
+        if not n:
+            return
+        starts = np.flatnonzero(new_window)
+        bounds = np.concatenate(([0], starts, [n]))
+        window = np.cumsum(new_window)
+
+        # every edge after the first of a window also gets a corner point at the previous level
+        plot_first = starts if len(self._states) else np.concatenate(([0], starts[starts > 0]))
+        prev_states = np.empty_like(states)
+        prev_states[1:] = states[:-1]
+        prev_states[0] = self.state_data[-1] if len(self._states) else 0
+        corner = np.ones(2 * n, dtype=bool)
+        corner[2 * plot_first] = False
+        step_states = np.column_stack((prev_states, states)).reshape(-1)[corner]
+        step_times = np.repeat(timestamps, 2)[corner]
+        step_bounds = 2 * bounds - np.searchsorted(plot_first, bounds)
+
+        # number of bit periods between edges, the level is the one before each edge. a window
+        # starts at tick 0
+        prev_times = np.empty_like(timestamps)
+        prev_times[1:] = timestamps[:-1]
+        prev_times[0] = self.last_time
+        prev_times[starts] = 0
+        bit_counts = self._level_bits(timestamps - prev_times)
+        bit_ends = np.cumsum(bit_counts)
+        bit_bounds = np.concatenate(([0], bit_ends))[bounds]
+
+        # bit_data position reached at each edge, the first window goes on from the bits kept
+        edge_bits = bit_ends - bit_bounds[window]
+        edge_bits[:bounds[1]] += self.bit_base + len(self._bits)
+
+        # the bits not destuffed yet and the new ones are destuffed in one go, every window
+        # starts without a run before it
+        bits = np.repeat(1 - states, bit_counts)
+        pending = len(self._bits) - self._destuff_pos
+        raw_bounds = pending + bit_bounds
+        raw_bounds[0] = 0
+        unstuffed, stuff_pos, last_bit, run_len = destuff_bits(
+            np.concatenate((self.bit_data[self._destuff_pos:], bits)),
+            self._last_bit, self._run_len, raw_bounds[1:-1])
+        stuff_bounds = np.searchsorted(stuff_pos, raw_bounds).tolist()
+        unstuff_bounds = (raw_bounds - stuff_bounds).tolist()
+        raw_bounds = raw_bounds.tolist()
+
+        step_times = step_times - self.time_base
+        edge_bits = edge_bits.tolist()
+        times = timestamps.tolist()
+        records = records.tolist()
+        bases = bases[bounds[:-1]].tolist()
+        bounds = bounds.tolist()
+        step_bounds = step_bounds.tolist()
+        bit_bounds = bit_bounds.tolist()
+
+        def destuffed(w, last_bit=None, run_len=0):
+            return (unstuffed[unstuff_bounds[w]:unstuff_bounds[w + 1]],
+                    stuff_pos[stuff_bounds[w]:stuff_bounds[w + 1]] - raw_bounds[w], last_bit, run_len)
+
+        for w in range(len(bounds) - 1):
+            a, b = bounds[w], bounds[w + 1]
+            if w:
+                self._close_window(destuffed(w - 1))
+                self.reset_data()
+                self.window_base = int(bases[w])
+            self._states.extend(step_states[step_bounds[w]:step_bounds[w + 1]])
+            self._times.extend(step_times[step_bounds[w]:step_bounds[w + 1]])
+            self._bits.extend(bits[bit_bounds[w]:bit_bounds[w + 1]])
+            self._edge_bit.extend(edge_bits[a:b])
+            self._edge_time.extend(times[a:b])
+            self._edge_record.extend(records[a:b])
+            if a < b:
+                self.last_time = times[b - 1]
+        # a new window without bits has no run yet
+        if len(bounds) > 2 and raw_bounds[-2] == raw_bounds[-1]:
+            last_bit, run_len = None, 0
+        self._advance(destuffed(len(bounds) - 2, last_bit, run_len))
+
+    def _commit_records(self, states, timestamps, records):
+        if not len(states):
+            return
+
+        # every edge after the first also gets a corner point at the previous level
+        step_states = np.empty(2 * len(states), dtype=np.int64)
+        step_times = np.repeat(timestamps, 2)
+        step_states[1::2] = states
+        step_states[2::2] = states[:-1]
+        if len(self._states):
+            step_states[0] = self.state_data[-1]
+        else:
+            step_states = step_states[1:]
+            step_times = step_times[1:]
+
+        self._states.extend(step_states)
+        self._times.extend(step_times - self.time_base)
+
+        # number of bit periods between edges, the level is the one before each edge
+        durations = np.diff(timestamps, prepend=self.last_time)
+        bit_counts = self._level_bits(durations)
+        self._bits.extend(np.repeat(1 - states, bit_counts))
+
+        # bit_data position reached at each edge, to map bits back to time
+        edge_bits = self.bit_base + len(self._bits) - bit_counts.sum() + np.cumsum(bit_counts)
+        self._edge_bit.extend(edge_bits.tolist())
+        self._edge_time.extend(timestamps.tolist())
+        self._edge_record.extend(records.tolist())
+
+        self.last_time = int(timestamps[-1])
+
+    def _advance(self, destuffed=None):
+        # destuff only the bits that arrived since the last call, unless they come destuffed
+        if destuffed is None:
+            destuffed = destuff_bits(self.bit_data[self._destuff_pos:], self._last_bit, self._run_len)
+        unstuffed, stuff_pos, self._last_bit, self._run_len = destuffed
+        stuff_pos = stuff_pos + self.bit_base + self._destuff_pos
+        self.unstuff_bits.extend(unstuffed.tolist())
+        first = self._stuff_dropped + len(self.stuff_bits_position)
+        self._stuff_shift.extend((stuff_pos - np.arange(first, first + len(stuff_pos))).tolist())
+        self.stuff_bits_position.extend(stuff_pos.tolist())
+        self._destuff_pos = len(self._bits)
+
+        bits = self.unstuff_bits
+        while True:
+            # recessive bits between frames are bus idle, nothing up to the next SOF is stuffed
+            self._restore_idle()
+            while self._frame_start < len(bits) and bits[self._frame_start] == 1:
+                self._frame_start += 1
+
+            try:
+                frame, end = parse_frame(bits, self._frame_start)
+            except IndexError:
+                break
+
+            # stuffing ends with the CRC, a stuff bit found after it is the CRC delimiter, ACK
+            # or EOF and the frame is read again with it
+            crc_end = self.unstuff_base + frame.field_span('CRC')[1]
+            if self._restore_stuff_bits(self.raw_bit_index(crc_end), self.unstuff_base + end):
+                frame, end = parse_frame(bits, self._frame_start)
+
+            frame.start_bit += self.unstuff_base
+            self._stamp_frame(frame)
+            self.frames.append(frame)
+            self._new_frames.append(frame)
+            self._frame_start = end
+
+        if self.max_frames is not None and len(self.frames) > self.max_frames:
+            del self.frames[:len(self.frames) - self.max_frames]
+        if self.continuous and len(self._bits) > 2 * self.keep_bits:
+            self._trim()
+
+    def _restore_idle(self):
+        # put back the stuff bits from the frame start on up to the first dominant bit
+        start = self.raw_bit_index(self.unstuff_base + self._frame_start)
+        k = bisect.bisect_left(self.stuff_bits_position, start)
+        while k < len(self.stuff_bits_position) and \
+                self.bit_data[start - self.bit_base:self.stuff_bits_position[k] - self.bit_base].all():
+            self._restore_stuff_bit(k)
+
+    def _restore_stuff_bits(self, start, end):
+        # put back the stuff bits from the raw bit start up to the destuffed bit end, True if
+        # there were any
+        restored = False
+        while True:
+            k = bisect.bisect_left(self.stuff_bits_position, start)
+            if k == len(self.stuff_bits_position) or self.stuff_bits_position[k] >= self.raw_bit_index(end):
+                return restored
+            self._restore_stuff_bit(k)
+            restored = True
+
+    def _restore_stuff_bit(self, k):
+        # the k-th stuff bit is a bus bit after all, every destuffed bit after it moves on by one
+        pos = self.stuff_bits_position.pop(k)
+        at = self._stuff_shift.pop(k)
+        self._stuff_shift[k:] = [shift + 1 for shift in self._stuff_shift[k:]]
+        self.unstuff_bits.insert(at - self.unstuff_base, int(self.bit_data[pos - self.bit_base]))
+
+    def _trim(self):
+        # keep the newest keep_bits and the open frame. the cut is made at an edge so the
+        # lists still line up, and the bases move on by what was cut
+        limit = min(len(self._bits) - self.keep_bits,
+                    self.raw_bit_index(self.unstuff_base + self._frame_start) - self.bit_base)
+        j = bisect.bisect_right(self._edge_bit, self.bit_base + limit) - 1
+        if j <= 0:
+            return
+
+        cut = self._edge_bit[j] - self.bit_base
+        dropped = bisect.bisect_left(self.stuff_bits_position, self._edge_bit[j])
+        unstuff_cut = cut - dropped
+        self._bits.drop(cut)
+        del self.unstuff_bits[:unstuff_cut]
+        del self.stuff_bits_position[:dropped]
+        del self._stuff_shift[:dropped]
+        del self._edge_bit[:j]
+        del self._edge_time[:j]
+        del self._edge_record[:j]
+        self.bit_base += cut
+        self.unstuff_base += unstuff_cut
+        self._stuff_dropped += dropped
+        self._destuff_pos -= cut
+        self._frame_start -= unstuff_cut
+
+        # the plot starts at the new level of the cut edge, with times relative to it
+        shift = self._edge_time[0] - self.time_base
+        first = int(np.searchsorted(self.timestamp_data, shift, 'right')) - 1
+        self._states.drop(first)
+        self._times.drop(first)
+        self.timestamp_data[:] -= shift
+        self.time_base = self._edge_time[0]
+
+        # frames whose bits are gone can't be drawn anymore
+        drawable = bisect.bisect_left([frame.start_bit for frame in self.frames], self.unstuff_base)
+        del self.frames[:drawable]
+
+    def _close_window(self, destuffed=None):
+        # nothing follows the last edge of a capture, finish the open frame with recessive bits
+        self._advance(destuffed)
+        if self._frame_start < len(self.unstuff_bits):
+            for frame in self.decode_frame_type(self.unstuff_bits, self._frame_start)[:1]:
+                crc_end = self.unstuff_base + frame.field_span('CRC')[1]
+                if self._restore_stuff_bits(self.raw_bit_index(crc_end), self.unstuff_base + len(self.unstuff_bits)):
+                    frame = self.decode_frame_type(self.unstuff_bits, self._frame_start)[0]
+                frame.start_bit += self.unstuff_base
+                self._stamp_frame(frame)
+                self._new_frames.append(frame)
+            self._frame_start = len(self.unstuff_bits)
+
+    def _stamp_frame(self, frame):
+        start = self.raw_bit_index(frame.start_bit)
+        frame.start_time = self.window_base + self.bit_time(start)
+        frame.end_time = self.window_base + self.bit_time(self.raw_bit_index(frame.end_bit))
+        record = self._edge_record[bisect.bisect_right(self._edge_bit, start) - 1]
+        frame.record = record if record >= 0 else None
+
+        crc_end = self.raw_bit_index(frame.field_span('CRC')[1])
+        frame.stuff_error = has_stuff_error(self.bit_data[start - self.bit_base:crc_end - self.bit_base])
+
+    def raw_bit_index(self, unstuffed_index):
+        # position in bit_data of a destuffed bit, every stuff bit before it shifts it by one.
+        # both indexes are global, minus bit_base/unstuff_base for the lists
+        return unstuffed_index + self._stuff_dropped + bisect.bisect_right(self._stuff_shift, unstuffed_index)
+
+    def bit_time(self, raw_index):
+        # start time of a bit in bit_data, bits past the last edge continue at the nominal rate
+        j = bisect.bisect_right(self._edge_bit, raw_index)
+        if j == len(self._edge_bit):
+            return float(self._edge_time[-1] + (raw_index - self._edge_bit[-1]) * self.bit_duration)
+
+        b0, b1 = self._edge_bit[j - 1], self._edge_bit[j]
+        t0, t1 = self._edge_time[j - 1], self._edge_time[j]
+        return t0 + (raw_index - b0) * (t1 - t0) / (b1 - b0)
+
+    def _level_bits(self, durations):
+        # bit periods in levels of the given lengths
+        bit_counts = np.ceil(np.maximum(durations - self.offset, 0) / self.bit_duration).astype(np.int64)
+        if self.continuous:
+            bit_counts = np.minimum(bit_counts, MAX_LEVEL_BITS)
+        return bit_counts
+
+    @timed('decode_frame_type')
+    def decode_frame_type(self, bits, current_idx=0):
         frames = []
-        current_idx = 0
 
         while current_idx < len(bits):
+            if bits[current_idx] == 1:
+                break
 
-            frame_info = {}
             try:
-                if bits[current_idx] == 1:
-                    break
-                
-                # SOF is bit 0
-                frame_info['SOF'] = bits[current_idx]
-                current_idx += 1  
-
-                # IDE (bit 13) and RTR (bit 12 for standard)
-                ide_bit = bits[current_idx + 12]
-                rtr_bit = bits[current_idx + 11]
-
-                if ide_bit == 0:
-                    # Standard Frame (11-bit ID)
-                    frame_info['FrameType'] = 'Standard'
-                    frame_info['ID'] = bits[current_idx:current_idx+11]
-                    current_idx += 11
-                    frame_info['RTR'] = bits[current_idx]
-                    current_idx += 1
-                    frame_info['IDE'] = bits[current_idx]
-                    current_idx += 1
-                    frame_info['r0'] = bits[current_idx]
-                    current_idx += 1
-
-                else:
-                    # Extended Frame (29-bit ID)
-                    frame_info['FrameType'] = 'Extended'
-                    frame_info['BASE ID'] = bits[current_idx:current_idx+11]
-                    current_idx += 11
-                    frame_info['SRR'] = bits[current_idx]
-                    current_idx += 1
-                    frame_info['IDE'] = bits[current_idx]
-                    current_idx += 1
-                    frame_info['EXT ID'] = bits[current_idx:current_idx+18]
-                    current_idx += 18
-                    frame_info['RTR'] = bits[current_idx]
-                    rtr_bit = bits[current_idx]
-                    current_idx += 1
-                    frame_info['r0'] = bits[current_idx]
-                    current_idx += 1
-                    frame_info['r1'] = bits[current_idx]
-                    current_idx += 1
-
-                # DLC (always next 4 bits)
-                frame_info['DLC'] = bits[current_idx:current_idx+4]
-                current_idx += 4
-
-                dlc_value = int(''.join(str(b) for b in frame_info['DLC']), 2)
-                
-                # Check for Remote Frame
-                if rtr_bit == 1:
-                    frame_info['FrameSubtype'] = 'Remote'
-                    # frame_info['Data'] = []
-                else:
-                    frame_info['FrameSubtype'] = 'Data'
-                    # Read data bytes (8 bits per byte)
-                    for i in range(dlc_value):
-                        frame_info[f'Data{i}'] = bits[current_idx:current_idx+8]
-                        current_idx += 8
-                    # current_idx += dlc_value*8
-
-                if len(bits[current_idx:current_idx+15]) < 5:
-                    print("CRC bits not enough")
-                    frames.append(frame_info)
-                    break
-
-                while len(bits[current_idx:current_idx+15]) < 15:
-                    bits.append(1)
-                # CRC (next 15 bits after data)
-                frame_info['CRC'] = bits[current_idx:current_idx+15]
-                current_idx += 15
-
-                while current_idx >= len(bits):
-                    bits.append(1)
-                    
-                frame_info['CD'] = bits[current_idx]
-
-                while current_idx+1 >= len(bits):
-                    bits.append(1)
-                    
-                frame_info['ACK'] = bits[current_idx+1]
-
-                while current_idx+2 >= len(bits):
-                    bits.append(1)
-                    
-                frame_info['AD'] = bits[current_idx+2]
-
-                while current_idx+10 >= len(bits):
-                    bits.append(1)
-                
-                frame_info['EOF'] = bits[current_idx+3:current_idx+10]
-                current_idx += 10  # Move past EOF
-
-                while current_idx+3 >= len(bits):
-                    bits.append(1)
-                
-                frame_info['IFS'] = bits[current_idx:current_idx+3]
-                current_idx += 3  # Move past IFS
-                
-
-                if current_idx+4 >= len(bits):
-                    while current_idx+4 >= len(bits):
-                        bits.append(1)
-                    
-                    frame_info['IDLE '] = bits[current_idx:current_idx+4]
-                    current_idx += 4  # Move past Idle
-
-            except Exception as e:
-                print(f"Error decoding frame: {e}")
-                break
-            
-            frames.append(frame_info)
-            
-        print("finished decoding frames")
-        return frames
-    
-    def retrive_bit_timestamp(self, timestamp_data):
-        actual_bit_timestamp = []
-        for time_index in range(0, len(timestamp_data)-1,2):
-            t1 = timestamp_data[time_index]
-            t2 = timestamp_data[time_index + 1] 
-            time_diff = t2 - t1
-            bit_count = 0
+                frame, current_idx = parse_frame(bits, current_idx)
+            except IndexError:
+                # the last frame is cut off, the bus stays recessive after it
+                frame, end = parse_frame(bits[current_idx:] + [1] * MAX_FRAME_BITS, 0)
+                frame.start_bit = current_idx
+                current_idx += end
 
-            while time_diff > 20:
-                bit_count += 1
-                time_diff -= 20
-            if time_diff > 8:
-                bit_count += 1
+            frames.append(frame)
 
-            for i in np.arange(t1, t2, (t2 - t1) / bit_count):
-                actual_bit_timestamp.append(i)
-                actual_bit_timestamp.append(i + (t2 - t1) / bit_count)
+        return frames
 
-        actual_bit_timestamp[0] = 0
+    @timed('retrive_bit_timestamp')
+    def retrive_bit_timestamp(self, timestamp_data):
+        # timestamp_data holds (start, end) pairs for every level, split each one into
+        # its bit periods and return [bit start, bit end, bit start, bit end, ...]
+        times = np.asarray(timestamp_data, dtype=np.float64)
+        n_pairs = len(times) // 2
+        t1 = times[0:2 * n_pairs:2]
+        t2 = times[1:2 * n_pairs:2]
+        span = t2 - t1
+
+        bit_counts = self._level_bits(span).astype(np.intp)
+        bit_len = np.divide(span, bit_counts, out=np.zeros_like(span), where=bit_counts > 0)
+
+        total = int(bit_counts.sum())
+        level = np.repeat(np.arange(n_pairs), bit_counts)
+        bit_in_level = np.arange(total) - np.repeat(np.cumsum(bit_counts) - bit_counts, bit_counts)
+        bit_start = t1[level] + bit_in_level * bit_len[level]
+
+        actual_bit_timestamp = np.empty(2 * total, dtype=np.float64)
+        actual_bit_timestamp[0::2] = bit_start
+        actual_bit_timestamp[1::2] = bit_start + bit_len[level]
+        if total:
+            actual_bit_timestamp[0] = 0
 
         return actual_bit_timestamp
-    
+
     def remove_stuff_bits(self, bitstream):
-        un_stf_bits = [bitstream[0]]
-        stf_bit_pos = []
-
-        last_bit = bitstream[0]
-        cnt = 1
-        bit_cnt = 0
-
-        for bit in bitstream[1:]:
-            bit_cnt += 1
-            if bit == last_bit:
-                cnt += 1
-                un_stf_bits.append(bit)
-            else:
-                if cnt == 5:
-                    cnt = 1
-                    # add stuff bit position to list
-                    stf_bit_pos.append(bit_cnt)
-                else:
-                    cnt = 1
-                    un_stf_bits.append(bit)
-
-            last_bit = bit
-
-        return un_stf_bits, stf_bit_pos
\ No newline at end of file
+        un_stf_bits, stf_bit_pos, _, _ = destuff_bits(np.asarray(bitstream, dtype=np.uint8))
+        return un_stf_bits.tolist(), stf_bit_pos.tolist()
@@ -0,0 +1,219 @@
+import bisect
+from array import array
+
+import numpy as np
+
+from can_frame import CANFrame, frame_layout
+from decoder import CANDecoder
+from timeline import CHUNK_SIZE, ChunkedArray
+
+EXTENDED = 1
+RTR = 2
+ERROR_FLAGS = {'CRC': 4, 'stuff': 8, 'form': 16, 'ACK': 32}
+
+ROW_DTYPE = np.dtype([('start', '<f8'),
+                      ('end', '<f8'),
+                      ('id', '<u4'),
+                      ('dlc', 'u1'),
+                      ('flags', 'u1'),
+                      ('data', 'u1', 8),
+                      ('crc', '<u2'),
+                      ('record', '<i8')])  # -1 if the frame has none
+
+MAX_FRAMES = 1 << 21  # frames a live session keeps indexed, 56 bytes each
+SHOW_RECORDS = 512  # records decoded after a frame of a continuous capture to draw it
+
+
+class FrameIndex:
+    # every decoded frame as one row, with the start times sorted for searching by time, a
+    # posting list of positions for every CAN ID and one for every kind of error. positions
+    # are global like ChunkedArray's, frames added later only append to the lists
+    def __init__(self, max_frames=None, chunk_size=CHUNK_SIZE):
+        self.max_frames = max_frames
+        self.chunk_size = chunk_size
+        self.clear()
+
+    def clear(self):
+        self.times = ChunkedArray(np.float64, self.chunk_size, self.max_frames)
+        self.rows = ChunkedArray(ROW_DTYPE, self.chunk_size, self.max_frames)
+        self.by_id = {}
+        self.by_error = {kind: array('q') for kind in ERROR_FLAGS}
+        self.by_error[None] = array('q')  # frames with any error
+        self._last_time = -np.inf
+
+    def __len__(self):
+        return len(self.times) - self.times.dropped
+
+    @property
+    def first(self):
+        return self.times.dropped
+
+    def add(self, frames):
+        if not frames:
+            return
+        pos = len(self.times)
+        rows = np.zeros(len(frames), dtype=ROW_DTYPE)
+        times = np.empty(len(frames), dtype=np.float64)
+        for i, frame in enumerate(frames):
+            flags = (EXTENDED if frame.extended else 0) | (RTR if frame.rtr else 0)
+            for kind in frame.errors:
+                flags |= ERROR_FLAGS[kind]
+            times[i] = frame.start_time
+            rows[i]['start'] = frame.start_time
+            rows[i]['end'] = frame.end_time
+            rows[i]['id'] = frame.can_id
+            rows[i]['dlc'] = frame.dlc
+            rows[i]['flags'] = flags
+            rows[i]['data'][:len(frame.data)] = np.frombuffer(frame.data, dtype=np.uint8)
+            rows[i]['crc'] = frame.crc
+            rows[i]['record'] = -1 if frame.record is None else frame.record
+
+            self.by_id.setdefault(frame.can_id, array('q')).append(pos + i)
+            if frame.error:
+                self.by_error[None].append(pos + i)
+                for kind in frame.errors:
+                    self.by_error[kind].append(pos + i)
+
+        # start times only go back where a frame overlaps the one before, the search key is
+        # kept sorted and the row has the real time
+        self.times.extend(np.maximum.accumulate(np.maximum(times, self._last_time)))
+        self.rows.extend(rows)
+        self._last_time = float(self.times[-1])
+
+        if self.times.dropped:
+            self._drop_postings()
+
+    def _drop_postings(self):
+        first = self.times.dropped
+        for postings in list(self.by_id.values()) + list(self.by_error.values()):
+            n = bisect.bisect_left(postings, first)
+            if n:
+                del postings[:n]
+        for can_id in [can_id for can_id, postings in self.by_id.items() if not postings]:
+            del self.by_id[can_id]
+
+    def ids(self):
+        # {can_id: frames} of the frames still indexed
+        return {can_id: len(postings) for can_id, postings in sorted(self.by_id.items())}
+
+    def errors(self):
+        return {kind or 'any': len(postings) for kind, postings in self.by_error.items()}
+
+    def time(self, pos):
+        return float(self.times[pos])
+
+    def position(self, t, side='left'):
+        # position of the first frame starting at t or later, 'right' for after t
+        return self.times.searchsorted(t, side)
+
+    def frame(self, pos):
+        # the frame at a position, without the bits it was decoded from
+        row = self.rows[pos]
+        flags = int(row['flags'])
+        extended = bool(flags & EXTENDED)
+        rtr = bool(flags & RTR)
+        dlc = int(row['dlc'])
+        data = bytes(row['data'][:0 if rtr else min(dlc, 8)])
+        record = int(row['record'])
+        return CANFrame(int(row['id']), extended, rtr, dlc, data, int(row['crc']), 0, frame_layout(extended, rtr, dlc),
+                        float(row['start']), float(row['end']),
+                        crc_ok=not flags & ERROR_FLAGS['CRC'], stuff_error=bool(flags & ERROR_FLAGS['stuff']),
+                        form_error=bool(flags & ERROR_FLAGS['form']), ack_error=bool(flags & ERROR_FLAGS['ACK']),
+                        record=None if record < 0 else record)
+
+    def _postings(self, can_id, error):
+        # the positions a query is limited to, None for all of them
+        if can_id is None and error is False:
+            return None
+        if error is False:
+            return self.by_id.get(can_id, ())
+        errors = self.by_error[None if error is True else error]
+        if can_id is None:
+            return errors
+        ids = self.by_id.get(can_id, ())
+        # the shorter list is walked, the other one searched
+        if len(ids) > len(errors):
+            ids, errors = errors, ids
+        return [pos for pos in ids if _contains(errors, pos)]
+
+    def between(self, t0=None, t1=None, can_id=None, error=False):
+        # positions of the frames starting at t0 <= t < t1 with the ID and, with error True
+        # or an error kind, the errors asked for
+        start = self.first if t0 is None else self.position(t0)
+        stop = len(self.times) if t1 is None else self.position(t1)
+        postings = self._postings(can_id, error)
+        if postings is None:
+            return range(start, stop)
+        return postings[bisect.bisect_left(postings, start):bisect.bisect_left(postings, stop)]
+
+    def next(self, t, can_id=None, error=False):
+        # position of the first matching frame starting after t, None if there is none
+        postings = self._postings(can_id, error)
+        start = self.position(t, 'right')
+        if postings is None:
+            return start if start < len(self.times) else None
+        i = bisect.bisect_left(postings, start)
+        return postings[i] if i < len(postings) else None
+
+    def previous(self, t, can_id=None, error=False):
+        # position of the last matching frame starting before t
+        postings = self._postings(can_id, error)
+        stop = self.position(t)
+        if postings is None:
+            return stop - 1 if stop > self.first else None
+        i = bisect.bisect_left(postings, stop)
+        return postings[i - 1] if i else None
+
+    def save(self, path):
+        np.savez(path, times=self.times.take(self.first, len(self.times)),
+                 rows=self.rows.take(self.first, len(self.rows)), first=self.first)
+
+    @classmethod
+    def load(cls, path):
+        # an index saved with save(), positions are the same as when it was saved
+        with np.load(path) as saved:
+            times, rows, first = saved['times'], saved['rows'], int(saved['first'])
+        index = cls()
+        index.times.dropped = index.rows.dropped = first
+        index.times.extend(times)
+        index.rows.extend(rows)
+        positions = first + np.arange(len(rows))
+        for can_id in np.unique(rows['id']).tolist():
+            index.by_id[can_id] = array('q', positions[rows['id'] == can_id].tolist())
+        for kind, flag in ERROR_FLAGS.items():
+            index.by_error[kind] = array('q', positions[(rows['flags'] & flag) != 0].tolist())
+        any_error = sum(ERROR_FLAGS.values())
+        index.by_error[None] = array('q', positions[(rows['flags'] & any_error) != 0].tolist())
+        if len(times):
+            index._last_time = float(times[-1])
+        return index
+
+
+def _contains(postings, pos):
+    i = bisect.bisect_left(postings, pos)
+    return i < len(postings) and postings[i] == pos
+
+
+def frame_records(records, record, continuous=False):
+    # [first, stop) of the records to decode again to show the frame starting at record. a
+    # window capture is decoded from the start of its window to the next one, a continuous
+    # one from the frame on, the decoder takes the bus as idle before its first edge
+    if continuous:
+        return record, min(record + SHOW_RECORDS, len(records))
+    lo = max(record - SHOW_RECORDS, 0)
+    ticks = records['timestamp'][lo:record + SHOW_RECORDS].astype(np.int64)
+    back = (lo + 1 + np.flatnonzero(ticks[1:] < ticks[:-1])).tolist()
+    i = bisect.bisect_right(back, record)
+    return (back[i - 1] if i else lo), (back[i] if i < len(back) else min(record + SHOW_RECORDS, len(records)))
+
+
+def decode_frame_at(records, record, bit_duration, offset, continuous=False, base=0):
+    # a decoder holding the bits of the frame at records[record] and the ones around it, to
+    # draw a frame found in the index without decoding everything before it. base is the
+    # global index of records[0]
+    first, stop = frame_records(records, record, continuous)
+    decoder = CANDecoder(bit_duration, offset, continuous=continuous)
+    decoder.start_at(base + first)
+    frames = decoder.feed(np.ascontiguousarray(records[first:stop]).tobytes())
+    decoder.retrived_frame = frames + decoder.flush()
+    return decoder
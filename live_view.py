@@ -0,0 +1,168 @@
+import argparse
+import sys
+
+import pyqtgraph as pg
+from pyqtgraph.Qt import QtCore, QtWidgets
+
+from bit_timing import BIT_RATE, TICK_RATE, timing_for
+from perf import instruments, status_text
+from plotter import Plotter
+from qt_renderer import PyQtGraphRenderer
+from rolling import RAW_LOG_BYTES
+from trigger import POST_TICKS, PRE_TICKS, parse_condition
+
+FRAME_INTERVAL = 16  # ms, about 60 redraws a second
+PERF_INTERVAL = 500
+
+
+class Toggle:
+    # checkbox with the get/set of the Tk variables the plotter reads its options from
+    def __init__(self, checkbox):
+        self.checkbox = checkbox
+
+    def get(self):
+        return self.checkbox.isChecked()
+
+    def set(self, value):
+        self.checkbox.blockSignals(True)
+        self.checkbox.setChecked(value)
+        self.checkbox.blockSignals(False)
+
+
+class LiveView(QtWidgets.QMainWindow):
+    def __init__(self, args):
+        super().__init__()
+        self.setWindowTitle("Logic Analyzer")
+        self.resize(1600, 900)
+
+        toolbar = self.addToolBar("Display")
+        self.all_checkbuttons = []
+        for name, text in (('bit_chkbox', "Bits"), ('hex_chkbox', "Hex"), ('hili_chkbox', "Field"),
+                           ('text_chkbox', "Stuff"), ('frametype_chkbox', "Frame Type")):
+            checkbox = QtWidgets.QCheckBox(text)
+            checkbox.toggled.connect(self.refresh_plot)
+            toolbar.addWidget(checkbox)
+            self.all_checkbuttons.append(checkbox)
+            setattr(self, name, Toggle(checkbox))
+
+        save_graph = QtWidgets.QPushButton("Save Graph")
+        save_graph.clicked.connect(self.save_graph_image)
+        toolbar.addWidget(save_graph)
+
+        self.plot_widget = pg.PlotWidget(background='w')
+        self.setCentralWidget(self.plot_widget)
+
+        bit_duration, offset = timing_for(args.bit_rate)
+        self.plotter = Plotter(self, continuous=args.continuous, bit_duration=bit_duration, offset=offset,
+                               auto_baud=args.auto_baud, trigger=args.trigger, pre=round(args.pre * TICK_RATE),
+                               post=round(args.post * TICK_RATE), max_log_bytes=round(args.max_log_mb * (1 << 20)),
+                               max_log_seconds=args.max_log_seconds, spill_path=args.spill)
+        self.plotter.renderer = PyQtGraphRenderer(self.plot_widget.getPlotItem(), self.plotter.text_styles,
+                                                  self.plotter.bit_style, self.plotter.bit_duration)
+        self.plotter.draw_idle_state()
+
+        if args.file:
+            self.plotter.start_replay(args.file, realtime=True, speed=args.speed)
+        else:
+            self.plotter.start_read_data(args.port, args.baudrate)
+
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.periodic_update)
+        self.timer.start(FRAME_INTERVAL)
+        self.statusBar().showMessage("Running")
+
+        if instruments.enabled:
+            self.perf_label = QtWidgets.QLabel()
+            self.statusBar().addPermanentWidget(self.perf_label)
+            self.perf_timer = QtCore.QTimer(self)
+            self.perf_timer.timeout.connect(self.update_perf)
+            self.perf_timer.start(PERF_INTERVAL)
+
+    def update_perf(self):
+        self.perf_label.setText(status_text(self.plotter.perf_snapshot()))
+
+    def periodic_update(self):
+        instruments.tick()
+        try:
+            self.plotter.update(None)
+            self.plotter.renderer.draw()
+        except Exception as e:
+            print(f"\nException caught: {e}\n")
+            self.plotter.decoder.reset_data()
+            if getattr(self.plotter.reader, 'error', None) is not None:
+                self.stop()
+                return
+
+        if self.plotter.reader._stop.is_set():
+            self.stop()
+
+    def stop(self):
+        self.timer.stop()
+        self.plotter.reader.disconnect()
+        self.statusBar().showMessage("Stopped")
+
+    def refresh_plot(self):
+        try:
+            self.plotter.draw_frame()
+            self.plotter.renderer.draw()
+        except Exception as e:
+            print(f"Error refreshing plot: {e}")
+
+    def save_graph_image(self):
+        file_path, _ = QtWidgets.QFileDialog.getSaveFileName(self, "Save Graph Image", "", "PNG Image (*.png)")
+        if file_path:
+            self.plotter.renderer.save(file_path)
+            print(f"Graph image saved to {file_path}")
+
+    def enable_all_checkboxes(self):
+        for name in ('bit_chkbox', 'hex_chkbox', 'hili_chkbox', 'text_chkbox', 'frametype_chkbox'):
+            getattr(self, name).set(True)
+        for cb in self.all_checkbuttons:
+            cb.setEnabled(True)
+
+    def closeEvent(self, event):
+        self.stop()
+        instruments.stop_profile()
+        self.plotter.close()
+        super().closeEvent(event)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Live CAN view drawn with pyqtgraph")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--port', help="serial port of the analyzer")
+    source.add_argument('--file', help="saved .cancap capture to replay")
+    parser.add_argument('--baudrate', type=int, default=1152000)
+    parser.add_argument('--speed', type=float, default=1.0, help="replay speed")
+    parser.add_argument('--perf', action='store_true', help="show stage timings in the status bar")
+    parser.add_argument('--profile', type=float, metavar='SECONDS', help="cProfile the first seconds")
+    parser.add_argument('--profile-out', default='live_view.prof')
+    parser.add_argument('--continuous', action='store_true',
+                        help="one capture on a 64 bit timeline instead of the analyzer's capture windows")
+    parser.add_argument('--bit-rate', type=int, default=BIT_RATE, help="CAN bit rate")
+    parser.add_argument('--auto-baud', action='store_true', help="estimate the bit rate from the first records")
+    parser.add_argument('--trigger', type=parse_condition, action='append', metavar='COND',
+                        help="only decode around frames or events matching id=0x650[/MASK][,data=01??ff], "
+                             "error or idle=SECONDS, can be repeated")
+    parser.add_argument('--pre', type=float, default=PRE_TICKS / TICK_RATE, help="seconds decoded before a trigger")
+    parser.add_argument('--post', type=float, default=POST_TICKS / TICK_RATE, help="seconds decoded after a trigger")
+    parser.add_argument('--max-log-mb', type=float, default=RAW_LOG_BYTES / (1 << 20),
+                        help="raw records kept for saving and finding frames, in MiB")
+    parser.add_argument('--max-log-seconds', type=float, help="also drop raw records older than this")
+    parser.add_argument('--spill', metavar='PATH', help="write raw records that age out to this .cancap capture")
+    args = parser.parse_args(argv)
+    if args.trigger and args.auto_baud:
+        parser.error("--trigger can't be used with --auto-baud")
+
+    instruments.enable(args.perf)
+    if args.profile:
+        instruments.start_profile(args.profile, args.profile_out)
+
+    app = pg.mkQApp("Logic Analyzer")
+    view = LiveView(args)
+    view.show()
+    return app.exec()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,19 +6,27 @@ from PIL import Image, ImageTk
 import matplotlib
 import matplotlib.pyplot as plt
 from matplotlib.animation import FuncAnimation
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
 matplotlib.use("TkAgg")
 
 import serial.tools.list_ports
 
+import argparse
 import threading
 
+from bit_timing import BIT_RATE, TICK_RATE, timing_for
 from plotter import Plotter
+from replay import ReplaySource
+from rolling import RAW_LOG_BYTES
+from serial_reader import SerialReaderError
+from perf import instruments, status_text
+from trigger import POST_TICKS, PRE_TICKS, parse_condition
 
 READ_INTERVAL = 100
+PERF_INTERVAL = 500
 
 class LogicAnalyzerApp(tk.Tk):
-    def __init__(self):
+    def __init__(self, perf_dump=None, **plotter_options):
         super().__init__()
         self.title("Logic Analyzer")
         self.geometry("1600x900")
@@ -29,18 +37,24 @@ class LogicAnalyzerApp(tk.Tk):
         self.configure(bg="white")
         
         self.plot_event = None
+        self.perf_dump = perf_dump
+        self.find_time = None  # start time of the frame found last
 
         self.load_image()
         self.create_top_panel()
+        self.create_find_bar()
         self.create_plot_area()
         self.get_serial_ports()
         self.update_serial_ports()
 
-        self.plotter = Plotter(self)
+        self.plotter = Plotter(self, **plotter_options)
         self.plotter.ax = self.ax        
         self.plotter.draw_idle_state()
 
         self.protocol("WM_DELETE_WINDOW", self.on_close)
+
+        if instruments.enabled:
+            self.update_perf()
     
     def animate_status(self):
         if not self.plotter.reader._stop.is_set():
@@ -52,6 +66,11 @@ class LogicAnalyzerApp(tk.Tk):
                 self.status_label.config(text=new_text)
             self.after(500, self.animate_status)
 
+    def update_perf(self):
+        # timings and rates in the status area while instruments are on
+        self.perf_label.config(text=status_text(self.plotter.perf_snapshot()))
+        self.after(PERF_INTERVAL, self.update_perf)
+
     def load_image(self):
         self.refresh_icon = ImageTk.PhotoImage(Image.open("icons/refresh.png").resize((36, 36)))
         self.start_icon   = ImageTk.PhotoImage(Image.open("icons/start.png").resize((24, 24)))
@@ -85,6 +104,7 @@ class LogicAnalyzerApp(tk.Tk):
         tk.Button(top_frame, image=self.refresh_icon, bg=top_frame['bg'], bd=0, command=self.update_serial_ports).pack(side=tk.LEFT, padx=10)
         tk.Button(top_frame, image=self.start_icon, bg=top_frame['bg'], bd=0, command=self.start).pack(side=tk.LEFT, padx=10)
         tk.Button(top_frame, image=self.stop_icon, bg=top_frame['bg'], bd=0, command=self.stop).pack(side=tk.LEFT, padx=10)
+        tk.Button(top_frame, text="Replay", bg="lightgrey", font=("Segoe UI", 14), command=self.replay).pack(side=tk.LEFT, padx=10)
 
         # Status Label
         self.status_label = tk.Label(
@@ -100,6 +120,11 @@ class LogicAnalyzerApp(tk.Tk):
         )
         self.status_label.pack(side=tk.LEFT, padx=(10, 20))
 
+        self.perf_label = tk.Label(top_frame, text="", bg=top_frame['bg'], font=("Segoe UI", 9),
+                                   anchor='w', justify=tk.LEFT, wraplength=600)
+        if instruments.enabled:
+            self.perf_label.pack(side=tk.LEFT, padx=(0, 10))
+
         # Right-aligned frame for Display + checkboxes + Save buttons
         right_frame = tk.Frame(top_frame, bg=top_frame['bg'])
         right_frame.pack(side=tk.RIGHT, padx=10)
@@ -139,6 +164,30 @@ class LogicAnalyzerApp(tk.Tk):
         tk.Button(right_frame, text="Save Graph", bg="lightgrey", font=("Segoe UI", 14), command=self.save_graph_image).pack(side=tk.LEFT, padx=10)
 
 
+    def create_find_bar(self):
+        # jump to frames by ID and errors through the frame index, Live goes back to the newest data
+        find_frame = tk.Frame(self, bg="lightgrey")
+        find_frame.pack(fill=tk.X)
+
+        tk.Label(find_frame, text="Find ID", bg=find_frame['bg'], font=("Segoe UI", 14)).pack(side=tk.LEFT, padx=(20, 5))
+        self.find_id = ttk.Entry(find_frame, width=12)
+        self.find_id.pack(side=tk.LEFT)
+        self.find_id.bind('<Return>', lambda event: self.find_frame())
+
+        self.find_errors = tk.BooleanVar(value=False)
+        ttk.Checkbutton(find_frame, text="Errors", variable=self.find_errors,
+                        style="Rounded.TCheckbutton").pack(side=tk.LEFT, padx=10)
+
+        tk.Button(find_frame, text="Prev", bg="lightgrey", font=("Segoe UI", 12),
+                  command=lambda: self.find_frame(backwards=True)).pack(side=tk.LEFT, padx=5)
+        tk.Button(find_frame, text="Next", bg="lightgrey", font=("Segoe UI", 12),
+                  command=self.find_frame).pack(side=tk.LEFT, padx=5)
+        tk.Button(find_frame, text="Live", bg="lightgrey", font=("Segoe UI", 12),
+                  command=self.show_live).pack(side=tk.LEFT, padx=5)
+
+        self.find_label = tk.Label(find_frame, text="", bg=find_frame['bg'], font=("Segoe UI", 11), anchor='w')
+        self.find_label.pack(side=tk.LEFT, padx=10)
+
     def create_plot_area(self):
         self.figure, self.ax = plt.subplots(figsize=(10, 5))
         self.ax.set_xlabel("Time (ticks)\n 0.1 us/tick")
@@ -149,6 +198,11 @@ class LogicAnalyzerApp(tk.Tk):
 
         self.canvas = FigureCanvasTkAgg(self.figure, master=self)
         self.canvas.draw()
+
+        # zoom and pan, the plot picks its level of detail from the visible range
+        self.toolbar = NavigationToolbar2Tk(self.canvas, self, pack_toolbar=False)
+        self.toolbar.update()
+        self.toolbar.pack(side=tk.BOTTOM, fill=tk.X)
         self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
 
     def get_serial_ports(self):
@@ -171,12 +225,13 @@ class LogicAnalyzerApp(tk.Tk):
             return
 
         try:
-            if self.plotter.reader and self.plotter.reader.ser:
-                if self.plotter.reader.ser.is_open and self.plotter.reader.ser.port == selected_port:
-                    print(f"Already connected to {selected_port}")
-                    return
+            reader = self.plotter.reader
+            if getattr(reader, 'port', None) == selected_port and not reader._stop.is_set():
+                print(f"Already connected to {selected_port}")
+                return
 
             self.plotter.start_read_data(selected_port, baudrate=1152000)
+            self.find_time = None
             self.port_combo.config(state="disabled")
 
             self.after(READ_INTERVAL, self.periodic_update)
@@ -190,19 +245,56 @@ class LogicAnalyzerApp(tk.Tk):
             print(f"Error opening port: {e}")
     
     def periodic_update(self):
+        instruments.tick()
         try:
             self.plotter.update(None)
-            self.canvas.draw()
+            self.plotter.renderer.draw()
+        except SerialReaderError as e:
+            # the worker lost or never opened the port, a new one would fail the same way
+            print(f"\n{e}\n")
+            self.stop()
+            return
         except Exception as e:
 
             print(f"\nException caught: {e}\n")
             self.plotter.decoder.reset_data()
             self.stop()
-            self.start()
+            if not isinstance(self.plotter.reader, ReplaySource):
+                self.start()
             return         
 
         if not self.plotter.reader._stop.is_set():
             self.plot_event = self.after(READ_INTERVAL, self.periodic_update)
+        else:
+            # replay reached the end of the capture
+            self.plot_event = None
+            self.status_label.config(text="Stopped", bg="red")
+            self.port_combo.config(state="readonly")
+
+    def replay(self):
+        file_path = filedialog.askopenfilename(filetypes=[("CAN capture", "*.cancap")],
+                                               title="Replay Capture")
+        if not file_path:
+            return
+
+        if self.plotter.reader and not self.plotter.reader._stop.is_set():
+            self.stop()
+
+        try:
+            self.plotter.decoder.reset_data()
+            self.plotter.start_replay(file_path)
+            self.find_time = None
+        except Exception as e:
+            print(f"Error opening capture: {e}")
+            return
+
+        self.port_combo.config(state="disabled")
+        self.plot_event = self.after(READ_INTERVAL, self.periodic_update)
+
+        self.status_label.config(text="Running", bg="green")
+        self.animate_status()
+
+        print(f"Replaying {file_path}")
 
     def stop(self):
         self.plotter.reader.disconnect()
@@ -217,42 +309,33 @@ class LogicAnalyzerApp(tk.Tk):
         self.port_combo.config(state="readonly")
 
     def on_close(self):
+        if self.perf_dump:
+            instruments.dump(self.perf_dump, getattr(self.plotter.reader, 'perf', None))
+        instruments.stop_profile()
+        self.plotter.close()
         self.quit()
         self.destroy()
 
     def save_raw_data(self):
-        raw_data_list = self.plotter.raw_data_log
-        if not raw_data_list:
+        if not self.plotter.has_raw_data():
             print("No raw data to save.")
             return
 
-        file_path = filedialog.asksaveasfilename(defaultextension=".txt",
-                                                filetypes=[("Text files", "*.txt")],
+        file_path = filedialog.asksaveasfilename(defaultextension=".cancap",
+                                                filetypes=[("CAN capture", "*.cancap")],
                                                 title="Save Raw Data")
         if file_path:
-            with open(file_path, "w") as file:
-                for raw in raw_data_list:
-                    file.write(repr(raw) + '\n')
-            print(f"Raw data saved to {file_path}")
+            self.plotter.save_raw_data(file_path)
+            print(f"Saving raw data to {file_path}")
 
     def save_graph_image(self):
         file_path = filedialog.asksaveasfilename(defaultextension=".png",
                                                  filetypes=[("PNG Image", "*.png")],
                                                  title="Save Graph Image")
         if file_path:
-            self.figure.savefig(file_path)
+            self.plotter.renderer.save(file_path)
             print(f"Graph image saved to {file_path}")
     
-    def disable_all_checkboxes(self):
-        for cb in self.all_checkbuttons:
-            cb.config(state='disabled')
-
-        self.bit_chkbox.set(False)
-        self.hex_chkbox.set(False)
-        self.hili_chkbox.set(False)
-        self.text_chkbox.set(False)
-        self.frametype_chkbox.set(False)
-
     def enable_all_checkboxes(self):
         self.bit_chkbox.set(True)
         self.hex_chkbox.set(True)
@@ -263,15 +346,77 @@ class LogicAnalyzerApp(tk.Tk):
         for cb in self.all_checkbuttons:
             cb.config(state='normal')
     
+    def find_frame(self, backwards=False):
+        if self.plotter.reader is None:
+            return
+        text = self.find_id.get().strip()
+        try:
+            can_id = int(text, 0) if text else None
+        except ValueError:
+            self.find_label.config(text=f"Not a CAN ID: {text}")
+            return
+
+        t = self.find_time
+        if t is None:
+            t = float('inf') if backwards else float('-inf')
+        pos = self.plotter.find(t, can_id, self.find_errors.get(), backwards)
+        if pos is None:
+            self.find_label.config(text="No more frames found")
+            return
+
+        frame = self.plotter.show_frame(pos)
+        if frame is None:
+            self.find_time = self.plotter.query('time', pos)
+            self.find_label.config(text="Frame found, but its raw data is no longer kept")
+            return
+        self.find_time = frame.start_time
+        self.plotter.renderer.draw()
+        self.find_label.config(text=f"{frame!r} at {frame.start_time / TICK_RATE:.6f} s")
+
+    def show_live(self):
+        self.find_time = None
+        self.find_label.config(text="")
+        self.plotter.resume()
+        self.plotter.renderer.draw()
+
     def refresh_plot(self):
         try:
-            self.plotter.setup_graph()
             self.plotter.draw_frame()
-            self.canvas.draw()
+            self.plotter.renderer.draw()
         except Exception as e:
             print(f"Error refreshing plot: {e}")
 
 if __name__ == "__main__":
-    app = LogicAnalyzerApp()
+    parser = argparse.ArgumentParser(description="Logic analyzer CAN viewer")
+    parser.add_argument('--perf', action='store_true', help="time the decoding and drawing stages")
+    parser.add_argument('--perf-dump', help="write the timings as JSON to this file on exit")
+    parser.add_argument('--profile', type=float, metavar='SECONDS', help="cProfile the first seconds")
+    parser.add_argument('--profile-out', default='can_viewer.prof')
+    parser.add_argument('--continuous', action='store_true',
+                        help="one capture on a 64 bit timeline instead of the analyzer's capture windows")
+    parser.add_argument('--bit-rate', type=int, default=BIT_RATE, help="CAN bit rate")
+    parser.add_argument('--auto-baud', action='store_true', help="estimate the bit rate from the first records")
+    parser.add_argument('--trigger', type=parse_condition, action='append', metavar='COND',
+                        help="only decode around frames or events matching id=0x650[/MASK][,data=01??ff], "
+                             "error or idle=SECONDS, can be repeated")
+    parser.add_argument('--pre', type=float, default=PRE_TICKS / TICK_RATE, help="seconds decoded before a trigger")
+    parser.add_argument('--post', type=float, default=POST_TICKS / TICK_RATE, help="seconds decoded after a trigger")
+    parser.add_argument('--max-log-mb', type=float, default=RAW_LOG_BYTES / (1 << 20),
+                        help="raw records kept for saving and finding frames, in MiB")
+    parser.add_argument('--max-log-seconds', type=float, help="also drop raw records older than this")
+    parser.add_argument('--spill', metavar='PATH', help="write raw records that age out to this .cancap capture")
+    args = parser.parse_args()
+    if args.trigger and args.auto_baud:
+        parser.error("--trigger can't be used with --auto-baud")
+    bit_duration, offset = timing_for(args.bit_rate)
+
+    instruments.enable(args.perf or bool(args.perf_dump))
+    if args.profile:
+        instruments.start_profile(args.profile, args.profile_out)
+
+    app = LogicAnalyzerApp(args.perf_dump, continuous=args.continuous, bit_duration=bit_duration, offset=offset,
+                           auto_baud=args.auto_baud, trigger=args.trigger, pre=round(args.pre * TICK_RATE),
+                           post=round(args.post * TICK_RATE), max_log_bytes=round(args.max_log_mb * (1 << 20)),
+                           max_log_seconds=args.max_log_seconds, spill_path=args.spill)
     app.mainloop()
 
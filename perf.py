@@ -0,0 +1,175 @@
+import cProfile
+import functools
+import json
+import time
+
+BUCKETS = 32  # bucket i counts calls that took [2^(i-1), 2^i) microseconds
+RATE_WINDOW = 1.0  # seconds the byte and frame rates are averaged over
+
+
+class StageStats:
+    __slots__ = ('count', 'total', 'max', 'histogram')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.histogram = [0] * BUCKETS
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        self.histogram[min(int(seconds * 1e6).bit_length(), BUCKETS - 1)] += 1
+
+    def to_dict(self):
+        return {'count': self.count, 'total': self.total, 'max': self.max, 'histogram': self.histogram}
+
+
+def percentile(stage, q):
+    # upper edge of the bucket holding the q-th call, in seconds
+    target = q * stage['count']
+    seen = 0
+    for i, n in enumerate(stage['histogram']):
+        seen += n
+        if n and seen >= target:
+            return (1 << i) / 1e6
+    return stage['max']
+
+
+class Instruments:
+    # timings of the hot path stages, byte and frame counters and reader gauges. everything
+    # is skipped while disabled, the stages then only check the flag
+    def __init__(self):
+        self.enabled = False
+        self._profile = None
+        self._profile_until = 0.0
+        self._profile_path = None
+        self.reset()
+
+    def reset(self):
+        self.stages = {}
+        self.counters = {}
+        self.gauges = {}
+        self.rates = {}
+        self.started = time.perf_counter()
+        self._window_start = self.started
+        self._window = {}
+
+    def enable(self, enabled=True):
+        if enabled and not self.enabled:
+            self.reset()
+        self.enabled = enabled
+
+    def record(self, name, seconds):
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = StageStats()
+        stage.add(seconds)
+
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        self.counters[name] = self.counters.get(name, 0) + n
+        self._window[name] = self._window.get(name, 0) + n
+
+        now = time.perf_counter()
+        if now - self._window_start >= RATE_WINDOW:
+            self.rates = {key: value / (now - self._window_start) for key, value in self._window.items()}
+            self._window = {}
+            self._window_start = now
+
+    def gauge(self, name, value):
+        if self.enabled:
+            self.gauges[name] = value
+
+    def snapshot(self):
+        return {'elapsed': time.perf_counter() - self.started,
+                'stages': {name: stage.to_dict() for name, stage in self.stages.items()},
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges),
+                'rates': dict(self.rates)}
+
+    def dump(self, path, *others):
+        # this process's numbers and those sent over from other processes, as JSON
+        with open(path, 'w') as f:
+            json.dump(merge(self.snapshot(), *others), f, indent=2)
+            f.write('\n')
+
+    def start_profile(self, seconds, path):
+        # cProfile of the calling thread for a bounded time, written to path once tick()
+        # sees the time is up
+        self.stop_profile()
+        self._profile = cProfile.Profile()
+        self._profile_until = time.perf_counter() + seconds
+        self._profile_path = path
+        self._profile.enable()
+
+    def tick(self):
+        if self._profile is not None and time.perf_counter() >= self._profile_until:
+            self.stop_profile()
+
+    def stop_profile(self):
+        if self._profile is None:
+            return
+        self._profile.disable()
+        self._profile.dump_stats(self._profile_path)
+        print(f"Profile written to {self._profile_path}")
+        self._profile = None
+
+
+instruments = Instruments()
+
+
+def timed(name):
+    # time every call of the function as stage `name` while instruments are enabled
+    def wrap(func):
+        @functools.wraps(func)
+        def timed_func(*args, **kwargs):
+            if not instruments.enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                instruments.record(name, time.perf_counter() - start)
+        return timed_func
+    return wrap
+
+
+def merge(*snapshots):
+    # one snapshot from several processes, stages and counters are summed
+    merged = {'elapsed': 0.0, 'stages': {}, 'counters': {}, 'gauges': {}, 'rates': {}}
+    for snapshot in snapshots:
+        if not snapshot:
+            continue
+        merged['elapsed'] = max(merged['elapsed'], snapshot['elapsed'])
+        for name, stage in snapshot['stages'].items():
+            total = merged['stages'].get(name)
+            if total is None:
+                merged['stages'][name] = dict(stage, histogram=list(stage['histogram']))
+                continue
+            total['count'] += stage['count']
+            total['total'] += stage['total']
+            total['max'] = max(total['max'], stage['max'])
+            total['histogram'] = [a + b for a, b in zip(total['histogram'], stage['histogram'])]
+        for key in ('counters', 'rates'):
+            for name, value in snapshot[key].items():
+                merged[key][name] = merged[key].get(name, 0) + value
+        merged['gauges'].update(snapshot['gauges'])
+    return merged
+
+
+def status_text(snapshot):
+    # one line for the status area: rates, mean and p99 of every stage, reader gauges
+    parts = [f"{snapshot['rates'].get('bytes', 0) / 1e3:.1f} kB/s {snapshot['rates'].get('frames', 0):.0f} fr/s"]
+    for name, stage in snapshot['stages'].items():
+        if stage['count']:
+            parts.append(f"{name} {stage['total'] / stage['count'] * 1e3:.2f}/{percentile(stage, 0.99) * 1e3:.1f} ms")
+    gauges = snapshot['gauges']
+    if 'backlog' in gauges:
+        parts.append(f"backlog {gauges['backlog'] / 1e3:.1f} kB")
+    if 'dropped' in gauges:
+        parts.append(f"dropped {gauges['dropped']} B")
+    return ' | '.join(parts)
@@ -1,18 +1,45 @@
 from decoder import CANDecoder
-from serial_reader import SerialReader
+from decode_worker import DecodeWorker
+from frame_index import FrameIndex, MAX_FRAMES, decode_frame_at
+from replay import ReplaySource
+from capture import CaptureWriter
+from rolling import RollingCapture, RAW_LOG_BYTES
+from renderer import MatplotlibRenderer, BIT_DETAIL, FIELD_DETAIL
+from perf import instruments, merge, timed
+from bit_timing import BIT_DURATION, SAMPLE_OFFSET, TICK_RATE
+from trigger import POST_TICKS, PRE_TICKS, TriggerEngine
 import numpy as np
 import time
 from matplotlib import patches
 
-BIT_DURATION = 20  # Duration of one bit in ticks (0.1 us/tick)
+HEX_FIELDS = ('ID', 'BASE ID', 'EXT ID', 'DLC', 'CRC') + tuple(f'Data{i}' for i in range(8))
 
 class Plotter:
 
-    def __init__(self, app):
+    def __init__(self, app, max_log_bytes=RAW_LOG_BYTES, max_log_seconds=None, spill_path=None, max_frames=1000,
+                 continuous=False, bit_duration=BIT_DURATION, offset=SAMPLE_OFFSET, auto_baud=False, trigger=None,
+                 pre=PRE_TICKS, post=POST_TICKS):
 
-        self.decoder = CANDecoder()
+        # the bit timing of the decoder is used for drawing too, auto_baud may change it
+        self.decoder = CANDecoder(bit_duration, offset, max_frames, continuous, auto_baud=auto_baud)
+        self.auto_baud = auto_baud
         self.reader = None
+
+        # with trigger conditions the plot holds the frames around the last trigger, like a
+        # logic analyzer, instead of the newest ones
+        self.trigger = trigger
+        self.pre = pre
+        self.post = post
+        self.engine = None
+        self.triggers = 0  # triggers reported so far
+
+        # frames of a replay for finding them again, a live session has its index in the worker.
+        # the plot is drawn from `drawn`, which is a decoder of just the frame found while
+        # one is shown and the live decoder otherwise
+        self.index = FrameIndex(MAX_FRAMES)
+        self.drawn = self.decoder
         self.ax = None
+        self.renderer = None
         self.app = app
 
         self.frame_patches = []
@@ -21,7 +48,21 @@ class Plotter:
 
         self.font_size = 9
         self.font_color = 'black'
-        self.raw_data_log = []
+        self.log_options = dict(max_bytes=max_log_bytes, max_seconds=max_log_seconds, spill_path=spill_path)
+        self.raw_data_log = None
+
+        label_box = dict(facecolor='yellow', edgecolor='black', boxstyle='round,pad=0.13')
+        self.bit_style = dict(markersize=self.font_size * 0.8, color=self.font_color)
+        self.text_styles = {"part": dict(fontsize=self.font_size, ha='left', va='baseline', color='black', bbox=label_box),
+                            "id": dict(fontsize=self.font_size, ha='left', va='baseline', color='black',
+                                       bbox=dict(label_box, facecolor="#ffe291")),
+                            "stuff": dict(fontsize=self.font_size, fontweight='bold', ha='center', va='center',
+                                          color='white', rotation=90,
+                                          bbox=dict(facecolor='red', edgecolor='black', boxstyle='round,pad=0.2')),
+                            "frame_type": dict(fontsize=12, fontweight='bold', va='bottom', ha='left', color='black',
+                                               bbox=label_box),
+                            "summary": dict(fontsize=self.font_size, fontweight='bold', va='bottom', ha='left',
+                                            color='black', bbox=label_box)}
 
         self.plot_timestamp = []
 
@@ -45,73 +86,194 @@ class Plotter:
                             "EOF":"#ef7c00",
                             "IFS":"#757575"}
     
-    def draw_idle_state(self, duration_bits=128):
-        self.ax.clear()
-        self.ax.set_ylim(-0.5, 1.5)
-        self.ax.set_xlim(0, duration_bits * BIT_DURATION)
-        self.ax.set_xlabel('Time (ticks)\n 0.1 us/tick')
-        self.ax.set_ylabel('Logic level')
-        self.ax.grid(True, axis='y')
+    @property
+    def bit_duration(self):
+        return self.drawn.bit_duration
 
-        x = [0]
-        y = [1]
+    @property
+    def showing(self):
+        return self.drawn is not self.decoder
 
-        for i in range(duration_bits):
-            start_x = i * BIT_DURATION
-            end_x = (i + 1) * BIT_DURATION
+    def draw_idle_state(self, duration_bits=128):
+        self.setup_graph()
 
-            self.ax.axvspan(start_x, end_x, facecolor=self.frame_color["IDLE"], alpha=0.5)
-            self.ax.axvline(x=end_x, color='gray', linestyle='-', linewidth=0.5)
+        for i in range(duration_bits):
+            start_x = i * self.bit_duration
+            end_x = (i + 1) * self.bit_duration
 
-            # Plot step line
-            x.append(end_x)
-            y.append(1)
+            self.renderer.span(start_x, end_x, self.frame_color["IDLE"])
+            self.renderer.vline(end_x)
 
             # Bit text
-            self.ax.text(start_x + 10, -0.05, "1", fontsize=self.font_size, ha='center', va='center', color=self.font_color)
+            self.renderer.bit(start_x + self.bit_duration / 2, -0.05, 1)
+
+        # Plot step line
+        x = np.arange(duration_bits + 1) * self.bit_duration
+        y = np.ones(duration_bits + 1)
 
         # Field label "IDLE"
-        self.ax.text(5, -0.43, "IDLE",
-                    fontsize=self.font_size,
-                    ha='left', va='baseline',
-                    color='black',
-                    bbox=dict(facecolor='yellow', edgecolor='black', boxstyle='round,pad=0.13'))
+        self.renderer.text("part", 5, -0.43, "IDLE")
 
-        self.ax.step(x, y, where='post', color='blue', linewidth=2)
+        self.renderer.step(x, y)
+        self.renderer.finish(0, duration_bits * self.bit_duration)
 
     def start_read_data(self, port, baudrate):
-        self.reader = SerialReader(port, baudrate)
-
-    def bits_to_hex(self, bits):
-        if len(bits) == 1:
-            return bits
-        elif bits:
-            return f"0x{int(bits, 2):02X}"
-        else: 
-            return "0x00"
+        # the port is read and decoded in a worker process that keeps the raw log
+        self.close()
+        self.drawn = self.decoder
+        self.triggers = 0
+        self.app.enable_all_checkboxes()
+        self.reader = DecodeWorker(port, baudrate, self.decoder.bit_duration, self.decoder.offset,
+                                   self.decoder.max_frames, instruments.enabled, self.decoder.continuous,
+                                   self.auto_baud, self.trigger, self.pre, self.post, **self.log_options)
+
+    def start_replay(self, path, realtime=True, speed=1.0):
+        self.close()
+        self.decoder.restart()
+        self.index.clear()
+        self.drawn = self.decoder
+        self.reader = ReplaySource(path, realtime, speed)
+        if self.auto_baud:
+            self.decoder.detect_timing()
+        else:
+            # the timing the capture was saved with
+            self.decoder.bit_duration = self.reader.capture.bit_duration
+            self.decoder.offset = self.reader.capture.offset
+        self.raw_data_log = RollingCapture(bit_duration=self.decoder.bit_duration, offset=self.decoder.offset,
+                                           **self.log_options)
+        self.engine = TriggerEngine(self.trigger, self.decoder, self.pre, self.post) if self.trigger else None
+        self.triggers = 0
+        self.app.enable_all_checkboxes()
+
+    def has_raw_data(self):
+        if isinstance(self.reader, DecodeWorker):
+            return self.reader.raw_records > 0
+        return bool(self.raw_data_log)
+
+    def save_raw_data(self, path):
+        # the capture file is finished in the background
+        if isinstance(self.reader, DecodeWorker):
+            self.reader.save_raw(path)
+            return
+
+        writer = CaptureWriter(path, self.decoder.bit_duration, self.decoder.offset)
+        for host_time, raw in self.raw_data_log.chunks():
+            writer.write(raw, host_time)
+        writer.close(wait=False)
+
+    def query(self, method, *args):
+        # a FrameIndex query, answered by the worker for a live session
+        if isinstance(self.reader, DecodeWorker):
+            return self.reader.query(method, *args)
+        return getattr(self.index, method)(*args)
+
+    def find(self, t, can_id=None, error=False, backwards=False):
+        # index position of the next frame after t with the ID and errors asked for, the
+        # one before t backwards. None if there is none
+        return self.query('previous' if backwards else 'next', t, can_id, error)
+
+    def show_frame(self, pos):
+        # draw the frame at an index position from the raw log, live data goes on being
+        # decoded but isn't drawn until resume(). None once the raw log has dropped it
+        if isinstance(self.reader, DecodeWorker):
+            shown = self.reader.show(pos)
+            if shown is None:
+                return None
+            frame, state = shown
+            drawn = CANDecoder(continuous=self.decoder.continuous)
+            drawn.load_snapshot(state)
+        else:
+            frame = self.index.frame(pos)
+            records = self.raw_data_log.records if self.raw_data_log is not None else None
+            if records is None or frame.record is None or frame.record < records.dropped:
+                return None
+            drawn = decode_frame_at(records.view(), frame.record - records.dropped, self.decoder.bit_duration,
+                                    self.decoder.offset, self.decoder.continuous, records.dropped)
+
+        self.drawn = drawn
+        self.draw_frame()
+        return frame
+
+    def report_triggers(self):
+        # the newest trigger since the last update, a live session has its engine in the worker
+        if isinstance(self.reader, DecodeWorker):
+            count, last = self.reader.triggers, self.reader.trigger
+        elif self.engine is not None:
+            count, last = len(self.engine.events), self.engine.events[-1] if self.engine.events else None
+        else:
+            return
+        if count > self.triggers:
+            tick, record, condition = last
+            more = f" ({count - self.triggers - 1} more since the last one)" if count - self.triggers > 1 else ""
+            print(f"Trigger at {tick / TICK_RATE:.6f} s: {condition}{more}")
+            self.triggers = count
+
+    def resume(self):
+        self.drawn = self.decoder
+        self.draw_frame()
+
+    def close(self):
+        # end the session, the worker process and the raw log go with it
+        if isinstance(self.reader, DecodeWorker):
+            self.reader.close()
+        if self.raw_data_log is not None:
+            self.raw_data_log.close()
+            self.raw_data_log = None
+
+    def perf_snapshot(self):
+        # instruments of this process and of the decode worker
+        return merge(instruments.snapshot(), getattr(self.reader, 'perf', None))
+
+    def bits_to_hex(self, value):
+        return f"0x{value:02X}"
+
+    def frame_parts(self, frame, first=False, last=False, offset_bits=4):
+        # (part, bits) of every field, bits past the end of the capture are recessive
+        bits = self.drawn.unstuff_bits
+        if first:
+            yield 'IDLE', [1] * offset_bits
+
+        for part, offset, length in frame.fields:
+            start = frame.start_bit - self.drawn.unstuff_base + offset
+            field_bits = bits[start:start + length]
+            yield part, field_bits + [1] * (length - len(field_bits))
+
+        if last:
+            yield 'IDLE ', [1] * offset_bits
+
+    def frame_summary(self, frame):
+        # one line per frame for the zoomed out view
+        summary = f"0x{frame.can_id:X} [{frame.dlc}]"
+        if frame.data:
+            summary += " " + frame.data.hex(' ').upper()
+        if frame.error:
+            summary += f" ({', '.join(frame.errors)} error)"
+        return summary
 
     def setup_graph(self):
 
-        self.ax.clear()
-        self.ax.set_ylim(-0.5, 1.5)
-        self.ax.set_xlabel('Time (ticks)\n 0.1 us/tick')
-        self.ax.set_ylabel('Logic Level')
-        self.ax.grid(True, axis='y')
+        # artists are created once and reused by every redraw. without a renderer set
+        # from outside the plot goes to the matplotlib axes
+        if self.renderer is None:
+            self.renderer = MatplotlibRenderer(self.ax, self.text_styles, self.bit_style, self.bit_duration)
+        self.renderer.bit_width = self.bit_duration
+        self.renderer.begin()
 
     def get_pos(self, bit_cnt, offset_bits=4):
         pos = 0
         act_bit_mins_4 = bit_cnt - offset_bits
         if bit_cnt > (offset_bits - 1) and (bit_cnt - offset_bits) * 2 < len(self.plot_timestamp):
             time_diff = self.plot_timestamp[act_bit_mins_4 * 2 + 1] - self.plot_timestamp[act_bit_mins_4 * 2]
-            pos = self.plot_timestamp[act_bit_mins_4 * 2] + time_diff / 2 + offset_bits * BIT_DURATION
+            pos = self.plot_timestamp[act_bit_mins_4 * 2] + time_diff / 2 + offset_bits * self.bit_duration
         elif (bit_cnt - offset_bits) * 2 >= len(self.plot_timestamp):
             cnt_from_last = bit_cnt - len(self.plot_timestamp) // 2
-            pos = self.plot_timestamp[-1] + cnt_from_last * BIT_DURATION + 10
+            pos = self.plot_timestamp[-1] + (cnt_from_last + 0.5) * self.bit_duration
         else:
-            pos = bit_cnt * BIT_DURATION + 10 
+            pos = (bit_cnt + 0.5) * self.bit_duration
         
         return pos
 
+    @timed('draw_frame')
     def draw_frame(self):
 
         self.setup_graph()
@@ -120,79 +282,58 @@ class Plotter:
         actual_bit_cnt = 0
         offset_bits = 4
         last_1bit_part_counter = 0
+        half_bit = self.bit_duration / 2
+        lead = offset_bits * self.bit_duration  # the idle bits drawn before the first frame
 
-        bit_data = self.decoder.bit_data
-        frames = self.decoder.retrived_frame
-        stuff_bit_pos = self.decoder.stuff_bits_position
+        decoder = self.drawn
+        bit_data = decoder.bit_data
+        frames = decoder.retrived_frame
+        stuff_bit_pos = {pos - decoder.bit_base for pos in decoder.stuff_bits_position}
 
-        self.plot_timestamp = self.decoder.retrive_bit_timestamp(self.decoder.timestamp_data)
+        self.plot_timestamp = decoder.retrive_bit_timestamp(decoder.timestamp_data)
+
+        for i, frame in enumerate(frames):
+
+            # frames after an idle gap start further along the bitstream
+            if i > 0:
+                start = decoder.raw_bit_index(frame.start_bit) - decoder.bit_base
+                actual_bit_cnt = max(actual_bit_cnt, start + offset_bits)
 
-        for frame_info in frames:
-  
             x_pos = self.get_pos(actual_bit_cnt, offset_bits) 
+            frame_x = x_pos
 
             if self.app.frametype_chkbox.get():
-                frame_type_label = f"Frame type: {frame_info['FrameType']} {frame_info['FrameSubtype']} Frame"
-                self.ax.text(x_pos, 1.05, frame_type_label,
-                            fontsize=12, fontweight='bold', verticalalignment='bottom',
-                            horizontalalignment='left', color='black',
-                            bbox=dict(facecolor='yellow', edgecolor='black', boxstyle='round,pad=0.13'))
-            
-            # add IDLE to frame info
-            if actual_bit_cnt == 0:
-                frame_info = {'IDLE': [1] * offset_bits, **frame_info}
-
-            for part, bits in frame_info.items():
-                
-                if type(bits) == int:
-                    bits = [bits]
+                frame_type_label = f"Frame type: {frame.frame_type} {frame.frame_subtype} Frame"
+                if frame.error:
+                    frame_type_label += f" ({', '.join(frame.errors)} error)"
+                self.renderer.text("frame_type", x_pos, 1.05, frame_type_label)
 
-                if part in ('FrameType', 'FrameSubtype') or len(bits) == 0:
-                    continue
+            for part, bits in self.frame_parts(frame, first=actual_bit_cnt == 0, last=i == len(frames) - 1):
 
                 x_pos = self.get_pos(actual_bit_cnt, offset_bits)
-                bit_text = ''.join(str(b) for b in bits)
-                bit_decoded = self.bits_to_hex(bit_text) if len(bits) > 1 else str(bits[0])
+                bit_decoded = self.bits_to_hex(frame.field_value(part)) if len(bits) > 1 and part in HEX_FIELDS else str(bits[0])
 
                 if actual_bit_cnt - offset_bits in stuff_bit_pos:
-                    x_pos += BIT_DURATION
+                    x_pos += self.bit_duration
 
                 if self.app.hili_chkbox.get():
                     # draw part name
                     part_label = '\n'.join(part) if len(bits) == 1 else part
-                    self.ax.text(
-                        x_pos -5, -0.43 + last_1bit_part_counter * 0.1, part_label,
-                        fontsize=self.font_size,
-                        ha='left', va='baseline',
-                        color='black',
-                        bbox=dict(facecolor='yellow', edgecolor='black', boxstyle='round,pad=0.13')
-                    )
-
-                if self.app.hex_chkbox.get() and len(bits) > 1 and part not in ('IDLE', 'EOF', 'IFS', 'IDLE '):
+                    detail = BIT_DETAIL if len(bits) == 1 else FIELD_DETAIL
+                    self.renderer.text("part", x_pos -5, -0.43 + last_1bit_part_counter * 0.1, part_label, detail)
+
+                if self.app.hex_chkbox.get() and len(bits) > 1 and part in HEX_FIELDS:
                     # draw hex data of each part
-                    self.ax.text(
-                        x_pos -5, -0.48 + last_1bit_part_counter * 0.1, bit_decoded,
-                        fontsize=self.font_size,
-                        ha='left', va='baseline',
-                        color='black',
-                        bbox=dict(facecolor='yellow', edgecolor='black', boxstyle='round,pad=0.13')
-                    )
+                    self.renderer.text("part", x_pos -5, -0.48 + last_1bit_part_counter * 0.1, bit_decoded)
                 
                 #draw Base ID + Ext ID -> ID
                 if part == "BASE ID":
-                    bit_text = ''.join(str(b) for b in frame_info['BASE ID']+frame_info['EXT ID'])
-                    bit_decoded = self.bits_to_hex(bit_text)
+                    bit_decoded = self.bits_to_hex(frame.can_id)
                     last_1bit_part_counter += 1
 
                     if self.app.hex_chkbox.get():
                         # draw part name
-                        self.ax.text(
-                            x_pos -5, -0.45 + last_1bit_part_counter * 0.1, "ID :" + bit_decoded, 
-                            fontsize=self.font_size,
-                            ha='left', va='baseline',
-                            color='black',
-                            bbox=dict(facecolor="#ffe291", edgecolor='black', boxstyle='round,pad=0.13')
-                        )
+                        self.renderer.text("id", x_pos -5, -0.45 + last_1bit_part_counter * 0.1, "ID :" + bit_decoded)
                     last_1bit_part_counter = 0
                 
                 for bit in bits:
@@ -203,30 +344,25 @@ class Plotter:
                         if self.app.text_chkbox.get():
 
                             # draw stuff text
-                            self.ax.text(
-                                x_pos, 0.5, 'stuff',
-                                fontsize=self.font_size,
-                                fontweight='bold',
-                                ha='center',
-                                va='center',
-                                color='white',
-                                rotation=90,
-                                bbox=dict(facecolor='red', edgecolor='black', boxstyle='round,pad=0.2')
-                            )
+                            self.renderer.text("stuff", x_pos, 0.5, 'stuff', BIT_DETAIL)
                         
                         if self.app.bit_chkbox.get():
 
                             # draw stuff bit 
-                            self.ax.text(x_pos,  -0.05, bit_data[actual_bit_cnt - offset_bits], fontsize=self.font_size, ha='center', va='center', color=self.font_color)
+                            self.renderer.bit(x_pos, -0.05, bit_data[actual_bit_cnt - offset_bits])
                         
                         act_bit_mins_4 = actual_bit_cnt - offset_bits
-                        t1 = self.plot_timestamp[act_bit_mins_4 * 2] + BIT_DURATION * offset_bits
-                        t2 = self.plot_timestamp[act_bit_mins_4 * 2 + 1] + BIT_DURATION * offset_bits
+                        if act_bit_mins_4 * 2 < len(self.plot_timestamp):
+                            t1 = self.plot_timestamp[act_bit_mins_4 * 2] + lead
+                            t2 = self.plot_timestamp[act_bit_mins_4 * 2 + 1] + lead
+                        else:
+                            # past the last timestamp, like the other bits
+                            t1, t2 = x_pos - half_bit, x_pos + half_bit
 
                         if self.app.hili_chkbox.get():
-                            self.ax.axvspan(t1, t2, facecolor='#ff6961', alpha=0.5)
+                            self.renderer.span(t1, t2, '#ff6961')
                             
-                        self.ax.axvline(t2, color='grey', linestyle='-', linewidth=0.5)
+                        self.renderer.vline(t2)
 
                         actual_bit_cnt += 1
                     
@@ -234,78 +370,69 @@ class Plotter:
 
                     if self.app.bit_chkbox.get():
                         # draw bit 
-                        self.ax.text(x_pos,  -0.05, str(bit), fontsize=self.font_size, ha='center', va='center', color=self.font_color)
+                        self.renderer.bit(x_pos, -0.05, bit)
                     
                     act_bit_mins_4 = actual_bit_cnt - offset_bits
-                    t1 = self.plot_timestamp[act_bit_mins_4 * 2] + 80 if actual_bit_cnt > 3 and act_bit_mins_4 * 2 < len(self.plot_timestamp) else 0
-                    t2 = self.plot_timestamp[act_bit_mins_4 * 2 + 1] + 80 if actual_bit_cnt > 3 and act_bit_mins_4 * 2 < len(self.plot_timestamp) else 0
+                    timed_bit = actual_bit_cnt >= offset_bits and act_bit_mins_4 * 2 < len(self.plot_timestamp)
+                    t1 = self.plot_timestamp[act_bit_mins_4 * 2] + lead if timed_bit else 0
+                    t2 = self.plot_timestamp[act_bit_mins_4 * 2 + 1] + lead if timed_bit else 0
                     
                     color = self.frame_color['Data'] if part.startswith("Data") else self.frame_color[part]
 
                     if self.app.hili_chkbox.get():
                         # draw colored plane
-                        if actual_bit_cnt > 3 and act_bit_mins_4 * 2 < len(self.plot_timestamp):
-                            self.ax.axvspan(t1, t2, facecolor=color, alpha=0.5)
+                        if timed_bit:
+                            self.renderer.span(t1, t2, color)
                             
                         else:
-                            self.ax.axvspan(x_pos - 10, x_pos + 10, facecolor=color, alpha=0.5)
-                            last_timestamp = x_pos + 10
+                            self.renderer.span(x_pos - half_bit, x_pos + half_bit, color)
+                            last_timestamp = x_pos + half_bit
 
-                    if actual_bit_cnt > 3 and act_bit_mins_4 * 2 < len(self.plot_timestamp):
-                        self.ax.axvline(t2, color='grey', linestyle='-', linewidth=0.5)
+                    if timed_bit:
+                        self.renderer.vline(t2)
                         last_timestamp = t2
                     else:
-                        self.ax.axvline(x_pos + 10, color='grey', linestyle='-', linewidth=0.5)
-                        last_timestamp = x_pos + 10
+                        self.renderer.vline(x_pos + half_bit)
+                        last_timestamp = x_pos + half_bit
 
                     actual_bit_cnt += 1
 
-        x, y = self.decoder.get_plot_data()
+            if self.app.frametype_chkbox.get() or self.app.hex_chkbox.get():
+                self.renderer.frame(frame_x, last_timestamp, self.frame_summary(frame))
+
+        x, y = decoder.get_plot_data()
            
         total_bits      = actual_bit_cnt + 1
-        last_needed_ts  = (total_bits - offset_bits) * BIT_DURATION
+        last_needed_ts  = (total_bits - offset_bits) * self.bit_duration
 
         # add line at the end
-        if y and last_needed_ts > y[-1]:
-            y.append(last_needed_ts) 
-            x.append(1)            
+        end_x, end_y = [], []
+        if len(y) and last_needed_ts > y[-1]:
+            end_x, end_y = [1], [last_needed_ts]
 
-        # add line at the start
-        start_offset = offset_bits * BIT_DURATION
-        x = [1, 1] + x
-        y = [0, start_offset] + [yi + start_offset for yi in y]
+        # add line at the start, the whole waveform is one path
+        start_offset = lead
+        x = np.concatenate(([1, 1], x, end_x))
+        y = np.concatenate(([0, start_offset], np.concatenate((y, end_y)) + start_offset))
 
-        self.ax.set_xlim(0, last_timestamp)
-        
-        self.ax.step(y, x, where='post', color='blue', linewidth=2)
+        self.renderer.step(y, x)
+        self.renderer.finish(0, last_timestamp)
 
     def update(self, frame):
-        data = self.reader.read_data()
-
-        if data:
-
-            self.raw_data_log.append(data)
-
-            if not self.decoder.decode_and_parse_data(data):
-                return
-            
-            frame = self.decoder.retrived_frame[0] if self.decoder.retrived_frame else None
-
-            if frame:
-
-                if 'ID' in frame:
-                    can_id_bin = ''.join(str(b) for b in frame['ID'])
-                elif 'BASE ID' in frame:
-                    can_id_bin = ''.join(str(b) for b in frame['BASE ID'] + frame['EXT ID'])
-                else:
-                    can_id_bin = None
-
-                if can_id_bin:
-                    can_id = int(can_id_bin, 2)
-                    if can_id == 0x650:
-                        self.app.disable_all_checkboxes()
-                    else:
-                        self.app.enable_all_checkboxes()
-
+        if isinstance(self.reader, DecodeWorker):
+            # only the newest state is drawn, older ones are skipped
+            state = self.reader.latest()
+            if state is not None:
+                self.decoder.load_snapshot(state)
+            data = state is not None and len(self.decoder.bit_data)
+        else:
+            data = self.reader.read_data()
+            if data:
+                self.raw_data_log.append(data, time.time())
+                self.index.add((self.engine or self.decoder).feed(data))
+                data = len(self.decoder.bit_data)
+
+        self.report_triggers()
+        if data and not self.showing:
             self.draw_frame()
                     
\ No newline at end of file
@@ -0,0 +1,154 @@
+from functools import partial
+
+import numpy as np
+import pyqtgraph as pg
+from pyqtgraph.Qt import QtGui
+
+from renderer import ArtistPool, Renderer, Y_RANGE, export_figure
+
+# matplotlib text alignment as pyqtgraph anchors, fractions of the label box
+H_ANCHOR = {'left': 0.0, 'center': 0.5, 'right': 1.0}
+V_ANCHOR = {'top': 0.0, 'center': 0.5, 'baseline': 1.0, 'bottom': 1.0}
+
+
+def text_symbol(text, font):
+    # scatter symbol drawn as text, centred and scaled to unit size
+    path = QtGui.QPainterPath()
+    path.addText(0, 0, font, text)
+    box = path.boundingRect()
+    scale = 1 / max(box.width(), box.height())
+    transform = QtGui.QTransform()
+    transform.scale(scale, scale)
+    transform.translate(-box.x() - box.width() / 2, -box.y() - box.height() / 2)
+    return transform.map(path)
+
+
+class PyQtGraphRenderer(Renderer):
+    # live view on a pyqtgraph PlotItem. the waveform is one PlotDataItem that pyqtgraph
+    # downsamples and clips to the view, spans and bit boundaries are one item each.
+    # images are exported through matplotlib
+    def __init__(self, plot, text_styles, bit_style, bit_width):
+        super().__init__(text_styles, bit_style, bit_width)
+        self.plot = plot
+
+        plot.clear()
+        plot.setYRange(*Y_RANGE, padding=0)
+        plot.setMouseEnabled(x=True, y=False)
+        plot.setLabel('bottom', 'Time (ticks), 0.1 us/tick')
+        plot.setLabel('left', 'Logic Level')
+        plot.showGrid(x=False, y=True)
+
+        self.labels = {name: ArtistPool(partial(self._new_text, style), self._set_text, pg.TextItem.setVisible)
+                       for name, style in text_styles.items()}
+        self._brushes = {}
+
+        self.spans = pg.BarGraphItem(x0=[0], x1=[0], y0=Y_RANGE[0], y1=Y_RANGE[1], pen=pg.mkPen(None))
+        self.spans.setVisible(False)
+        self.vlines = pg.PlotDataItem(connect='pairs', pen=pg.mkPen('grey', width=0.5))
+        plot.addItem(self.spans)
+        plot.addItem(self.vlines)
+
+        font = QtGui.QFont()
+        size = bit_style.get('markersize', 7) * 4 / 3  # points to pixels
+        self.bits = {value: pg.ScatterPlotItem(symbol=text_symbol(str(value), font), size=size, pen=None,
+                                               brush=pg.mkBrush(bit_style.get('color', 'black')))
+                     for value in (0, 1)}
+        for item in self.bits.values():
+            plot.addItem(item)
+
+        self.wave = plot.plot(pen=pg.mkPen('blue', width=2), skipFiniteCheck=True)
+        self.wave.setDownsampling(auto=True, method='peak')
+        self.wave.setClipToView(True)
+
+        self._extent = None
+        self._view = None
+        plot.sigXRangeChanged.connect(self._on_range)
+        plot.getViewBox().sigResized.connect(self._on_resize)
+
+    def _new_text(self, style):
+        bbox = style.get('bbox')
+        item = pg.TextItem(color=style.get('color', 'black'),
+                           anchor=(H_ANCHOR[style.get('ha', 'left')], V_ANCHOR[style.get('va', 'baseline')]),
+                           angle=style.get('rotation', 0),
+                           border=pg.mkPen(bbox.get('edgecolor', 'black')) if bbox else None,
+                           fill=pg.mkBrush(bbox['facecolor']) if bbox else None)
+        font = QtGui.QFont()
+        font.setPointSizeF(style.get('fontsize', 9))
+        font.setBold(style.get('fontweight') == 'bold')
+        item.setFont(font)
+        item.setVisible(False)
+        self.plot.addItem(item)
+        return item
+
+    def _set_text(self, item, value):
+        x, y, text = value
+        item.setText(text)
+        item.setPos(x, y)
+
+    def _brush(self, color):
+        # field colours at half opacity like the matplotlib spans
+        if color not in self._brushes:
+            qcolor = QtGui.QColor(color)
+            qcolor.setAlphaF(0.5)
+            self._brushes[color] = pg.mkBrush(qcolor)
+        return self._brushes[color]
+
+    def show_extent(self, xmin, xmax):
+        # the visible range follows the data unless it was zoomed or panned away
+        following = self._extent is None or np.allclose(self.plot.viewRange()[0], self._extent)
+        self._extent = (xmin, xmax)
+
+        x, y = self._wave_data
+        if self._changed('wave', x, y):
+            # explicit corners, so downsampling sees an ordinary line
+            self.wave.setData(np.repeat(x, 2)[1:], np.repeat(y, 2)[:-1])
+
+        self._view = None
+        if following:
+            self.plot.setXRange(xmin, xmax, padding=0)
+            self._extent = tuple(self.plot.viewRange()[0])
+        if self._view is None:
+            self._apply_view()
+
+    def _on_range(self, viewbox, x_range):
+        if tuple(x_range) != self._view:
+            self._apply_view()
+
+    def _on_resize(self):
+        self._view = None
+        self._apply_view()
+
+    def _apply_view(self):
+        if self._layout is None:
+            return
+
+        xmin, xmax = self._view = tuple(self.plot.viewRange()[0])
+        texts, span_x, colors, vline_x, bits = self.select(xmin, xmax, self.plot.getViewBox().width())
+
+        for pool in self.labels.values():
+            pool.begin()
+        for style, x, y, text in texts:
+            self.labels[style].put((x, y, text))
+        for pool in self.labels.values():
+            pool.finish()
+
+        if self._changed('spans', span_x, colors):
+            if len(span_x):
+                self.spans.setOpts(x0=span_x[:, 0], x1=span_x[:, 1],
+                                   brushes=[self._brush(color) for color in colors.tolist()])
+            self.spans.setVisible(len(span_x) > 0)
+
+        if self._changed('vlines', vline_x):
+            self.vlines.setData(np.repeat(vline_x, 2), np.tile(Y_RANGE, len(vline_x)))
+
+        for value, item in self.bits.items():
+            pos = bits[bits[:, 2] == value, :2]
+            if self._changed(value, pos):
+                item.setData(x=pos[:, 0], y=pos[:, 1])
+
+    def draw(self):
+        # Qt repaints changed items on its own
+        pass
+
+    def save(self, path):
+        export_figure(self, path, tuple(self.plot.viewRange()[0]))
@@ -0,0 +1,372 @@
+from abc import ABC, abstractmethod
+from functools import partial
+
+import numpy as np
+from matplotlib.artist import Artist
+from matplotlib.collections import LineCollection, PolyCollection
+
+from perf import timed
+
+# level of detail, in screen pixels per bit
+BIT_DETAIL = 8        # bit values and per-bit labels
+FIELD_DETAIL = 5      # field names, hex values and frame type, below this frames get a summary box
+BOUNDARY_DETAIL = 3   # bit boundary lines
+SUMMARY_MIN_PX = 80   # narrowest frame that still gets a summary box
+LABEL_PAD_PX = 300    # labels starting this far left of the view are still drawn
+
+Y_RANGE = (-0.5, 1.5)
+
+
+class ArtistPool:
+    # artists of one kind reused from one redraw to the next, only the ones whose
+    # values changed are touched
+    def __init__(self, create, update, show):
+        self.create = create
+        self.update = update
+        self.show = show
+        self.artists = []
+        self.values = []
+        self.used = 0
+        self.changed = False
+
+    def begin(self):
+        self.used = 0
+        self.changed = False
+
+    def put(self, value):
+        if self.used == len(self.artists):
+            self.artists.append(self.create())
+            self.values.append(None)
+
+        i = self.used
+        self.used += 1
+        if self.values[i] != value:
+            self.update(self.artists[i], value)
+            self.show(self.artists[i], True)
+            self.values[i] = value
+            self.changed = True
+
+    def finish(self):
+        # hide whatever this redraw did not use, returns True when anything changed
+        for i in range(self.used, len(self.artists)):
+            if self.values[i] is not None:
+                self.show(self.artists[i], False)
+                self.values[i] = None
+                self.changed = True
+        return self.changed
+
+
+class Renderer(ABC):
+    # what Plotter draws through. a redraw hands over the whole layout, the backend
+    # shows the part of it inside the visible range at a matching level of detail
+    def __init__(self, text_styles, bit_style, bit_width):
+        self.text_styles = text_styles
+        self.bit_style = bit_style
+        self.bit_width = bit_width
+
+        self._texts = []
+        self._span_x = []
+        self._span_colors = []
+        self._vline_x = []
+        self._bit_pos = []
+        self._frames = []
+        self._layout = None
+        self._wave_data = (np.zeros(0), np.zeros(0))
+        self._drawn = {}
+
+    def begin(self):
+        self._texts.clear()
+        self._span_x.clear()
+        self._span_colors.clear()
+        self._vline_x.clear()
+        self._bit_pos.clear()
+        self._frames.clear()
+
+    def text(self, style, x, y, text, detail=FIELD_DETAIL):
+        # detail: pixels per bit from which on the label is shown
+        self._texts.append((x, detail, style, y, text))
+
+    def span(self, x0, x1, color):
+        self._span_x.append((x0, x1))
+        self._span_colors.append(color)
+
+    def vline(self, x):
+        self._vline_x.append(x)
+
+    def bit(self, x, y, value):
+        self._bit_pos.append((x, y, int(value)))
+
+    def frame(self, x0, x1, summary):
+        # summary box text that stands in for the labels of the frame when zoomed out
+        self._frames.append((x0, x1, summary))
+
+    def step(self, x, y):
+        self._wave_data = (np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+
+    def finish(self, xmin, xmax):
+        texts = self._texts
+        self._layout = {
+            'text_x': np.array([t[0] for t in texts], dtype=float),
+            'text_detail': np.array([t[1] for t in texts], dtype=float),
+            'texts': list(texts),
+            'span_x': np.array(self._span_x, dtype=float).reshape(-1, 2),
+            'span_colors': np.array(self._span_colors, dtype=object),
+            'vline_x': np.array(self._vline_x, dtype=float),
+            'bits': np.array(self._bit_pos, dtype=float).reshape(-1, 3),
+            'frames': list(self._frames),
+        }
+        self.show_extent(xmin, xmax)
+
+    def load(self, other):
+        # take over the layout of another renderer, e.g. to export what it shows
+        self._layout = other._layout
+        self._wave_data = other._wave_data
+
+    def select(self, xmin, xmax, width_px):
+        # what of the layout is shown for the range [xmin, xmax] over width_px pixels
+        layout = self._layout
+        ticks_per_px = (xmax - xmin) / max(width_px, 1)
+        px_per_bit = self.bit_width / ticks_per_px if ticks_per_px > 0 else 0
+        pad = LABEL_PAD_PX * ticks_per_px
+
+        # labels, only those near the view and detailed enough for the zoom level
+        text_x = layout['text_x']
+        shown = np.flatnonzero((text_x >= xmin - pad) & (text_x <= xmax) & (layout['text_detail'] <= px_per_bit))
+        texts = []
+        for i in shown.tolist():
+            x, detail, style, y, text = layout['texts'][i]
+            texts.append((style, x, y, text))
+
+        if px_per_bit < FIELD_DETAIL and 'summary' in self.text_styles:
+            for x0, x1, summary in layout['frames']:
+                if summary and x1 >= xmin and x0 <= xmax and (x1 - x0) / ticks_per_px >= SUMMARY_MIN_PX:
+                    texts.append(('summary', max(x0, xmin), 1.05, summary))
+
+        span_x, colors = self._select_spans(layout['span_x'], layout['span_colors'], xmin, xmax,
+                                            px_per_bit, ticks_per_px)
+
+        vline_x = layout['vline_x']
+        if px_per_bit < BOUNDARY_DETAIL:
+            vline_x = vline_x[:0]
+        vline_x = vline_x[(vline_x >= xmin) & (vline_x <= xmax)]
+
+        bits = layout['bits']
+        if px_per_bit < BIT_DETAIL:
+            bits = bits[:0]
+        bits = bits[(bits[:, 0] >= xmin) & (bits[:, 0] <= xmax)]
+
+        return texts, span_x, colors, vline_x, bits
+
+    def _select_spans(self, span_x, colors, xmin, xmax, px_per_bit, ticks_per_px):
+        keep = (span_x[:, 1] >= xmin) & (span_x[:, 0] <= xmax)
+        span_x, colors = span_x[keep], colors[keep]
+
+        if px_per_bit < FIELD_DETAIL and len(span_x) > 1:
+            # zoomed out, neighbouring spans of one colour become one span per field, and
+            # below a pixel per bit everything up to the next visible gap becomes one span
+            if px_per_bit < 1:
+                joined = span_x[1:, 0] - span_x[:-1, 1] < ticks_per_px
+            else:
+                joined = (colors[1:] == colors[:-1]) & (span_x[1:, 0] <= span_x[:-1, 1])
+            starts = np.flatnonzero(np.concatenate(([True], ~joined)))
+            span_x = np.stack((span_x[starts, 0], np.maximum.reduceat(span_x[:, 1], starts)), 1)
+            colors = colors[starts]
+
+        return span_x, colors
+
+    def _changed(self, key, *values):
+        # compares the batched data of this redraw with what is on screen
+        drawn = self._drawn.get(key)
+        if drawn is not None and all(np.array_equal(a, b) for a, b in zip(drawn, values)):
+            return False
+        self._drawn[key] = values
+        return True
+
+    @abstractmethod
+    def show_extent(self, xmin, xmax):
+        # a new layout covering [xmin, xmax] is ready
+        pass
+
+    @abstractmethod
+    def draw(self):
+        pass
+
+    @abstractmethod
+    def save(self, path):
+        pass
+
+
+class MatplotlibRenderer(Renderer):
+    # the plot is built once per axes and updated in place. labels, spans and bit
+    # boundaries make up the static layer, the waveform is blitted on top of it.
+    # spans, bit boundaries and bit values are one batched artist each
+    def __init__(self, ax, text_styles, bit_style, bit_width):
+        super().__init__(text_styles, bit_style, bit_width)
+        self.ax = ax
+        self.canvas = ax.figure.canvas
+
+        ax.clear()
+        ax.set_ylim(*Y_RANGE)
+        ax.set_xlabel('Time (ticks)\n 0.1 us/tick')
+        ax.set_ylabel('Logic Level')
+        ax.grid(True, axis='y')
+
+        self.labels = {name: ArtistPool(partial(self._new_text, style), self._set_text, Artist.set_visible)
+                       for name, style in text_styles.items()}
+
+        # spans and boundaries are in data x and axes y, they always cover the full height
+        self.spans = PolyCollection([], alpha=0.5, linewidths=0, transform=ax.get_xaxis_transform())
+        self.vlines = LineCollection([], colors='grey', linestyles='-', linewidths=0.5,
+                                     transform=ax.get_xaxis_transform())
+        ax.add_collection(self.spans, autolim=False)
+        ax.add_collection(self.vlines, autolim=False)
+
+        # bit values are text markers, one line per value
+        self.bits = {value: ax.plot([], [], linestyle='none', marker=f'${value}$', **bit_style)[0]
+                     for value in (0, 1)}
+
+        self._extent = None
+        self._view = None
+
+        self.blit = self.canvas.supports_blit
+        self.wave, = ax.plot([], [], drawstyle='steps-post', color='blue', linewidth=2, animated=self.blit)
+        self._background = None
+        self._dirty = True
+        self._wave_dirty = True
+        self._cids = [self.canvas.mpl_connect('draw_event', self._on_draw),
+                      self.canvas.mpl_connect('resize_event', self._on_resize)]
+        ax.callbacks.connect('xlim_changed', self._on_xlim)
+
+    def _new_text(self, style):
+        style = dict(style)
+        if 'bbox' in style:
+            style['bbox'] = dict(style['bbox'])
+        return self.ax.text(0, 0, '', visible=False, **style)
+
+    def _set_text(self, artist, value):
+        x, y, text = value
+        artist.set_position((x, y))
+        artist.set_text(text)
+
+    def show_extent(self, xmin, xmax):
+        # the visible range follows the data unless it was zoomed or panned away
+        following = self._extent is None or tuple(self.ax.get_xlim()) == self._extent
+        self._extent = (xmin, xmax)
+        self._view = None
+        if following:
+            self.ax.set_xlim(xmin, xmax)
+            self._extent = tuple(self.ax.get_xlim())
+        if self._view is None:
+            self._apply_view()
+
+    def _on_xlim(self, ax):
+        if tuple(ax.get_xlim()) != self._view:
+            self._apply_view()
+
+    def _on_resize(self, event):
+        self._view = None
+        self._apply_view()
+
+    def _apply_view(self):
+        if self._layout is None:
+            return
+
+        xmin, xmax = self._view = tuple(self.ax.get_xlim())
+        width_px = max(int(self.ax.bbox.width), 1)
+        texts, span_x, colors, vline_x, bits = self.select(xmin, xmax, width_px)
+
+        for pool in self.labels.values():
+            pool.begin()
+        for style, x, y, text in texts:
+            self.labels[style].put((x, y, text))
+        for pool in self.labels.values():
+            if pool.finish():
+                self._dirty = True
+
+        if self._changed('spans', span_x, colors):
+            x0, x1 = span_x[:, 0], span_x[:, 1]
+            zero, one = np.zeros_like(x0), np.ones_like(x0)
+            verts = np.stack((np.stack((x0, zero), 1), np.stack((x0, one), 1),
+                              np.stack((x1, one), 1), np.stack((x1, zero), 1)), 1)
+            self.spans.set_verts(verts)
+            self.spans.set_facecolor(colors.tolist())
+            self._dirty = True
+
+        if self._changed('vlines', vline_x):
+            segments = np.stack((np.stack((vline_x, np.zeros_like(vline_x)), 1),
+                                 np.stack((vline_x, np.ones_like(vline_x)), 1)), 1)
+            self.vlines.set_segments(segments)
+            self._dirty = True
+
+        for value, line in self.bits.items():
+            pos = bits[bits[:, 2] == value, :2]
+            if self._changed(value, pos):
+                line.set_data(pos[:, 0], pos[:, 1])
+                self._dirty = True
+
+        x, y = decimate_step(*self._wave_data, xmin, xmax, width_px)
+        if self._changed('wave', x, y):
+            self.wave.set_data(x, y)
+            self._wave_dirty = True
+
+    @timed('canvas_draw')
+    def draw(self):
+        # a full draw only when the static layer changed, otherwise just the waveform
+        if not (self._dirty or self._wave_dirty):
+            return
+
+        if self._dirty or not self.blit or self._background is None:
+            self.canvas.draw()
+        else:
+            self.canvas.restore_region(self._background)
+            self.ax.draw_artist(self.wave)
+            self.canvas.blit(self.ax.bbox)
+        self._dirty = self._wave_dirty = False
+
+    def _on_draw(self, event):
+        # every full draw (redraws, zooming, window resizes) refreshes the cached background
+        if self.blit:
+            self._background = self.canvas.copy_from_bbox(self.ax.bbox)
+            self.ax.draw_artist(self.wave)
+        self._dirty = self._wave_dirty = False
+
+    def save(self, path):
+        # savefig leaves animated artists out, the background is cached again afterwards
+        self.wave.set_animated(False)
+        try:
+            self.ax.figure.savefig(path)
+        finally:
+            self.wave.set_animated(self.blit)
+            self._dirty = True
+
+
+def decimate_step(x, y, xmin, xmax, width_px):
+    # the part of a step line inside [xmin, xmax] with at most a few points per pixel
+    # column: where a column holds more edges than it can show, its first, lowest,
+    # highest and last level are drawn as one vertical bar
+    lo = max(int(np.searchsorted(x, xmin, side='right')) - 1, 0)
+    hi = min(int(np.searchsorted(x, xmax, side='left')) + 1, len(x))
+    x, y = x[lo:hi], y[lo:hi]
+    if len(x) <= 4 * width_px:
+        return x, y
+
+    columns = ((x - xmin) * (width_px / (xmax - xmin))).astype(np.int64)
+    starts = np.flatnonzero(np.concatenate(([True], columns[1:] != columns[:-1])))
+    ends = np.append(starts[1:], len(x)) - 1
+
+    out_x = np.repeat(x[starts], 4)
+    out_y = np.stack((y[starts], np.minimum.reduceat(y, starts), np.maximum.reduceat(y, starts), y[ends]), 1)
+    return out_x, out_y.ravel()
+
+
+def export_figure(renderer, path, xlim, figsize=(16, 5)):
+    # saves what a renderer shows through an offscreen matplotlib figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=figsize, layout='tight')
+    FigureCanvasAgg(figure)
+    export = MatplotlibRenderer(figure.add_subplot(), renderer.text_styles, renderer.bit_style, renderer.bit_width)
+    export.load(renderer)
+    export.show_extent(*xlim)
+    export.save(path)
@@ -0,0 +1,61 @@
+import threading
+import time
+
+import numpy as np
+
+from capture import CaptureFile
+from perf import timed
+
+MAX_READ_RECORDS = 1 << 17
+
+
+class ReplaySource:
+    # plays a saved capture back through the same read_data()/disconnect() interface as
+    # SerialReader. realtime keeps the original spacing between chunks (scaled by speed),
+    # otherwise every call hands out as much as max_records allows
+    def __init__(self, path, realtime=False, speed=1.0, max_records=MAX_READ_RECORDS):
+        self.capture = CaptureFile(path)
+        self.realtime = realtime
+        self.speed = speed
+        self.max_records = max_records
+
+        index = self.capture.index
+        self._offsets = (index['host_time'] - index['host_time'][0]) if len(index) else index['host_time']
+        self._ends = index['record'].astype(np.int64) + index['count']
+        self._entry = 0
+        self._started = None
+        self._stop = threading.Event()
+        self.bytes_read = 0
+
+    @property
+    def finished(self):
+        return self._entry >= len(self.capture.index)
+
+    @timed('read')
+    def read_data(self):
+        if self._stop.is_set() or self.finished:
+            self._stop.set()
+            return b''
+
+        if self._started is None:
+            self._started = time.perf_counter()
+
+        first = int(self.capture.index['record'][self._entry])
+        if self.realtime:
+            elapsed = (time.perf_counter() - self._started) * self.speed
+            last = int(np.searchsorted(self._offsets, elapsed, side='right'))
+            if last <= self._entry:
+                return b''
+        else:
+            # always make progress, one entry may hold more than max_records
+            last = max(int(np.searchsorted(self._ends, first + self.max_records, side='right')), self._entry + 1)
+
+        stop = int(self._ends[last - 1])
+        self._entry = last
+        data = self.capture.raw_bytes(first, stop)
+        self.bytes_read += len(data)
+        return data
+
+    def disconnect(self):
+        self._stop.set()
+        print("Replay stopped.")
@@ -0,0 +1,101 @@
+import threading
+
+DROP_OLDEST = 'drop-oldest'
+BLOCK = 'block'
+
+
+class RingBuffer:
+    def __init__(self, capacity=1 << 20, overflow=DROP_OLDEST):
+        if overflow not in (DROP_OLDEST, BLOCK):
+            raise ValueError(f"unknown overflow policy: {overflow}")
+
+        self.capacity = capacity
+        self.overflow = overflow
+
+        self._buf = bytearray(capacity)
+        self._view = memoryview(self._buf)
+        self._head = 0  # next byte to read
+        self._size = 0
+        self._lock = threading.Lock()
+        self._not_full = threading.Condition(self._lock)
+        self._not_empty = threading.Condition(self._lock)
+        self._closed = False
+
+        self.bytes_written = 0
+        self.bytes_consumed = 0  # read out or dropped
+        self.overrun_bytes = 0
+        self.overruns = 0
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def fill_level(self):
+        return self._size / self.capacity
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._not_full.notify_all()
+            self._not_empty.notify_all()
+
+    def wait(self, timeout=None):
+        # block until there is something to read, returns False on timeout or close
+        with self._lock:
+            if not self._size and not self._closed:
+                self._not_empty.wait(timeout)
+            return self._size > 0
+
+    def write(self, data):
+        data = memoryview(data).cast('B')
+        with self._lock:
+            if self.overflow == BLOCK:
+                written = 0
+                while written < len(data) and not self._closed:
+                    while self._size == self.capacity and not self._closed:
+                        self._not_full.wait(0.1)
+                    written += self._put(data[written:written + self.capacity - self._size])
+                return written
+
+            if len(data) > self.capacity:
+                # only the newest bytes fit
+                dropped = len(data) - self.capacity
+                self.overrun_bytes += dropped
+                data = data[dropped:]
+
+            excess = self._size + len(data) - self.capacity
+            if excess > 0:
+                # make room by dropping the oldest bytes
+                self._head = (self._head + excess) % self.capacity
+                self._size -= excess
+                self.bytes_consumed += excess
+                self.overrun_bytes += excess
+                self.overruns += 1
+
+            return self._put(data)
+
+    def _put(self, data):
+        n = len(data)
+        tail = (self._head + self._size) % self.capacity
+        first = min(n, self.capacity - tail)
+        self._view[tail:tail + first] = data[:first]
+        self._view[:n - first] = data[first:]
+        self._size += n
+        self.bytes_written += n
+        self._not_empty.notify_all()
+        return n
+
+    def readinto(self, target):
+        # copy up to len(target) bytes out of the buffer, returns the count
+        target = memoryview(target).cast('B')
+        with self._lock:
+            n = min(len(target), self._size)
+            first = min(n, self.capacity - self._head)
+            target[:first] = self._view[self._head:self._head + first]
+            target[first:n] = self._view[:n - first]
+
+            self._head = (self._head + n) % self.capacity
+            self._size -= n
+            self.bytes_consumed += n
+            self._not_full.notify_all()
+        return n
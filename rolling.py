@@ -0,0 +1,117 @@
+import numpy as np
+
+from bit_timing import BIT_DURATION, SAMPLE_OFFSET
+from decoder import RECORD_DTYPE, RECORD_SIZE, RecordStream
+
+RAW_LOG_BYTES = 64 << 20
+
+
+class RollingArray:
+    # the newest `capacity` items in a preallocated array of twice that size. items are
+    # appended at the end and slid back to the front only when the end is reached, so the
+    # window is always one contiguous view
+    def __init__(self, capacity, dtype):
+        self.capacity = capacity
+        self._data = np.empty(2 * capacity, dtype=dtype)
+        self._start = 0
+        self._end = 0
+        self.dropped = 0  # items aged out so far, the global index of view()[0]
+
+    def __len__(self):
+        return self._end - self._start
+
+    def view(self):
+        return self._data[self._start:self._end]
+
+    def clear(self):
+        self.dropped += len(self)
+        self._start = self._end = 0
+
+    def drop(self, n):
+        # remove the n oldest items and return a copy of them
+        n = min(n, len(self))
+        aged = self._data[self._start:self._start + n].copy()
+        self._start += n
+        self.dropped += n
+        return aged
+
+    def extend(self, items):
+        # append items, returns a copy of whatever aged out to make room
+        items = np.asarray(items, dtype=self._data.dtype)
+        n = len(items)
+        if n >= self.capacity:
+            aged = np.concatenate((self.view(), items[:n - self.capacity]))
+            self._data[:self.capacity] = items[n - self.capacity:]
+            self._start, self._end = 0, self.capacity
+            self.dropped += len(aged)
+            return aged
+
+        aged = self.drop(max(0, len(self) + n - self.capacity))
+
+        if self._end + n > len(self._data):
+            size = len(self)
+            self._data[:size] = self._data[self._start:self._end]
+            self._start, self._end = 0, size
+
+        self._data[self._end:self._end + n] = items
+        self._end += n
+        return aged
+
+
+class RollingCapture:
+    # raw log of a session bounded by size and optionally by age. records that age out
+    # are written to spill_path in the capture format when it is set
+    def __init__(self, max_bytes=RAW_LOG_BYTES, max_seconds=None, spill_path=None, bit_duration=BIT_DURATION,
+                 offset=SAMPLE_OFFSET):
+        capacity = max(1, max_bytes // RECORD_SIZE)
+        self.max_seconds = max_seconds
+        self.records = RollingArray(capacity, RECORD_DTYPE)
+        self.host_times = RollingArray(capacity, np.float64)
+        self._stream = RecordStream()
+
+        self._spill = None
+        if spill_path:
+            from capture import CaptureWriter
+            self._spill = CaptureWriter(spill_path, bit_duration, offset)
+
+    def __len__(self):
+        return len(self.records)
+
+    def append(self, chunk, host_time):
+        records = self._stream.feed(chunk)
+        if not len(records):
+            return
+
+        aged = self.records.extend(records)
+        aged_times = self.host_times.extend(np.full(len(records), host_time))
+
+        if self.max_seconds is not None:
+            n = int(np.searchsorted(self.host_times.view(), host_time - self.max_seconds))
+            if n:
+                aged = np.concatenate((aged, self.records.drop(n)))
+                aged_times = np.concatenate((aged_times, self.host_times.drop(n)))
+
+        if self._spill is not None and len(aged):
+            for host_time, chunk in self._group(aged, aged_times):
+                self._spill.write(chunk, host_time)
+
+    def clear(self):
+        self.records.clear()
+        self.host_times.clear()
+
+    def _group(self, records, host_times):
+        # consecutive records that arrived together go out as one chunk
+        if not len(records):
+            return
+        bounds = np.concatenate(([0], np.flatnonzero(np.diff(host_times)) + 1, [len(records)]))
+        for a, b in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+            yield float(host_times[a]), records[a:b].tobytes()
+
+    def chunks(self):
+        # (arrival time, raw bytes) of everything still in the window
+        return self._group(self.records.view(), self.host_times.view())
+
+    def close(self):
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
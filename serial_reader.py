@@ -1,45 +1,145 @@
 import serial
 import threading
-import queue
 import time
+from collections import deque
+
+from perf import timed
+from ring_buffer import RingBuffer, DROP_OLDEST
+
+CHUNK_TIME = 0.01  # line time one regular read should cover
+MAX_CHUNK = 1 << 16
+
+
+class SerialReaderError(Exception):
+    pass
 
 
 class SerialReader:
-    def __init__(self, port, baudrate=1152000, chunk_size=1024):
-        self.ser = serial.Serial(port, baudrate, timeout=1)
-        self.chunk_size = chunk_size
-        self._buf = queue.Queue()
+    def __init__(self, port, baudrate=1152000, chunk_size=1024, buffer_size=1 << 20, overflow=DROP_OLDEST,
+                 timeout=0.1, threaded=True):
+        self.ser = serial.Serial(port, baudrate, timeout=timeout)
+        # a serial byte is 10 bits on the wire
+        self.chunk_size = max(chunk_size, int(baudrate / 10 * CHUNK_TIME))
+        self._buf = RingBuffer(buffer_size, overflow)
+        self._out = bytearray(buffer_size)
         self._stop = threading.Event()
+        self.error = None
+
+        # (stream offset after the chunk, arrival time) to measure wire-to-decoder latency
+        self._arrivals = deque(maxlen=4096)
+        self.last_latency = 0.0
+        self.max_latency = 0.0
+        self._latency_sum = 0.0
+        self._latency_count = 0
+
+        # without the thread the owner calls poll() whenever the port is readable
+        self._thr = None
+        if threaded:
+            self._thr = threading.Thread(target=self._loop, daemon=True)
+            self._thr.start()
+
+    @property
+    def fill_level(self):
+        return self._buf.fill_level
+
+    @property
+    def backlog(self):
+        return len(self._buf)
+
+    @property
+    def overrun_bytes(self):
+        return self._buf.overrun_bytes
+
+    @property
+    def mean_latency(self):
+        return self._latency_sum / self._latency_count if self._latency_count else 0.0
 
-        self._thr = threading.Thread(target=self._loop, daemon=True)
-        self._thr.start()
+    def reset_latency(self):
+        self.max_latency = 0.0
+        self._latency_sum = 0.0
+        self._latency_count = 0
+
+    def _read_size(self, waiting):
+        # drain a backlog in one big read, otherwise block for a chunk of about CHUNK_TIME
+        # of line time, cut short by the port timeout when the line is quiet
+        if waiting > self.chunk_size:
+            return min(waiting, MAX_CHUNK, self._buf.capacity)
+        return min(self.chunk_size, MAX_CHUNK, self._buf.capacity)
+
+    def fileno(self):
+        return self.ser.fileno()
+
+    def _read_chunk(self, size):
+        data = self.ser.read(size)
+        if data:
+            arrival = time.perf_counter()
+            self._buf.write(data)
+            self._arrivals.append((self._buf.bytes_written, arrival))
+        return len(data)
 
     def _loop(self):
         while not self._stop.is_set():
             try:
-                if self.ser.in_waiting:
-                    data = self.ser.read(self.chunk_size)
-                    if data:
-                        self._buf.put(data)
-                else:
-                    time.sleep(0.01)
+                self._read_chunk(self._read_size(self.ser.in_waiting))
             except Exception as e:
-                print(f"[SerialReader] read error: {e}")
+                if not self._stop.is_set():
+                    print(f"[SerialReader] read error: {e}")
+                    self.error = e
                 break
 
+    def poll(self):
+        # move whatever the port already has into the buffer without blocking
+        try:
+            waiting = self.ser.in_waiting
+            return self._read_chunk(min(waiting, MAX_CHUNK, self._buf.capacity)) if waiting else 0
+        except Exception as e:
+            self.error = e
+            raise SerialReaderError(f"serial read failed: {e}") from e
+
+    def wait(self, timeout=None):
+        return self._buf.wait(timeout)
+
+    @timed('read')
     def read_data(self):
-        out = b''
-        while not self._buf.empty():
-            out += self._buf.get_nowait()
-        return out
+        # the returned view is only valid until the next call
+        n = self.readinto(self._out)
+        return memoryview(self._out)[:n]
+
+    def readinto(self, target):
+        # once the port has failed and the backlog is drained the error is raised here
+        start = self._buf.bytes_consumed
+        n = self._buf.readinto(target)
+        if n:
+            self._track_latency(start, start + n)
+        elif self.error is not None:
+            raise SerialReaderError(f"serial read failed: {self.error}") from self.error
+        return n
+
+    def _track_latency(self, start, end):
+        arrivals = self._arrivals
+        while arrivals and arrivals[0][0] <= start:
+            arrivals.popleft()
+        if not arrivals:
+            return
+
+        # age of the oldest byte handed out
+        latency = time.perf_counter() - arrivals[0][1]
+        self.last_latency = latency
+        self.max_latency = max(self.max_latency, latency)
+        self._latency_sum += latency
+        self._latency_count += 1
+
+        while arrivals and arrivals[0][0] <= end:
+            arrivals.popleft()
 
     def disconnect(self):
         self._stop.set()
+        self._buf.close()
         if self.ser and self.ser.is_open:
             try:
                 self.ser.close()
                 print("Serial port disconnected.")
             except Exception as e:
                 print(f"Error closing port: {e}")
-        if self._thr.is_alive():
+        if self._thr is not None and self._thr.is_alive():
             self._thr.join(timeout=1)
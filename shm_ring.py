@@ -0,0 +1,68 @@
+import struct
+from multiprocessing import shared_memory
+
+# block: header, then `slots` slots of slot header + payload
+HEADER = struct.Struct('<QII')     # newest sequence number, slot count, payload size per slot
+SLOT_HEADER = struct.Struct('<QI')  # slot sequence, payload length
+
+
+class SnapshotRing:
+    # single writer, any number of readers in other processes. message n goes to slot
+    # n % slots; the slot sequence is odd while it is written and 2 * n once it is
+    # complete, so a reader can tell a torn copy and tries again with the newest message
+    def __init__(self, name=None, slots=4, slot_size=1 << 22):
+        if name is None:
+            self._shm = shared_memory.SharedMemory(create=True, size=HEADER.size + slots * (SLOT_HEADER.size + slot_size))
+            HEADER.pack_into(self._shm.buf, 0, 0, slots, slot_size)
+            self.owner = True
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+
+        self.name = self._shm.name
+        _, self.slots, self.slot_size = HEADER.unpack_from(self._shm.buf, 0)
+        self.seq = 0  # last message written by this side
+
+    def _slot(self, seq):
+        return HEADER.size + (seq % self.slots) * (SLOT_HEADER.size + self.slot_size)
+
+    @property
+    def latest_seq(self):
+        return HEADER.unpack_from(self._shm.buf, 0)[0]
+
+    def write(self, payload):
+        # publish one message, returns its sequence number
+        if len(payload) > self.slot_size:
+            raise ValueError(f"message of {len(payload)} bytes does not fit a {self.slot_size} byte slot")
+
+        seq = self.seq + 1
+        buf = self._shm.buf
+        pos = self._slot(seq)
+        SLOT_HEADER.pack_into(buf, pos, 2 * seq - 1, len(payload))
+        buf[pos + SLOT_HEADER.size:pos + SLOT_HEADER.size + len(payload)] = payload
+        SLOT_HEADER.pack_into(buf, pos, 2 * seq, len(payload))
+        HEADER.pack_into(buf, 0, seq, self.slots, self.slot_size)
+        self.seq = seq
+        return seq
+
+    def read_latest(self, after=0, retries=8):
+        # (seq, payload) of the newest message if it is newer than `after`, else (after, None)
+        buf = self._shm.buf
+        for _ in range(retries):
+            seq = self.latest_seq
+            if seq <= after:
+                return after, None
+
+            pos = self._slot(seq)
+            slot_seq, length = SLOT_HEADER.unpack_from(buf, pos)
+            if slot_seq != 2 * seq:
+                continue
+            payload = bytes(buf[pos + SLOT_HEADER.size:pos + SLOT_HEADER.size + length])
+            if SLOT_HEADER.unpack_from(buf, pos)[0] == slot_seq:
+                return seq, payload
+        return after, None
+
+    def close(self):
+        self._shm.close()
+        if self.owner:
+            self._shm.unlink()
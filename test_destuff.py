@@ -0,0 +1,101 @@
+import random
+
+import numpy as np
+
+from decoder import destuff_bits
+
+
+def remove_stuff_bits(bitstream):
+    # the per-bit loop destuff_bits replaced, kept as the reference
+    un_stf_bits = [bitstream[0]]
+    stf_bit_pos = []
+
+    last_bit = bitstream[0]
+    cnt = 1
+    bit_cnt = 0
+
+    for bit in bitstream[1:]:
+        bit_cnt += 1
+        if bit == last_bit:
+            cnt += 1
+            un_stf_bits.append(bit)
+        else:
+            if cnt == 5:
+                cnt = 1
+                # add stuff bit position to list
+                stf_bit_pos.append(bit_cnt)
+            else:
+                cnt = 1
+                un_stf_bits.append(bit)
+
+        last_bit = bit
+
+    return un_stf_bits, stf_bit_pos
+
+
+def random_bits(rng, n):
+    # runs of one to nine equal bits, so runs of exactly five and of six or more are common
+    bits = []
+    level = rng.randrange(2)
+    while len(bits) < n:
+        bits += [level] * rng.choice((1, 1, 2, 3, 4, 5, 5, 5, 6, 7, 9))
+        level = 1 - level
+    return bits[:n]
+
+
+def destuff_chunks(bits, cuts):
+    # destuff_bits fed the bits in pieces, the run carried from one to the next
+    unstuffed, stuff_pos = [], []
+    last_bit, run_len = None, 0
+    for start, stop in zip([0] + cuts, cuts + [len(bits)]):
+        out, pos, last_bit, run_len = destuff_bits(bits[start:stop], last_bit, run_len)
+        unstuffed += out.tolist()
+        stuff_pos += (pos + start).tolist()
+    return unstuffed, stuff_pos
+
+
+def test_runs_of_five_and_six():
+    # a bit after exactly five equal bits is a stuff bit, after six or more it isn't
+    for bits in ([0] * 5 + [1] * 3, [1] * 5 + [0] + [0] * 4 + [1], [0] * 6 + [1] * 2, [1] * 9 + [0] * 5 + [1],
+                 [0, 1] * 4 + [1] * 5 + [0] * 6 + [1]):
+        unstuffed, stuff_pos, _, _ = destuff_bits(bits)
+        assert (unstuffed.tolist(), stuff_pos.tolist()) == remove_stuff_bits(bits)
+
+
+def test_whole_stream():
+    rng = random.Random(3)
+    for _ in range(300):
+        bits = random_bits(rng, rng.randrange(1, 400))
+        unstuffed, stuff_pos, _, _ = destuff_bits(bits)
+        assert (unstuffed.tolist(), stuff_pos.tolist()) == remove_stuff_bits(bits)
+
+
+def test_chunked_stream():
+    rng = random.Random(4)
+    for _ in range(300):
+        bits = random_bits(rng, rng.randrange(1, 400))
+        cuts = sorted(rng.sample(range(1, len(bits) + 1), min(len(bits), rng.randrange(1, 20))))
+        assert destuff_chunks(bits, cuts) == remove_stuff_bits(bits)
+
+
+def test_single_bit_chunks():
+    rng = random.Random(5)
+    bits = random_bits(rng, 500)
+    assert destuff_chunks(bits, list(range(1, len(bits)))) == remove_stuff_bits(bits)
+
+
+def test_resets():
+    # every capture is destuffed on its own, as if no bits came before it
+    rng = random.Random(6)
+    for _ in range(100):
+        captures = [random_bits(rng, rng.randrange(1, 60)) for _ in range(rng.randrange(1, 6))]
+        bits = sum(captures, [])
+        resets = np.cumsum([len(capture) for capture in captures])[:-1]
+        unstuffed, stuff_pos, _, _ = destuff_bits(bits, resets=resets)
+
+        expected, expected_pos = [], []
+        for start, capture in zip([0] + resets.tolist(), captures):
+            out, pos = remove_stuff_bits(capture)
+            expected += out
+            expected_pos += [start + p for p in pos]
+        assert (unstuffed.tolist(), stuff_pos.tolist()) == (expected, expected_pos)
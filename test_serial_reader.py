@@ -0,0 +1,29 @@
+from serial_reader import MAX_CHUNK, SerialReader
+
+
+def reader(baudrate, **kwargs):
+    # no port is opened for port None, only the read sizes are looked at
+    return SerialReader(None, baudrate, threaded=False, **kwargs)
+
+
+def test_quiet_line_reads_follow_the_baud_rate():
+    # a blocking read covers about 10 ms of line time, never less than chunk_size
+    assert reader(1152000)._read_size(0) == 1152
+    assert reader(4000000)._read_size(0) == 4000
+    assert reader(115200)._read_size(0) == 1024
+    assert reader(115200, chunk_size=64)._read_size(0) == 115
+    assert reader(1152000)._read_size(100) == 1152
+
+
+def test_backlog_is_read_at_once():
+    r = reader(1152000)
+    assert r._read_size(1153) == 1153
+    assert r._read_size(50000) == 50000
+    assert r._read_size(10 * MAX_CHUNK) == MAX_CHUNK
+
+
+def test_reads_fit_the_buffer():
+    r = reader(1152000, buffer_size=4096)
+    assert r._read_size(0) == 1152
+    assert r._read_size(100000) == 4096
+    assert reader(4000000, buffer_size=2048)._read_size(0) == 2048
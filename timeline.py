@@ -0,0 +1,203 @@
+import bisect
+
+import numpy as np
+
+CHUNK_SIZE = 1 << 16
+TICK_WRAP = 1 << 32
+MAX_WRAP_GAP = 1 << 30  # the longest step a wrap of the tick counter is taken for, about 107 s
+
+
+class ChunkedArray:
+    # an append only array stored as fixed size chunks, growing never copies what is already
+    # there. with max_items the oldest chunks are dropped, indexes stay global like
+    # RollingArray's and start at `dropped`
+    def __init__(self, dtype, chunk_size=CHUNK_SIZE, max_items=None):
+        self.dtype = np.dtype(dtype)
+        self.chunk_size = chunk_size
+        self.max_chunks = None if max_items is None else max(2, -(-max_items // chunk_size))
+        self._chunks = []
+        self._firsts = []  # first item of every chunk, to search sorted data
+        self._fill = chunk_size  # items in the last chunk
+        self.dropped = 0
+
+    def __len__(self):
+        if not self._chunks:
+            return self.dropped
+        return self.dropped + (len(self._chunks) - 1) * self.chunk_size + self._fill
+
+    @property
+    def nbytes(self):
+        return len(self._chunks) * self.chunk_size * self.dtype.itemsize
+
+    def extend(self, items):
+        items = np.asarray(items, dtype=self.dtype)
+        pos = 0
+        while pos < len(items):
+            if self._fill == self.chunk_size:
+                self._chunks.append(np.empty(self.chunk_size, dtype=self.dtype))
+                self._firsts.append(items[pos].item())
+                self._fill = 0
+            n = min(len(items) - pos, self.chunk_size - self._fill)
+            self._chunks[-1][self._fill:self._fill + n] = items[pos:pos + n]
+            self._fill += n
+            pos += n
+
+        if self.max_chunks is not None and len(self._chunks) > self.max_chunks:
+            drop = len(self._chunks) - self.max_chunks
+            del self._chunks[:drop]
+            del self._firsts[:drop]
+            self.dropped += drop * self.chunk_size
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                raise ValueError("ChunkedArray slices can't have a step")
+            return self.take(start, stop)
+
+        if index < 0:
+            index += len(self)
+        if not self.dropped <= index < len(self):
+            raise IndexError("ChunkedArray index out of range")
+        c, i = divmod(index - self.dropped, self.chunk_size)
+        return self._chunks[c][i]
+
+    def take(self, start, stop):
+        # a copy of the items [start, stop), what was dropped is left out
+        start = max(start, self.dropped)
+        out = np.empty(max(0, stop - start), dtype=self.dtype)
+        pos = 0
+        while start < stop:
+            c, i = divmod(start - self.dropped, self.chunk_size)
+            n = min(stop - start, self.chunk_size - i)
+            out[pos:pos + n] = self._chunks[c][i:i + n]
+            pos += n
+            start += n
+        return out
+
+    def searchsorted(self, value, side='left'):
+        # global index value would be inserted at in sorted data, a search of the chunk
+        # firsts and then of one chunk
+        if not self._chunks:
+            return self.dropped
+        find = bisect.bisect_left if side == 'left' else bisect.bisect_right
+        c = find(self._firsts, value) - 1
+        if c < 0:
+            return self.dropped
+        size = self._fill if c == len(self._chunks) - 1 else self.chunk_size
+        return self.dropped + c * self.chunk_size + int(np.searchsorted(self._chunks[c][:size], value, side))
+
+
+class ArrayBuffer:
+    # one contiguous array appended to at the end and cut at the front, view() is the items
+    # in it. the storage is allocated up front and the items are slid back to the front
+    # only when the end is reached, it grows to twice the size when half of it is in use
+    def __init__(self, dtype, capacity=CHUNK_SIZE):
+        self._data = np.empty(capacity, dtype=dtype)
+        self._start = 0
+        self._end = 0
+
+    def __len__(self):
+        return self._end - self._start
+
+    def view(self):
+        return self._data[self._start:self._end]
+
+    def clear(self):
+        self._start = self._end = 0
+
+    def drop(self, n):
+        # remove the n oldest items
+        self._start += min(n, len(self))
+
+    def extend(self, items):
+        n = len(items)
+        if self._end + n > len(self._data):
+            size = len(self)
+            data = self._data
+            if 2 * (size + n) > len(data):
+                data = np.empty(max(2 * len(data), 2 * (size + n)), dtype=data.dtype)
+            data[:size] = self._data[self._start:self._end]
+            self._data = data
+            self._start, self._end = 0, size
+        self._data[self._end:self._end + n] = items
+        self._end += n
+
+
+class TickCounter:
+    # extends the 32 bit tick counter of the analyzer to a 64 bit timeline. a step back that
+    # is a short step forward modulo 2^32 is the counter wrapping, anything else is the
+    # analyzer starting over and its new run is put right after the last tick
+    def __init__(self, max_gap=MAX_WRAP_GAP):
+        self.max_gap = max_gap
+        self.base = 0
+        self.last = None  # last raw tick
+        self.wraps = 0
+        self.resets = 0
+
+    def extend(self, ticks):
+        # returns the timeline ticks and the positions the analyzer was reset at
+        ticks = np.asarray(ticks, dtype=np.int64)
+        if not len(ticks):
+            return ticks, np.empty(0, dtype=np.intp)
+
+        prev = np.empty_like(ticks)
+        prev[0] = ticks[0] if self.last is None else self.last
+        prev[1:] = ticks[:-1]
+        back = np.flatnonzero(ticks < prev)
+        wrap = (ticks[back] - prev[back]) % TICK_WRAP <= self.max_gap
+
+        steps = np.zeros(len(ticks), dtype=np.int64)
+        steps[back] = np.where(wrap, TICK_WRAP, prev[back])
+        extended = ticks + self.base + np.cumsum(steps)
+
+        self.base = int(extended[-1] - ticks[-1])
+        self.last = int(ticks[-1])
+        self.wraps += int(wrap.sum())
+        self.resets += int(len(wrap) - wrap.sum())
+        return extended, back[~wrap]
+
+
+class Timeline:
+    # every edge of a continuous capture, 8 bytes each. kept levels always alternate, so the
+    # level of an edge follows from its index and only the times are stored
+    def __init__(self, chunk_size=CHUNK_SIZE, max_edges=None):
+        self.times = ChunkedArray(np.int64, chunk_size, max_edges)
+        self.first_level = None
+        self.resets = []  # timeline ticks the analyzer started over at
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def start(self):
+        return int(self.times[self.times.dropped]) if len(self.times) > self.times.dropped else None
+
+    @property
+    def end(self):
+        return int(self.times[-1]) if len(self.times) > self.times.dropped else None
+
+    def append(self, states, times):
+        if not len(states):
+            return
+        if self.first_level is None:
+            self.first_level = int(states[0])
+        self.times.extend(times)
+
+    def levels(self, start, stop):
+        # bus level after each edge [start, stop)
+        start = max(start, self.times.dropped)
+        return ((self.first_level + np.arange(start, max(start, stop))) & 1).astype(np.uint8)
+
+    def between(self, t0, t1):
+        # (levels, times) of the edges at t0 <= t < t1
+        start = self.times.searchsorted(t0)
+        stop = self.times.searchsorted(t1)
+        return self.levels(start, stop), self.times.take(start, stop)
+
+    def level_at(self, t):
+        # bus level at tick t, None before the first edge kept
+        i = self.times.searchsorted(t, 'right') - 1
+        if i < self.times.dropped:
+            return None
+        return (self.first_level + i) & 1
@@ -0,0 +1,174 @@
+import argparse
+import random
+import struct
+
+import numpy as np
+
+from bit_timing import BIT_DURATION, TICK_RATE, timing_for
+from can_frame import crc15
+from decoder import TIMESTAMP_LIMIT
+
+RECORD = struct.Struct('<BBBBI')
+TRAILER_BITS = [1, 0, 1] + [1] * 7 + [1] * 3  # CRC delimiter, ACK, ACK delimiter, EOF, IFS
+TICK_WRAP = 1 << 32
+WINDOW_LEAD = 8  # idle bits before the first frame of a capture window
+
+# the most stuff bits found for a standard and an extended frame with eight data bytes
+WORST_CASE_FRAMES = ((0x7F0, False), ((0x7C1 << 18) | 0x33FBE, True))
+WORST_CASE_BYTE = 0x3C
+
+
+def int_bits(value, length):
+    return [(value >> (length - 1 - i)) & 1 for i in range(length)]
+
+
+def stuff(bits):
+    # a bit of the other level after every five equal bits, the stuff bit starts the next run
+    out = []
+    last = None
+    run = 0
+    for bit in bits:
+        out.append(bit)
+        run = run + 1 if bit == last else 1
+        last = bit
+        if run == 5:
+            out.append(1 - bit)
+            last = 1 - bit
+            run = 1
+    return out
+
+
+def frame_bits(can_id, data=b'', extended=False, rtr=False, dlc=None, stuffed=True):
+    # bus levels of a frame from SOF to the end of IFS, as a receiver acknowledges it
+    dlc = len(data) if dlc is None else dlc
+    if extended:
+        bits = [0] + int_bits(can_id >> 18, 11) + [1, 1] + int_bits(can_id & 0x3FFFF, 18) + [int(rtr), 0, 0]
+    else:
+        bits = [0] + int_bits(can_id, 11) + [int(rtr), 0, 0]
+    bits += int_bits(dlc, 4)
+    if not rtr:
+        for byte in data[:8]:
+            bits += int_bits(byte, 8)
+    bits += int_bits(crc15(bits), 15)
+    return (stuff(bits) if stuffed else bits) + TRAILER_BITS
+
+
+class TrafficGenerator:
+    # analyzer records of random CAN traffic. frames are packed into capture windows the way
+    # the analyzer delivers them, bus_load sets the idle time between frames
+    def __init__(self, bus_load=0.5, seed=None, extended=0.3, remote=0.1, worst_case=0.05,
+                 bit_duration=BIT_DURATION):
+        self.bus_load = bus_load
+        self.extended = extended
+        self.remote = remote
+        self.worst_case = worst_case
+        self.bit_duration = bit_duration
+        self.rng = random.Random(seed)
+
+        self.windows = 0
+        self.bus_bits = 0  # bus time covered so far, frames and idle
+
+    def random_frame(self):
+        # (can_id, extended, rtr, dlc, data)
+        rng = self.rng
+        if rng.random() < self.worst_case:
+            can_id, extended = rng.choice(WORST_CASE_FRAMES)
+            return can_id, extended, False, 8, bytes([WORST_CASE_BYTE] * 8)
+
+        extended = rng.random() < self.extended
+        can_id = rng.getrandbits(29 if extended else 11)
+        dlc = rng.randrange(9)
+        if rng.random() < self.remote:
+            return can_id, extended, True, dlc, b''
+        return can_id, extended, False, dlc, bytes(rng.getrandbits(8) for _ in range(dlc))
+
+    def frames(self, count):
+        return [self.random_frame() for _ in range(count)]
+
+    def idle_bits(self, frame_length):
+        # idle after a frame so the bus is busy bus_load of the time
+        return int(round(frame_length * (1 / self.bus_load - 1))) if self.bus_load < 1 else 0
+
+    def windows_of(self, frames):
+        # bus levels of every capture window, each window ends with its last edge inside the
+        # timestamp limit of the analyzer
+        limit_bits = TIMESTAMP_LIMIT // self.bit_duration
+        levels = [1] * WINDOW_LEAD
+        idle = WINDOW_LEAD
+        for can_id, extended, rtr, dlc, data in frames:
+            bits = frame_bits(can_id, data, extended, rtr, dlc)
+            last_edge = len(bits) - TRAILER_BITS[::-1].index(0)
+            if len(levels) + last_edge > limit_bits and len(levels) > idle:
+                yield levels
+                idle = max(1, min(idle, WINDOW_LEAD))
+                levels = [1] * idle
+
+            levels += bits
+            idle = self.idle_bits(len(bits))
+            levels += [1] * idle
+            self.bus_bits += len(bits) + idle
+        if len(levels) > idle:
+            yield levels
+
+    def bus_levels(self, frames):
+        # bus levels of all frames on one timeline, for a continuous capture
+        levels = [1] * WINDOW_LEAD
+        for can_id, extended, rtr, dlc, data in frames:
+            bits = frame_bits(can_id, data, extended, rtr, dlc)
+            idle = self.idle_bits(len(bits))
+            levels += bits + [1] * idle
+            self.bus_bits += len(bits) + idle
+        return levels
+
+    def stream(self, frames, continuous=False, start_tick=0):
+        # analyzer bytes for the frames: one 11 <state> 01 00 <timestamp> record per edge.
+        # timestamps start over in every window, a continuous capture runs on from
+        # start_tick and wraps at 2^32
+        out = bytearray()
+        for levels in [self.bus_levels(frames)] if continuous else self.windows_of(frames):
+            levels = np.asarray(levels, dtype=np.int8)
+            edges = np.flatnonzero(np.diff(levels)) + 1
+            ticks = (start_tick + np.round(edges * self.bit_duration).astype(np.int64)) % TICK_WRAP
+            for tick, state in zip(ticks.tolist(), levels[edges].tolist()):
+                out += RECORD.pack(0x11, state, 0x01, 0, tick)
+            self.windows += 1
+        return bytes(out)
+
+    def seconds(self):
+        return self.bus_bits * self.bit_duration / TICK_RATE
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write synthetic analyzer traffic")
+    parser.add_argument('output', help="raw analyzer bytes, or a .cancap capture")
+    parser.add_argument('--frames', type=int, default=10000)
+    parser.add_argument('--load', type=float, default=0.5, help="bus load between 0 and 1")
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--extended', type=float, default=0.3, help="share of extended frames")
+    parser.add_argument('--remote', type=float, default=0.1, help="share of remote frames")
+    parser.add_argument('--worst-case', type=float, default=0.05, help="share of frames with the most stuff bits")
+    parser.add_argument('--bit-rate', type=int, default=500_000, help="CAN bit rate")
+    parser.add_argument('--continuous', action='store_true',
+                        help="one capture with a running tick counter instead of capture windows")
+    parser.add_argument('--start-tick', type=int, default=0, help="first tick of a continuous capture")
+    args = parser.parse_args(argv)
+
+    bit_duration, offset = timing_for(args.bit_rate)
+    generator = TrafficGenerator(args.load, args.seed, args.extended, args.remote, args.worst_case, bit_duration)
+    data = generator.stream(generator.frames(args.frames), args.continuous, args.start_tick)
+
+    if args.output.endswith('.cancap'):
+        from capture import CaptureWriter
+
+        writer = CaptureWriter(args.output, bit_duration, offset)
+        writer.write(data)
+        writer.close()
+    else:
+        with open(args.output, 'wb') as f:
+            f.write(data)
+    print(f"{args.frames} frames in {generator.windows} windows, {len(data)} bytes, "
+          f"{generator.seconds():.3f} s of bus time")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,392 @@
+import bisect
+import time
+
+import numpy as np
+
+from bit_timing import TICK_RATE
+from can_frame import IDE_OFFSET, STANDARD_RTR_OFFSET, EXTENDED_RTR_OFFSET
+from decoder import RecordStream, TIMESTAMP_LIMIT, destuff_bits
+from perf import timed
+from timeline import TickCounter
+
+PRE_TICKS = TICK_RATE // 1000  # decoded before a trigger, 1 ms
+POST_TICKS = 5 * TICK_RATE // 1000  # and after it
+IDLE_BITS = 10  # recessive bits before a frame start, EOF and intermission
+EOF_BITS = 7  # a frame is over once a recessive run this long follows its start
+ERROR_FLAG_BITS = 6  # dominant bits no frame has, an error flag
+SCAN_BITS = 140  # wire bits from SOF to past the last data byte, stuff bits included
+HEADER_BITS = 39 + 64  # destuffed bits from SOF to the end of the data field
+ALL_IDS = 0x1FFFFFFF
+
+
+class FrameMatch:
+    # a frame whose ID matches can_id where mask is set and whose first data bytes match
+    # data where data_mask is set
+    def __init__(self, can_id=None, mask=ALL_IDS, data=b'', data_mask=None):
+        self.can_id = can_id
+        self.mask = mask
+        self.data = bytes(data)
+        self.data_mask = bytes(data_mask) if data_mask is not None else b'\xff' * len(self.data)
+
+    def matches(self, can_id, data, n_data):
+        # which of the frames with these IDs, data byte rows and data lengths match
+        found = np.ones(len(can_id), dtype=bool)
+        if self.can_id is not None:
+            found &= (can_id ^ self.can_id) & self.mask == 0
+        for i, (want, mask) in enumerate(zip(self.data, self.data_mask)):
+            if mask:
+                found &= (n_data > i) & ((data[:, i] ^ want) & mask == 0)
+        return found
+
+    def __str__(self):
+        parts = []
+        if self.can_id is not None:
+            parts.append(f"id=0x{self.can_id:X}" + (f"/0x{self.mask:X}" if self.mask != ALL_IDS else ""))
+        if self.data:
+            parts.append("data=" + ''.join(f"{b:02x}" if m else "??" for b, m in zip(self.data, self.data_mask)))
+        return ','.join(parts) or "any frame"
+
+
+class ErrorFrame:
+    # an error flag on the bus
+    def __str__(self):
+        return "error"
+
+
+class IdleTimeout:
+    # the bus recessive for this many ticks
+    def __init__(self, ticks):
+        self.ticks = ticks
+
+    def __str__(self):
+        return f"idle={self.ticks / TICK_RATE:g}"
+
+
+def parse_condition(text):
+    # 'error', 'idle=SECONDS' or 'id=0x650[/MASK]' and 'data=01??ff' with ?? for any byte,
+    # both comma separated for a frame that has to match both
+    text = text.strip()
+    if text == 'error':
+        return ErrorFrame()
+    if text.startswith('idle='):
+        return IdleTimeout(round(float(text[5:]) * TICK_RATE))
+
+    match = FrameMatch()
+    for part in text.split(','):
+        key, _, value = part.partition('=')
+        key, value = key.strip(), value.strip()
+        if key == 'id':
+            can_id, _, mask = value.partition('/')
+            match.can_id = int(can_id, 0)
+            match.mask = int(mask, 0) if mask else ALL_IDS
+        elif key == 'data' and value and len(value) % 2 == 0:
+            pairs = [value[i:i + 2] for i in range(0, len(value), 2)]
+            match.data = bytes(0 if pair == '??' else int(pair, 16) for pair in pairs)
+            match.data_mask = bytes(0 if pair == '??' else 0xFF for pair in pairs)
+        else:
+            raise ValueError(f"not a trigger condition: {part!r}")
+    return match
+
+
+def field(bits, start, length):
+    # big endian value of bits [start, start + length) of every row
+    return bits[:, start:start + length].astype(np.int64) @ (1 << np.arange(length - 1, -1, -1))
+
+
+def frame_headers(level, bits, starts):
+    # (can_id, data bytes, data length) of the frames starting at the levels in starts, from
+    # levels of the given bit counts. all frames are destuffed as one bitstream, stuffing
+    # starts over at every frame
+    wire = np.repeat(level.astype(np.uint8), bits)
+    sof = np.cumsum(bits)[starts] - bits[starts]
+    unstuffed, stuff_pos, _, _ = destuff_bits(wire, resets=sof)
+    sof -= np.searchsorted(stuff_pos, sof)
+    unstuffed = np.concatenate((unstuffed, np.ones(HEADER_BITS, dtype=np.uint8)))
+    header = unstuffed[sof[:, None] + np.arange(HEADER_BITS)]
+
+    extended = header[:, IDE_OFFSET] == 1
+    can_id = np.where(extended, (field(header, 1, 11) << 18) | field(header, 14, 18), field(header, 1, 11))
+    rtr = np.where(extended, header[:, EXTENDED_RTR_OFFSET], header[:, STANDARD_RTR_OFFSET]) == 1
+    dlc_offset = np.where(extended, 35, 15)
+    rows = np.arange(len(starts))[:, None]
+    dlc = header[rows, dlc_offset[:, None] + np.arange(4)] @ (1 << np.arange(3, -1, -1))
+    data = header[rows, dlc_offset[:, None] + 4 + np.arange(64)].reshape(-1, 8, 8) @ (1 << np.arange(7, -1, -1))
+    return can_id, data, np.where(rtr, 0, np.minimum(dlc, 8))
+
+
+class HeaderScan:
+    # finds frame starts, error flags and idle gaps in raw records and reads only the ID and
+    # data bytes of a frame, none of the bit lists, stuff positions and timestamps the full
+    # decoder keeps. the records since the start of the last frame not yet over are carried
+    # to the next scan
+    def __init__(self, bit_duration, offset, continuous=False):
+        self.bit_duration = bit_duration
+        self.offset = offset
+        self.continuous = continuous
+        self.ticks = TickCounter()
+        self._tick_base = 0
+        self._last_raw = None
+
+        # records the full decoder can start at: window starts, or frame starts of a
+        # continuous capture
+        self.start_records = []
+        self.start_ticks = []
+
+        self._carry = None  # (states, ticks, records, boundary) from the first level not done
+        self.carried_from = 0  # first record carried, the ones before are scanned for good
+        self._scanned = -1  # record of the last level looked at for errors and idle
+        self._framed = -1  # record of the last frame start looked at
+        self._last_level = None  # (state, tick, record, host arrival time) of the last level
+        self._idle_fired = {}  # record of the level each idle condition last fired on
+
+    def timeline(self, raw):
+        # capture timeline ticks of the records and where a new window or analyzer run starts
+        if self.continuous:
+            ticks, resets = self.ticks.extend(raw)
+            boundary = np.zeros(len(raw), dtype=bool)
+            boundary[resets] = True
+            return ticks, boundary
+
+        prev = np.empty_like(raw)
+        prev[0] = raw[0] if self._last_raw is None else self._last_raw
+        prev[1:] = raw[:-1]
+        boundary = raw < prev
+        ticks = raw + self._tick_base + np.cumsum(np.where(boundary, prev, 0))
+        self._tick_base = int(ticks[-1] - raw[-1])
+        self._last_raw = int(raw[-1])
+        return ticks, boundary
+
+    @timed('trigger_scan')
+    def scan(self, records, first, conditions, host_time=None):
+        # timeline ticks of the records and the (tick, record, condition) of every condition
+        # met in them or in the records carried. host_time is when live records arrived
+        raw = records['timestamp'].astype(np.int64)
+        ticks, boundary = self.timeline(raw)
+        if first == 0:
+            boundary[0] = True
+        states = records['state'].astype(np.int64)
+        index = first + np.arange(len(raw))
+
+        if not self.continuous:
+            self.start_records += index[boundary].tolist()
+            self.start_ticks += ticks[boundary].tolist()
+
+        # records past a capture window carry no level
+        valid = np.ones(len(raw), dtype=bool) if self.continuous else raw <= TIMESTAMP_LIMIT
+        parts = [states[valid], ticks[valid], index[valid], boundary[valid]]
+        if self._carry is not None:
+            parts = [np.concatenate((carried, part)) for carried, part in zip(self._carry, parts)]
+        states, level_ticks, index, boundary = parts
+        if not len(states):
+            self._carry = None
+            self.carried_from = first + len(raw)
+            return ticks, []
+
+        # a level starts at every change and at every window start
+        edge = boundary.copy()
+        edge[0] = True
+        edge[1:] |= states[1:] != states[:-1]
+        e = np.flatnonzero(edge)
+        level, start, record, cut = states[e], level_ticks[e], index[e], np.append(boundary[e][1:], False)
+
+        # every level but the last one has ended, one cut by a window end has no known length
+        durations = np.diff(start)
+        bits = np.minimum(np.ceil(np.maximum(durations - self.offset, 0) / self.bit_duration), SCAN_BITS)
+        bits = np.append(np.where(cut[:-1], SCAN_BITS, bits), 0).astype(np.int64)
+        closed = np.arange(len(e)) < len(e) - 1
+        if self._last_level is None or self._last_level[2] != int(record[-1]):
+            self._last_level = (int(level[-1]), int(start[-1]), int(record[-1]), host_time)
+
+        events = []
+        new = closed & (record > self._scanned)
+        for condition in conditions:
+            if isinstance(condition, ErrorFrame):
+                flags = np.flatnonzero(new & ~cut & (level == 0) & (bits >= ERROR_FLAG_BITS))
+                events += [(int(start[k]), int(record[k]), condition) for k in flags.tolist()]
+            elif isinstance(condition, IdleTimeout):
+                idle = np.flatnonzero(new[:-1] & ~cut[:-1] & (level[:-1] == 1) & (durations >= condition.ticks))
+                idle = idle[record[idle] != self._idle_fired.get(condition, -1)]
+                events += [(int(start[k]) + condition.ticks, int(record[k]), condition) for k in idle.tolist()]
+        if closed.any():
+            self._scanned = max(self._scanned, int(record[closed][-1]))
+
+        # frame starts: a dominant level after an idle bus or at a window start, over once a
+        # long recessive level follows
+        idle_before = np.zeros(len(e), dtype=bool)
+        idle_before[1:] = (level[:-1] == 1) & ((bits[:-1] >= IDLE_BITS) | cut[:-1])
+        sof = np.flatnonzero((level == 0) & (idle_before | boundary[e]))
+        ends = np.flatnonzero(closed & (level == 1) & ((bits >= EOF_BITS) | cut))
+
+        # a frame is over when a long recessive level follows, or long enough after its start
+        # that the header is in what was scanned
+        following = np.searchsorted(ends, sof, 'right')
+        over = (following < len(ends)) | (len(e) - 1 - sof >= SCAN_BITS)
+        pending = sof[np.argmin(over)] if not over.all() else None
+        done = sof[over & np.cumprod(over).astype(bool) & (record[sof] > self._framed)]
+        if len(done):
+            self._framed = int(record[done[-1]])
+            if self.continuous:
+                self.start_records += record[done].tolist()
+                self.start_ticks += start[done].tolist()
+
+            matches = [condition for condition in conditions if isinstance(condition, FrameMatch)]
+            if matches:
+                can_id, data, n_data = frame_headers(level, bits, done)
+                # a frame triggers once, on the first condition it meets
+                hit = np.zeros(len(done), dtype=bool)
+                for match in matches:
+                    found = ~hit & match.matches(can_id, data, n_data)
+                    events += [(int(start[k]), int(record[k]), match) for k in done[found].tolist()]
+                    hit |= found
+
+        # carried on: the level before a frame not over yet, or the last level whose length
+        # isn't known yet
+        keep = e[-1] if pending is None else e[max(pending - 1, 0)]
+        self._carry = [part[keep:] for part in parts]
+        self.carried_from = int(index[keep])
+        events.sort(key=lambda event: event[0])
+        return ticks, events
+
+    def idle_events(self, now, conditions):
+        # the idle conditions the last level has met by host time now, counted from the
+        # arrival of its edge. a level still going on has no length in the records yet
+        if self._last_level is None or self._last_level[0] != 1 or self._last_level[3] is None:
+            return []
+        _, tick, record, arrived = self._last_level
+        events = []
+        for condition in conditions:
+            if isinstance(condition, IdleTimeout) and self._idle_fired.get(condition) != record and \
+                    now - arrived >= condition.ticks / TICK_RATE:
+                self._idle_fired[condition] = record
+                events.append((tick + condition.ticks, record, condition))
+        return events
+
+
+class TriggerEngine:
+    # decodes a capture in full only from pre ticks before to post ticks after every trigger,
+    # anything else only goes through the header scan and the records held for the pre
+    # trigger window. a trigger inside an open window extends it, a window ends at the first
+    # frame or window start after it. feed() and flush() work like the decoder's.
+    # offline an idle trigger fires once the level after the gap shows up. live input is
+    # stamped with its arrival time and poll() fires it on the host clock
+    def __init__(self, conditions, decoder, pre=PRE_TICKS, post=POST_TICKS, live=False):
+        self.conditions = list(conditions)
+        self.decoder = decoder
+        self.pre = pre
+        self.post = post
+        self.live = live
+        self.scan = HeaderScan(decoder.bit_duration, decoder.offset, decoder.continuous)
+        self.events = []  # (tick, record, condition) of every trigger
+        self.windows = 0
+        self._records = RecordStream()
+        self._seen = 0
+        self._held = []  # (first record, records, ticks) of the chunks a window may start in
+        self._until = None  # tick the open window lasts to, None outside windows
+        self._from = None  # tick the open window decodes from
+        self._next = None  # next record the open window decodes, None before it has started
+        self._closed = 0  # record the last window ended at
+
+    def feed(self, data):
+        records = self._records.feed(data)
+        if not len(records):
+            return self.poll() if self.live else []
+        first = self._seen
+        self._seen += len(records)
+        ticks, events = self.scan.scan(records, first, self.conditions, time.time() if self.live else None)
+        self._held.append((first, records.copy(), ticks))
+        frames = self._trigger(events)
+        self._drop_held()
+        return frames
+
+    def poll(self, now=None):
+        # live input: idle triggers whose timeout has passed since the last edge arrived
+        events = self.scan.idle_events(time.time() if now is None else now, self.conditions)
+        return self._trigger(events) if events else []
+
+    def _trigger(self, events):
+        frames = []
+        for event in events:
+            tick = event[0]
+            if self._until is not None and tick - self.pre > self._until:
+                end = self._end_of(self._until)
+                frames += self._close(end if end is not None else max(event[1], self._next or 0))
+            if self._until is None:
+                self._open(tick - self.pre)
+                self._until = tick + self.post
+            self._until = max(self._until, tick + self.post)
+            self.events.append(event)
+
+        if self._until is not None:
+            end = self._end_of(self._until)
+            frames += self._close(end) if end is not None else self._decode(self.scan.carried_from)
+        return frames
+
+    def flush(self):
+        if self._until is None:
+            return []
+        return self._close(self._seen)
+
+    def _open(self, tick):
+        # a window decodes from tick on, once there is a record to start at
+        self._from = tick
+        self._next = None
+
+    def _begin(self):
+        # start decoding at the last record the decoder can start at before the window, not
+        # before the end of the last one. False while none is known
+        records, ticks = self.scan.start_records, self.scan.start_ticks
+        lo = bisect.bisect_left(records, self._closed)
+        if lo == len(records):
+            return False
+        start = records[max(bisect.bisect_right(ticks, self._from) - 1, lo)]
+
+        self.decoder.restart()
+        self.decoder.start_at(start, *self._base_before(start))
+        self._next = start
+        return True
+
+    def _end_of(self, tick):
+        # first start after tick the window ends at, None if it isn't known yet
+        i = bisect.bisect_right(self.scan.start_ticks, tick)
+        return self.scan.start_records[i] if i < len(self.scan.start_records) else None
+
+    def _close(self, stop):
+        frames = self._decode(stop)
+        if self._next is not None:
+            frames += self.decoder.flush()
+        self._until = None
+        self._closed = stop
+        self.windows += 1
+        return frames
+
+    def _decode(self, stop):
+        if self._next is None and not self._begin():
+            return []
+        frames = []
+        for first, records, ticks in self._held:
+            a, b = max(self._next, first), min(stop, first + len(records))
+            if a < b:
+                frames += self.decoder.feed(records[a - first:b - first].tobytes())
+        self._next = max(self._next, stop)
+        return frames
+
+    def _base_before(self, record):
+        # (tick base, raw tick) of the record before, for the decoder to go on from
+        for first, records, ticks in self._held:
+            if first <= record - 1 < first + len(records):
+                i = record - 1 - first
+                return int(ticks[i]) - int(records['timestamp'][i]), int(records['timestamp'][i])
+        return 0, None
+
+    def _drop_held(self):
+        # records before the start a trigger now would decode from are no longer needed
+        records, ticks = self.scan.start_records, self.scan.start_ticks
+        latest = int(self._held[-1][2][-1])
+        i = max(bisect.bisect_right(ticks, latest - self.pre) - 1, 0)
+        keep = records[i] if records else self.scan.carried_from
+        if self._until is not None:
+            keep = min(keep, self._closed if self._next is None else self._next)
+        del records[:bisect.bisect_left(records, keep)]
+        del ticks[:len(ticks) - len(records)]
+        while len(self._held) > 1 and self._held[0][0] + len(self._held[0][1]) < keep:
+            del self._held[0]